@@ -0,0 +1,207 @@
+"""ASGI entry point for the county data API.
+
+Serve with any ASGI server, e.g. `uvicorn api.asgi:app`. Connections are
+handled on the event loop, so slow or idle clients cost a coroutine rather
+than a worker thread. Once a request body has fully arrived, the Flask app
+(the same routes, validation, cache and error codes as the WSGI entry point)
+runs in a bounded thread pool of ASGI_WORKERS threads, where its SQLite
+lookups happen. Streamed responses are pulled from that pool one chunk at
+a time.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+import asyncio
+import json
+import sys
+
+from api.index import app as flask_app
+
+# Header names are matched case-insensitively; ASGI servers send them lowercased.
+CONTENT_LENGTH_HEADER = b"content-length"
+
+# read_body's result when the client disconnects before its body arrives
+DISCONNECTED = object()
+
+
+class AsgiApp:
+    """Run a WSGI app from ASGI with its blocking work in a bounded executor."""
+
+    def __init__(self, wsgi_app, max_workers, max_body_bytes):
+        self.wsgi_app = wsgi_app
+        self.max_workers = max_workers
+        self.max_body_bytes = max_body_bytes
+        self.executor = ThreadPoolExecutor(max_workers, thread_name_prefix="county-asgi")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            raise ValueError(f"Unsupported ASGI scope type: {scope['type']}")
+
+        body = await self.read_body(scope, receive)
+        # Nobody is left to answer, so don't spend a worker on the request
+        if body is DISCONNECTED:
+            return
+        if body is None:
+            await self.send_error(send, 413, "Request body too large")
+            return
+
+        loop = asyncio.get_running_loop()
+        environ = self.build_environ(scope, body)
+        status, headers, chunks, iterator = await loop.run_in_executor(
+            self.executor, self.call_wsgi, environ)
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        try:
+            for chunk in chunks:
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            while iterator is not None:
+                chunk = await loop.run_in_executor(self.executor, next, iterator, None)
+                if chunk is None:
+                    break
+                if chunk:
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        finally:
+            # Release the stream's pooled connection even if the client went away
+            if iterator is not None:
+                await loop.run_in_executor(self.executor, close_iterable, iterator)
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.executor.shutdown(wait=True)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def read_body(self, scope, receive):
+        """Return the whole request body, None if it exceeds max_body_bytes,
+        or DISCONNECTED if the client went away first."""
+        for name, value in scope["headers"]:
+            if name.lower() == CONTENT_LENGTH_HEADER and value.isdigit() \
+                    and int(value) > self.max_body_bytes:
+                return None
+        parts = []
+        size = 0
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return DISCONNECTED
+            part = message.get("body", b"")
+            size += len(part)
+            if size > self.max_body_bytes:
+                return None
+            parts.append(part)
+            if not message.get("more_body", False):
+                break
+        return b"".join(parts)
+
+    @staticmethod
+    async def send_error(send, status, message):
+        body = json.dumps({"error": message}).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"application/json"),
+                        (b"content-length", str(len(body)).encode("latin-1"))],
+        })
+        await send({"type": "http.response.body", "body": body, "more_body": False})
+
+    @staticmethod
+    def build_environ(scope, body):
+        """Translate an ASGI HTTP scope into a PEP 3333 environ."""
+        server = scope.get("server") or ("localhost", 80)
+        client = scope.get("client") or ("", 0)
+        environ = {
+            "REQUEST_METHOD": scope["method"],
+            "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+            "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+            "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+            "SERVER_NAME": server[0],
+            "SERVER_PORT": str(server[1]),
+            "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+            "REMOTE_ADDR": client[0],
+            "REMOTE_PORT": str(client[1]),
+            "CONTENT_LENGTH": str(len(body)),
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": scope.get("scheme", "http"),
+            "wsgi.input": BytesIO(body),
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": True,
+            "wsgi.run_once": False,
+        }
+        for name, value in scope["headers"]:
+            key = name.decode("latin-1").upper().replace("-", "_")
+            value = value.decode("latin-1")
+            if key == "CONTENT_TYPE":
+                environ["CONTENT_TYPE"] = value
+                continue
+            if key == "CONTENT_LENGTH":
+                continue
+            key = f"HTTP_{key}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+        return environ
+
+    def call_wsgi(self, environ):
+        """Run the WSGI app in a worker thread.
+
+        Returns (status, headers, chunks, iterator): the body chunks already
+        produced, and the rest of the response iterator, or None when the
+        body was complete in the first chunk (every non-streamed response).
+        """
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response["status"] = int(status.split(" ", 1)[0])
+            response["headers"] = [(name.lower().encode("latin-1"), value.encode("latin-1"))
+                                   for name, value in headers]
+            return self.reject_write
+
+        iterable = self.wsgi_app(environ, start_response)
+        iterator = iter(iterable)
+        first = next(iterator, None)
+        chunks = [first] if first else []
+        length = dict(response["headers"]).get(CONTENT_LENGTH_HEADER)
+        if first is None or (length is not None and int(length) == len(first)):
+            close_iterable(iterable)
+            return response["status"], response["headers"], chunks, None
+        return response["status"], response["headers"], chunks, ClosingIterator(iterator, iterable)
+
+    @staticmethod
+    def reject_write(data):
+        raise NotImplementedError("The WSGI write() callable is not supported")
+
+
+class ClosingIterator:
+    """Iterate a WSGI response and close the original iterable afterwards."""
+
+    def __init__(self, iterator, iterable):
+        self.iterator = iterator
+        self.iterable = iterable
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self.iterator)
+
+    def close(self):
+        close_iterable(self.iterable)
+
+
+def close_iterable(iterable):
+    close = getattr(iterable, "close", None)
+    if close is not None:
+        close()
+
+
+app = AsgiApp(
+    flask_app,
+    flask_app.config["ASGI_WORKERS"],
+    flask_app.config["ASGI_MAX_BODY_BYTES"],
+)
@@ -1,9 +1,76 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, g, make_response, render_template, request, jsonify
+from collections import OrderedDict
+from contextlib import ExitStack, contextmanager
+from datetime import datetime, timezone
+from array import array
+from bisect import bisect_left
+from functools import lru_cache
+from json.encoder import encode_basestring_ascii
+from operator import itemgetter
+from urllib.parse import quote
+from werkzeug.test import create_environ
+import json
+import math
+import queue
+import struct
+import sys
 import sqlite3
+import threading
+import time
 import os
 import re
 
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
 app = Flask(__name__)
+app.config.from_mapping(
+    DATABASE=os.environ.get("COUNTY_DB_PATH", os.path.join(BASE_DIR, "data.db")),
+    # Read-only connections kept open per process
+    DB_POOL_SIZE=int(os.environ.get("DB_POOL_SIZE", "8")),
+    # Seconds a request waits for a free connection before failing
+    DB_POOL_TIMEOUT=float(os.environ.get("DB_POOL_TIMEOUT", "5")),
+    # Per-connection page cache in KiB and memory-mapped I/O size in bytes
+    DB_CACHE_SIZE_KIB=int(os.environ.get("DB_CACHE_SIZE_KIB", "16384")),
+    DB_MMAP_SIZE=int(os.environ.get("DB_MMAP_SIZE", str(256 * 1024 * 1024))),
+    # Bounds for the /county_data response cache; 0 entries disables it
+    RESPONSE_CACHE_MAX_ENTRIES=int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", "10000")),
+    RESPONSE_CACHE_MAX_BYTES=int(os.environ.get("RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+    # Seconds a cached response stays valid; 0 keeps it until data.db changes
+    RESPONSE_CACHE_TTL=float(os.environ.get("RESPONSE_CACHE_TTL", "0")),
+    # Most (zip, measure_name) pairs accepted by /county_data/batch
+    BATCH_MAX_ITEMS=int(os.environ.get("BATCH_MAX_ITEMS", "500")),
+    # "sqlite" queries data.db per request; "memory" loads it into an in-process
+    # index; "snapshot" maps the binary snapshot at SNAPSHOT_PATH
+    SERVING_MODE=os.environ.get("SERVING_MODE", "sqlite"),
+    SNAPSHOT_PATH=os.environ.get("SNAPSHOT_PATH", os.path.join(BASE_DIR, "data.snapshot")),
+    # Log lookups slower than this many milliseconds with their query plan; 0 disables
+    SLOW_QUERY_MS=float(os.environ.get("SLOW_QUERY_MS", "0")),
+    # Optional marker bumped by deployments to invalidate cached responses
+    DATA_VERSION=os.environ.get("DATA_VERSION", ""),
+    # Cache-Control lifetimes, in seconds, of GET lookups for browsers (max-age)
+    # and shared caches such as CDN edges (s-maxage)
+    HTTP_CACHE_MAX_AGE=int(os.environ.get("HTTP_CACHE_MAX_AGE", "300")),
+    HTTP_CACHE_S_MAXAGE=int(os.environ.get("HTTP_CACHE_S_MAXAGE", "86400")),
+    # Threads running requests for the ASGI entry point (api/asgi.py)
+    ASGI_WORKERS=int(os.environ.get("ASGI_WORKERS", "8")),
+    # Largest request body the ASGI entry point buffers before answering 413
+    ASGI_MAX_BODY_BYTES=int(os.environ.get("ASGI_MAX_BODY_BYTES", str(1024 * 1024))),
+    # Lookup requests served at once per process before answering 503; 0 is unlimited
+    MAX_IN_FLIGHT=int(os.environ.get("MAX_IN_FLIGHT", "0")),
+    # Per-client token bucket for lookups: sustained requests/second (0 disables)
+    # and burst size. Clients are keyed on X-API-Key when it is one of the
+    # comma-separated API_KEYS, else the client address, taken from
+    # X-Forwarded-For when TRUST_FORWARDED_FOR is set (behind a proxy).
+    RATE_LIMIT_PER_SECOND=float(os.environ.get("RATE_LIMIT_PER_SECOND", "0")),
+    RATE_LIMIT_BURST=int(os.environ.get("RATE_LIMIT_BURST", "20")),
+    RATE_LIMIT_MAX_CLIENTS=int(os.environ.get("RATE_LIMIT_MAX_CLIENTS", "10000")),
+    API_KEYS=frozenset(key for key in os.environ.get("API_KEYS", "").split(",") if key),
+    TRUST_FORWARDED_FOR=os.environ.get("TRUST_FORWARDED_FOR", "0") not in ("0", "false"),
+    # Retry-After, in seconds, sent with 503s from the in-flight limit or pool timeouts
+    BUSY_RETRY_AFTER=int(os.environ.get("BUSY_RETRY_AFTER", "1")),
+    # Open the lookup index or a pooled connection at import (see prewarm())
+    PREWARM=os.environ.get("PREWARM", "1") not in ("0", "false"),
+)
 
 ALLOWED_MEASURES = {
     "Violent crime rate",
@@ -20,12 +87,1486 @@ ALLOWED_MEASURES = {
     "Daily fine particulate matter",
 }
 
+ZIP_PATTERN = re.compile(r"\d{5}")
+
+# Columns returned for each matching row, in response order.
+RESULT_COLUMNS = (
+    "state",
+    "county",
+    "state_code",
+    "county_code",
+    "year_span",
+    "measure_name",
+    "measure_id",
+    "numerator",
+    "denominator",
+    "raw_value",
+    "confidence_interval_lower_bound",
+    "confidence_interval_upper_bound",
+    "data_release_year",
+    "fipscode",
+)
+
+SELECT_COLUMNS = ", ".join(f"s.{col}" for col in RESULT_COLUMNS)
+
+# Positions in RESULT_COLUMNS; rows are plain tuples in this order whether
+# they come from SQLite, the in-memory index or the snapshot.
+STATE_INDEX = RESULT_COLUMNS.index("state")
+COUNTY_INDEX = RESULT_COLUMNS.index("county")
+MEASURE_NAME_INDEX = RESULT_COLUMNS.index("measure_name")
+FIPSCODE_INDEX = RESULT_COLUMNS.index("fipscode")
+YEAR_SPAN_INDEX = RESULT_COLUMNS.index("year_span")
+RELEASE_YEAR_INDEX = RESULT_COLUMNS.index("data_release_year")
+
+# Per-release columns of each county's series in a release range response.
+SERIES_COLUMNS = (
+    "data_release_year",
+    "year_span",
+    "numerator",
+    "denominator",
+    "raw_value",
+    "confidence_interval_lower_bound",
+    "confidence_interval_upper_bound",
+)
+SERIES_INDEXES = tuple(RESULT_COLUMNS.index(col) for col in SERIES_COLUMNS)
+
+RELEASE_RANGE_PATTERN = re.compile(r"(\d{4})-(\d{4})")
+
+# Denormalized (zip, measure_name) -> rows table, built by
+# `csv_to_sqlite.py --materialize`.
+LOOKUP_TABLE = "zip_measure_lookup"
+
+# Same shape as LOOKUP_TABLE, computed on the fly. csv_to_sqlite.py trims the
+# FIPS join keys at ingest, so plain equality here can use the indexes on
+# zip_county (zip) and county_health_rankings (fipscode, measure_name).
+JOIN_SOURCE = (
+    "(SELECT zc.zip AS zip, "
+    + ", ".join(f"chr.{col} AS {col}" for col in RESULT_COLUMNS)
+    + " FROM zip_county AS zc"
+    " JOIN county_health_rankings AS chr"
+    " ON zc.county_code = chr.fipscode"
+    " AND zc.state_abbreviation = chr.state)"
+)
+
+# Per (state, measure_name, data_release_year) rollups precomputed by
+# csv_to_sqlite.py, and the nearest-rank raw_value percentiles they hold.
+SUMMARY_TABLE = "state_measure_summary"
+SUMMARY_PERCENTILES = (25, 50, 75, 90)
+
+# Columns of one aggregate group after its key, in SUMMARY_TABLE order.
+AGGREGATE_COLUMNS = (
+    "rows", "counties", "numerator", "denominator", "weighted_rate",
+    "raw_count", "raw_min", "raw_max", "raw_mean",
+) + tuple(f"raw_p{p}" for p in SUMMARY_PERCENTILES)
+# (fipscode, state, measure_name) -> latest data_release_year, built by
+# csv_to_sqlite.py so "latest" lookups are a primary key probe per row.
+LATEST_RELEASE_TABLE = "latest_release"
+
+# Per county row percentile ranks and z-scores of raw_value within its state
+# and nationally, built by csv_to_sqlite.py and added to lookups that ask for
+# "ranks".
+RANK_TABLE = "county_measure_rank"
+RANK_COLUMNS = (
+    "state_percentile",
+    "state_z_score",
+    "state_counties",
+    "national_percentile",
+    "national_z_score",
+    "national_counties",
+)
+RANK_QUERY = (
+    f"SELECT data_release_year, {', '.join(RANK_COLUMNS)} FROM {RANK_TABLE}"
+    " WHERE fipscode = ? AND state = ? AND measure_name = ?"
+)
+NO_RANKS = (None,) * len(RANK_COLUMNS)
+
+# Every allowed measure, in the order a profile lookup binds them.
+PROFILE_MEASURES = tuple(sorted(ALLOWED_MEASURES))
+
+
+@lru_cache(maxsize=None)
+def county_query(source, measure_count=1, release_kind=None, latest_table=True):
+    """Return the lookup query for a zip and measure_count measure names.
+
+    release_kind narrows it to one release year ("year"), a range of them
+    ("range", ordered for series) or each county's latest ("latest", from
+    LATEST_RELEASE_TABLE, or a MAX() subquery without latest_table). Query
+    text is constant per argument set so sqlite3 reuses the prepared
+    statement.
+    """
+    if measure_count == 1:
+        measure_filter = "s.measure_name = ?"
+    else:
+        measure_filter = f"s.measure_name IN ({', '.join(['?'] * measure_count)})"
+    sql = f"SELECT {SELECT_COLUMNS} FROM {source} AS s WHERE s.zip = ? AND {measure_filter}"
+    if release_kind == "year":
+        sql += " AND s.data_release_year = ?"
+    elif release_kind == "range":
+        sql += (" AND s.data_release_year BETWEEN ? AND ?"
+                " ORDER BY s.fipscode, s.state, s.data_release_year, s.year_span")
+    elif release_kind == "latest" and latest_table:
+        sql += (
+            " AND s.data_release_year = (SELECT lr.data_release_year"
+            f" FROM {LATEST_RELEASE_TABLE} AS lr WHERE lr.fipscode = s.fipscode"
+            " AND lr.state = s.state AND lr.measure_name = s.measure_name)"
+        )
+    elif release_kind == "latest":
+        sql += (
+            " AND s.data_release_year = (SELECT MAX(chr.data_release_year)"
+            " FROM county_health_rankings AS chr WHERE chr.fipscode = s.fipscode"
+            " AND chr.state = s.state AND chr.measure_name = s.measure_name)"
+        )
+    return sql
+
+
+def table_exists(conn, table_name):
+    cursor = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+        (table_name,),
+    )
+    return cursor.fetchone() is not None
+
+
+def serving_source(conn):
+    """Return the table expression to query zip/measure rows from."""
+    return LOOKUP_TABLE if table_exists(conn, LOOKUP_TABLE) else JOIN_SOURCE
+
+
+class PoolTimeout(sqlite3.OperationalError):
+    """No pooled connection was free within DB_POOL_TIMEOUT seconds."""
+
+
+class ConnectionPool:
+    """Thread-safe pool of read-only SQLite connections reused across requests.
+
+    Connections keep their page cache and sqlite3's per-connection prepared
+    statement cache between requests. At most `size` connections are checked
+    out at once; further requests wait up to `timeout` seconds.
+    """
+
+    def __init__(self, db_path, size, timeout, cache_size_kib, mmap_size):
+        self.db_path = db_path
+        self.db_inode = file_inode(db_path)
+        self.size = size
+        self.timeout = timeout
+        self.cache_size_kib = cache_size_kib
+        self.mmap_size = mmap_size
+        self.pid = os.getpid()
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self.closed = False
+        self.created = 0
+        self.hits = 0
+        self.misses = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+
+    def _connect(self):
+        uri = f"file:{quote(self.db_path)}?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        conn.execute("PRAGMA query_only = ON")
+        conn.execute(f"PRAGMA cache_size = -{int(self.cache_size_kib)}")
+        conn.execute(f"PRAGMA mmap_size = {int(self.mmap_size)}")
+        return conn
+
+    def acquire(self):
+        start = time.perf_counter()
+        acquired = self._slots.acquire(timeout=self.timeout)
+        waited = time.perf_counter() - start
+        with self._lock:
+            self.wait_seconds += waited
+            if not acquired:
+                self.timeouts += 1
+        if not acquired:
+            raise PoolTimeout("timed out waiting for a database connection")
+        try:
+            conn = self._idle.get_nowait()
+            with self._lock:
+                self.hits += 1
+        except queue.Empty:
+            try:
+                conn = self._connect()
+            except Exception:
+                self._slots.release()
+                raise
+            with self._lock:
+                self.misses += 1
+                self.created += 1
+        return conn
+
+    def release(self, conn):
+        if self.closed:
+            conn.close()
+            with self._lock:
+                self.created -= 1
+        else:
+            self._idle.put(conn)
+        self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self):
+        self.closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+            with self._lock:
+                self.created -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": self.size,
+                "open": self.created,
+                "idle": self._idle.qsize(),
+                "hits": self.hits,
+                "misses": self.misses,
+                "timeouts": self.timeouts,
+                "wait_seconds": round(self.wait_seconds, 6),
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def file_inode(path):
+    """Return the inode of path, or None if it doesn't exist."""
+    try:
+        return os.stat(path).st_ino
+    except OSError:
+        return None
+
+
+def pool_is_stale(pool):
+    db_path = app.config["DATABASE"]
+    return (pool is None or pool.pid != os.getpid() or pool.db_path != db_path
+            or pool.db_inode != file_inode(db_path))
+
+
+def get_pool():
+    """Return this process's connection pool, creating it on first use.
+
+    A new pool is created after a fork, when app.config['DATABASE'] changes,
+    or when the file is atomically replaced (a new inode), so lookups move to
+    the new data while in-flight ones finish on the old file.
+    """
+    global _pool
+    pool = _pool
+    if pool_is_stale(pool):
+        with _pool_lock:
+            pool = _pool
+            if pool_is_stale(pool):
+                if pool is not None and pool.pid == os.getpid():
+                    pool.close()
+                pool = ConnectionPool(
+                    app.config["DATABASE"],
+                    app.config["DB_POOL_SIZE"],
+                    app.config["DB_POOL_TIMEOUT"],
+                    app.config["DB_CACHE_SIZE_KIB"],
+                    app.config["DB_MMAP_SIZE"],
+                )
+                _pool = pool
+    return pool
+
+
+def close_pool():
+    """Close the idle connections of this process's pool and discard it."""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None and pool.pid == os.getpid():
+        pool.close()
+
+
 def get_db_connection():
-    base_dir = os.path.dirname(os.path.abspath(__file__))
-    db_path = os.path.join(base_dir, 'data.db')
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """Check out a pooled read-only connection; use as `with get_db_connection() as conn`."""
+    return get_pool().connection()
+
+
+class ResponseCache:
+    """Bounded LRU cache of serialized JSON responses with an optional TTL.
+
+    Entries are tagged with the data version they were computed from; a
+    lookup with a different version drops every entry.
+    """
+
+    def __init__(self, max_entries, max_bytes, ttl):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = None
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def _check_version(self, version):
+        if version != self._version:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._bytes = 0
+            self._version = version
+
+    def get(self, key, version):
+        """Return (body, status) for key, or None on a miss."""
+        with self._lock:
+            self._check_version(version)
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            body, status, stored_at = entry
+            if self.ttl and time.monotonic() - stored_at > self.ttl:
+                del self._entries[key]
+                self._bytes -= len(body)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return body, status
+
+    def put(self, key, version, body, status):
+        if self.max_entries <= 0 or len(body) > self.max_bytes:
+            return
+        with self._lock:
+            self._check_version(version)
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= len(previous[0])
+            self._entries[key] = (body, status, time.monotonic())
+            self._bytes += len(body)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (evicted, _, _) = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+
+response_cache = ResponseCache(
+    app.config["RESPONSE_CACHE_MAX_ENTRIES"],
+    app.config["RESPONSE_CACHE_MAX_BYTES"],
+    app.config["RESPONSE_CACHE_TTL"],
+)
+
+
+class AdmissionControl:
+    """Bounded in-flight lookups plus a token bucket per client.
+
+    Each decision takes one lock and does no I/O, so rejecting a request
+    stays cheap however busy the process is. The least recently seen
+    clients' buckets are dropped beyond max_clients.
+    """
+
+    def __init__(self, max_in_flight, rate, burst, max_clients):
+        self.max_in_flight = max_in_flight
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.admitted = 0
+        self.rejected_busy = 0
+        self.rejected_rate_limit = 0
+
+    def take_token(self, client):
+        """Spend one of client's tokens; return 0, or seconds until one refills."""
+        if self.rate <= 0:
+            return 0
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.pop(client, None)
+            if bucket is None:
+                tokens, updated = float(self.burst), now
+            else:
+                tokens, updated = bucket
+                tokens = min(float(self.burst), tokens + (now - updated) * self.rate)
+            if tokens >= 1:
+                self._buckets[client] = (tokens - 1, now)
+                wait = 0
+            else:
+                self._buckets[client] = (tokens, now)
+                self.rejected_rate_limit += 1
+                wait = (1 - tokens) / self.rate
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+            return wait
+
+    def acquire(self):
+        """Take an in-flight slot; False if every slot is in use."""
+        with self._lock:
+            if self.max_in_flight and self.in_flight >= self.max_in_flight:
+                self.rejected_busy += 1
+                return False
+            self.in_flight += 1
+            self.admitted += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            return True
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+            self.peak_in_flight = self.in_flight
+            self.admitted = self.rejected_busy = self.rejected_rate_limit = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_in_flight": self.max_in_flight,
+                "in_flight": self.in_flight,
+                "peak_in_flight": self.peak_in_flight,
+                "admitted": self.admitted,
+                "rejected_busy": self.rejected_busy,
+                "rejected_rate_limit": self.rejected_rate_limit,
+                "rate_limit_per_second": self.rate,
+                "rate_limit_burst": self.burst,
+                "clients": len(self._buckets),
+            }
+
+
+admission = AdmissionControl(
+    app.config["MAX_IN_FLIGHT"],
+    app.config["RATE_LIMIT_PER_SECOND"],
+    app.config["RATE_LIMIT_BURST"],
+    app.config["RATE_LIMIT_MAX_CLIENTS"],
+)
+
+# Endpoints admission control applies to; /stats, /metrics and / stay reachable.
+ADMITTED_ENDPOINTS = {"county_data", "county_data_batch", "county_data_aggregate"}
+
+
+def data_version():
+    """Identify the current data.db contents, or None if it doesn't exist.
+
+    Rebuilding or replacing the file changes its mtime, size or inode.
+    """
+    try:
+        st = os.stat(app.config["DATABASE"])
+    except OSError:
+        return None
+    return (app.config["DATA_VERSION"], st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+METADATA_TABLE = "metadata"
+
+_dataset_version = (None, None)
+_dataset_version_lock = threading.Lock()
+
+
+def read_metadata(conn):
+    """Return the metadata table written by csv_to_sqlite.py, or {} if there is none."""
+    try:
+        return dict(tuple(row) for row in conn.execute(f"SELECT key, value FROM {METADATA_TABLE}"))
+    except sqlite3.OperationalError:
+        return {}
+
+
+def dataset_version():
+    """Return (version, last_modified) for HTTP caching, or None without data.
+
+    The version is the data_version csv_to_sqlite.py recorded at ingest
+    (from the snapshot header in snapshot mode), read once per file and
+    cached against data_version(), so a conditional request costs a stat()
+    rather than a query. Databases built before the metadata table existed
+    fall back to the file's identity and mtime.
+    """
+    global _dataset_version
+    index = get_lookup_index()
+    if isinstance(index, Snapshot):
+        key = _lookup_index_version
+    else:
+        key = data_version()
+        if key is None:
+            return None
+    cached_key, cached = _dataset_version
+    if key == cached_key:
+        return cached
+    with _dataset_version_lock:
+        if isinstance(index, Snapshot):
+            metadata = index.metadata
+            fallback = os.stat(app.config["SNAPSHOT_PATH"])
+        else:
+            with get_db_connection() as conn:
+                metadata = read_metadata(conn)
+            fallback = os.stat(app.config["DATABASE"])
+        version = metadata.get("data_version") or f"{fallback.st_ino:x}-{fallback.st_mtime_ns:x}"
+        if app.config["DATA_VERSION"]:
+            version = f"{app.config['DATA_VERSION']}.{version}"
+        if metadata.get("built_at"):
+            last_modified = datetime.fromisoformat(metadata["built_at"])
+        else:
+            last_modified = datetime.fromtimestamp(int(fallback.st_mtime), timezone.utc)
+        _dataset_version = (key, (version, last_modified))
+        return version, last_modified
+
+
+# Pairs per batch query; two parameters each stays under SQLite's
+# default limit of 999 bound parameters.
+BATCH_QUERY_CHUNK = 400
+
+
+# Upper bounds, in seconds, of the latency histogram buckets.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+# Descriptions for the HELP lines of the counters and histograms /metrics exports.
+METRIC_HELP = {
+    "county_requests_total": "Requests by endpoint and status code.",
+    "county_request_seconds": "Request latency by endpoint.",
+    "county_request_measure_seconds": "Request latency by endpoint and measure name.",
+    "county_request_stage_seconds": "Time spent in each stage of a request.",
+    "county_sql_statement_seconds": "Lookup query execution time by statement.",
+    "county_admission_rejections_total": "Requests rejected by admission control, by reason.",
+}
+
+
+class Metrics:
+    """Process-local counters and latency histograms in Prometheus text format."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    def inc(self, name, labels, amount=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, labels, seconds):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                # Per-bucket counts, then the running sum and count
+                histogram = self._histograms[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram[i] += 1
+                    break
+            histogram[-2] += seconds
+            histogram[-1] += 1
+
+    def clear(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def render(self, gauges=()):
+        """Render every metric, plus (name, labels, value, help) gauges, as text.
+
+        Each metric name gets # HELP and # TYPE lines before its first sample.
+        """
+        def fmt_labels(labels):
+            if not labels:
+                return ""
+            pairs = ",".join(
+                '{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"'))
+                for k, v in labels
+            )
+            return "{" + pairs + "}"
+
+        lines = []
+        described = set()
+
+        def describe(name, kind, help_text=None):
+            if name not in described:
+                described.add(name)
+                lines.append(f"# HELP {name} {help_text or METRIC_HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, list(value)) for key, value in self._histograms.items())
+        for (name, labels), value in counters:
+            describe(name, "counter")
+            lines.append(f"{name}{fmt_labels(labels)} {value}")
+        for (name, labels), histogram in histograms:
+            describe(name, "histogram")
+            cumulative = 0
+            for bound, count in zip(self.buckets, histogram):
+                cumulative += count
+                lines.append(f"{name}_bucket{fmt_labels(labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{name}_bucket{fmt_labels(labels + (('le', '+Inf'),))} {histogram[-1]}")
+            lines.append(f"{name}_sum{fmt_labels(labels)} {histogram[-2]:.6f}")
+            lines.append(f"{name}_count{fmt_labels(labels)} {histogram[-1]}")
+        for name, labels, value, help_text in gauges:
+            describe(name, "gauge", help_text)
+            lines.append(f"{name}{fmt_labels(tuple(sorted(labels.items())))} {value}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+class StageTimer:
+    """Records the time spent in each named stage of one request."""
+
+    def __init__(self):
+        self.start = self._last = time.perf_counter()
+        self.stages = []
+
+    def mark(self, stage):
+        """Close the stage that ran since the previous mark."""
+        now = time.perf_counter()
+        self.stages.append((stage, now - self._last))
+        self._last = now
+        return now
+
+
+def run_lookup_query(conn, statement, sql, params, zip_code, measure_name):
+    """Execute and fetch a lookup, recording its timing and logging it if slow."""
+    start = time.perf_counter()
+    rows = conn.execute(sql, params).fetchall()
+    elapsed = time.perf_counter() - start
+    metrics.observe("county_sql_statement_seconds", {"statement": statement}, elapsed)
+    threshold = app.config["SLOW_QUERY_MS"]
+    if threshold and elapsed * 1000 >= threshold:
+        plan = [row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+        app.logger.warning(
+            "slow query: %.1fms zip=%s measure_name=%s plan=%s",
+            elapsed * 1000, zip_code, measure_name, " | ".join(plan),
+        )
+    return rows
+
+
+def current_rss_kib():
+    """Resident set size of this process in KiB (peak RSS where /proc is missing)."""
+    try:
+        with open("/proc/self/statm") as statm:
+            pages = int(statm.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") // 1024
+    except (OSError, ValueError, IndexError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class MemoryIndex:
+    """Read-only copy of the serving rows held in compact in-process structures.
+
+    ZIPs are interned as ints mapping to county ids and measures as small
+    ints. Rows are sorted by (county, measure) and stored column-wise:
+    array('q') or array('d') for purely integer or real columns, and lists
+    of interned strings otherwise. Each (county, measure) maps to a row range.
+    """
+
+    INT_NULL = -2**63
+
+    def __init__(self, conn):
+        start = time.perf_counter()
+        rss_before = current_rss_kib()
+        self.measure_ids = {name: i for i, name in enumerate(PROFILE_MEASURES)}
+        measure_count = len(PROFILE_MEASURES)
+        placeholders = ", ".join(["?"] * measure_count)
+        cursor = conn.cursor()
+        cursor.row_factory = None
+        cursor.execute(
+            f"SELECT {', '.join(RESULT_COLUMNS)} FROM county_health_rankings "
+            f"WHERE measure_name IN ({placeholders}) ORDER BY fipscode, state, measure_name",
+            PROFILE_MEASURES,
+        )
+
+        # Rows arrive grouped by county and measure, so each pair is one range
+        county_ids = {}
+        self.ranges = {}
+        columns = [[] for _ in RESULT_COLUMNS]
+        interned = [{} for _ in RESULT_COLUMNS]
+        position = 0
+        for position, row in enumerate(cursor, start=1):
+            county_id = county_ids.setdefault((row[FIPSCODE_INDEX], row[STATE_INDEX]), len(county_ids))
+            key = county_id * measure_count + self.measure_ids[row[MEASURE_NAME_INDEX]]
+            self.ranges[key] = (self.ranges.get(key, (position - 1,))[0], position)
+            for column, strings, value in zip(columns, interned, row):
+                column.append(strings.setdefault(value, value) if isinstance(value, str) else value)
+        del interned
+        self.columns = [self._pack(column) for column in columns]
+        del columns
+
+        zips = {}
+        for zip_code, county_code, state in conn.execute(
+                "SELECT zip, county_code, state_abbreviation FROM zip_county"):
+            county_id = county_ids.get((county_code, state))
+            zip_code = str(zip_code)
+            if county_id is not None and ZIP_PATTERN.fullmatch(zip_code):
+                zips.setdefault(int(zip_code), []).append(county_id)
+        self.zips = {z: tuple(dict.fromkeys(ids)) for z, ids in zips.items()}
+
+        self.stats = {
+            "rows": position,
+            "zips": len(self.zips),
+            "counties": len(county_ids),
+            "load_seconds": round(time.perf_counter() - start, 3),
+            "rss_delta_kib": current_rss_kib() - rss_before,
+        }
+
+    @classmethod
+    def _pack(cls, values):
+        kinds = {type(v) for v in values if v is not None}
+        if kinds == {int} and all(v is None or cls.INT_NULL < v < 2**63 for v in values):
+            return array("q", (cls.INT_NULL if v is None else v for v in values))
+        if kinds == {float}:
+            return array("d", (math.nan if v is None else v for v in values))
+        return values
+
+    def _row(self, position):
+        values = []
+        for column in self.columns:
+            value = column[position]
+            if isinstance(column, array):
+                if column.typecode == "q" and value == self.INT_NULL:
+                    value = None
+                elif column.typecode == "d" and value != value:
+                    value = None
+            values.append(value)
+        return tuple(values)
+
+    def lookup(self, zip_code, measures):
+        """Return row tuples, in RESULT_COLUMNS order, for a zip and measures."""
+        rows = []
+        measure_count = len(PROFILE_MEASURES)
+        for county_id in self.zips.get(int(zip_code), ()):
+            for measure in measures:
+                span = self.ranges.get(county_id * measure_count + self.measure_ids[measure])
+                if span is not None:
+                    rows.extend(self._row(position) for position in range(*span))
+        return rows
+
+
+class Snapshot:
+    """Read-only lookups over a binary snapshot from `csv_to_sqlite.py --snapshot`.
+
+    The file is mapped with mmap and its sections are read in place through
+    memoryview casts, so opening it costs one header parse and every worker
+    process shares the same OS pages. ZIPs are found by binary search, and
+    only the strings a response needs are decoded.
+    """
+
+    MAGIC = b"CHRSNAP1"
+    INT_NULL = -2**63
+    STRING_NULL = 0xFFFFFFFF
+
+    def __init__(self, path):
+        # Imported here so SQLite-mode cold starts don't pay for it
+        import mmap
+        start = time.perf_counter()
+        rss_before = current_rss_kib()
+        with open(path, "rb") as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+        if bytes(view[:len(self.MAGIC)]) != self.MAGIC:
+            raise ValueError(f"{path} is not a county data snapshot")
+        (header_size,) = struct.unpack_from("<I", view, len(self.MAGIC))
+        header_start = len(self.MAGIC) + 4
+        header = json.loads(bytes(view[header_start:header_start + header_size]))
+        if header["byteorder"] != sys.byteorder:
+            raise ValueError(f"{path} was written with {header['byteorder']}-endian byte order")
+        if [name for name, _ in header["columns"]] != list(RESULT_COLUMNS):
+            raise ValueError(f"{path} has unexpected columns")
+
+        def section(name):
+            offset, count, fmt = header["sections"][name]
+            return view[offset:offset + count * struct.calcsize(fmt)].cast(fmt)
+
+        self._string_offsets = section("string_offsets")
+        self._string_data = section("string_data")
+        self._zips = section("zips")
+        self._zip_ref_start = section("zip_ref_start")
+        self._zip_refs = section("zip_refs")
+        self._county_row_start = section("county_row_start")
+        self._columns = [(kind, section(f"column:{name}")) for name, kind in header["columns"]]
+        self._measure_column = self._columns[MEASURE_NAME_INDEX][1]
+        self._measure_ids = header["measure_ids"]
+        self._strings = {}
+        self.metadata = {key: header[key] for key in ("data_version", "built_at") if header.get(key)}
+        self.stats = {
+            "path": path,
+            "bytes": len(self._mmap),
+            "rows": header["rows"],
+            "zips": header["zips"],
+            "counties": header["counties"],
+            "load_seconds": round(time.perf_counter() - start, 6),
+            "rss_delta_kib": current_rss_kib() - rss_before,
+        }
+
+    def _string(self, string_id):
+        if string_id == self.STRING_NULL:
+            return None
+        value = self._strings.get(string_id)
+        if value is None:
+            start, end = self._string_offsets[string_id], self._string_offsets[string_id + 1]
+            value = self._strings[string_id] = str(self._string_data[start:end], "utf-8")
+        return value
+
+    def _row(self, position):
+        values = []
+        for kind, column in self._columns:
+            value = column[position]
+            if kind == "s":
+                value = self._string(value)
+            elif (kind == "q" and value == self.INT_NULL) or (kind == "d" and value != value):
+                value = None
+            values.append(value)
+        return tuple(values)
+
+    def lookup(self, zip_code, measures):
+        """Return row tuples, in RESULT_COLUMNS order, for a zip and measures."""
+        zip_int = int(zip_code)
+        i = bisect_left(self._zips, zip_int)
+        if i == len(self._zips) or self._zips[i] != zip_int:
+            return []
+        wanted = {self._measure_ids[m] for m in measures if m in self._measure_ids}
+        rows = []
+        for ref in range(self._zip_ref_start[i], self._zip_ref_start[i + 1]):
+            county = self._zip_refs[ref]
+            for position in range(self._county_row_start[county], self._county_row_start[county + 1]):
+                if self._measure_column[position] in wanted:
+                    rows.append(self._row(position))
+        return rows
+
+
+_NOT_LOADED = object()
+_lookup_index = None
+_lookup_index_version = _NOT_LOADED
+_lookup_index_lock = threading.Lock()
+
+
+def file_version(path):
+    """Identify a file's current contents by inode, size and mtime, or None."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def get_lookup_index():
+    """Return the index lookups are served from, or None to query SQLite.
+
+    SERVING_MODE "memory" loads data.db into a MemoryIndex and "snapshot"
+    maps SNAPSHOT_PATH; either is reopened when its file changes. If it
+    can't be opened the error is logged and lookups fall back to
+    get_db_connection().
+    """
+    global _lookup_index, _lookup_index_version
+    mode = app.config["SERVING_MODE"]
+    if mode == "memory":
+        version = (mode, data_version())
+    elif mode == "snapshot":
+        version = (mode, app.config["SNAPSHOT_PATH"], file_version(app.config["SNAPSHOT_PATH"]))
+    else:
+        return None
+    if version == _lookup_index_version:
+        return _lookup_index
+    with _lookup_index_lock:
+        if version != _lookup_index_version:
+            try:
+                if mode == "memory":
+                    with get_db_connection() as conn:
+                        _lookup_index = MemoryIndex(conn)
+                else:
+                    _lookup_index = Snapshot(app.config["SNAPSHOT_PATH"])
+            except (sqlite3.Error, OSError, ValueError, KeyError):
+                app.logger.exception("could not open the %s index; using SQLite", mode)
+                _lookup_index = None
+            _lookup_index_version = version
+            if _lookup_index is not None:
+                app.logger.info("%s index loaded: %s", mode, _lookup_index.stats)
+    return _lookup_index
+
+
+def cache_version():
+    """Version responses are cached under, or None without data.
+
+    data.db's version, plus the snapshot's while one is served, since
+    csv_to_sqlite.py replaces the two files one after the other and a
+    snapshot can be replaced on its own.
+    """
+    version = data_version()
+    if version is not None and isinstance(get_lookup_index(), Snapshot):
+        version += (_lookup_index_version,)
+    return version
+
+
+def prewarm():
+    """Do the setup a fresh instance's first lookup would otherwise pay for.
+
+    Binds the URL map (building its matcher and lazy imports), opens the
+    memory or snapshot index or checks a connection into the pool with the
+    schema read and the lookup statement prepared, and caches the dataset
+    version. The database steps are skipped while data.db is missing.
+    """
+    with app.request_context(create_environ("/county_data")):
+        pass
+    try:
+        if get_lookup_index() is None:
+            if data_version() is None:
+                return
+            with get_db_connection() as conn:
+                conn.execute(county_query(serving_source(conn)), ("00000", "")).fetchall()
+        dataset_version()
+    except (sqlite3.Error, OSError):
+        app.logger.exception("prewarm failed; the first request will open the database")
+
+
+def validate_lookup(zip_code, measure_name, allow_multiple=False):
+    """Return the 400 error message for a zip/measure pair, or None if valid.
+
+    With allow_multiple, measure_name may also be "*" or a list of measures.
+    """
+    # Validate required inputs
+    if not zip_code or not measure_name:
+        return "Both 'zip' and 'measure_name' are required"
+
+    # Validate zip format (5 digits)
+    if not ZIP_PATTERN.fullmatch(str(zip_code)):
+        return "'zip' must be a 5-digit ZIP code"
+
+    # Validate measure_name against allowed list
+    if allow_multiple and measure_name == "*":
+        return None
+    if allow_multiple and isinstance(measure_name, list):
+        if all(isinstance(m, str) and m in ALLOWED_MEASURES for m in measure_name):
+            return None
+        return "'measure_name' is invalid"
+    if not isinstance(measure_name, str) or measure_name not in ALLOWED_MEASURES:
+        return "'measure_name' is invalid"
+    return None
+
+
+def lookup_measures(measure_name):
+    """Return the sorted, de-duplicated measures a validated measure_name selects."""
+    if measure_name == "*":
+        return PROFILE_MEASURES
+    if isinstance(measure_name, list):
+        return tuple(sorted(set(measure_name)))
+    return (measure_name,)
+
+
+def group_profile(zip_code, rows, columns=RESULT_COLUMNS):
+    """Group profile rows by county, then by measure name."""
+    counties = {}
+    for row in rows:
+        fipscode = row[FIPSCODE_INDEX]
+        county = counties.get(fipscode)
+        if county is None:
+            county = counties[fipscode] = {
+                "fipscode": fipscode,
+                "state": row[STATE_INDEX],
+                "county": row[COUNTY_INDEX],
+                "measures": {},
+            }
+        county["measures"].setdefault(row[MEASURE_NAME_INDEX], []).append(
+            dict(zip(columns, row))
+        )
+    return {"zip": zip_code, "counties": list(counties.values())}
+
+
+def parse_release(value):
+    """Return (release, error) for a request's release option.
+
+    release is None (every release), ("latest",), ("year", year) or
+    ("range", first, last); error is the 400 message for an invalid value.
+    """
+    if value is None:
+        return None, None
+    if value == "latest":
+        return ("latest",), None
+    if not isinstance(value, bool) and re.fullmatch(r"\d{4}", str(value)):
+        return ("year", int(value)), None
+    match = RELEASE_RANGE_PATTERN.fullmatch(value) if isinstance(value, str) else None
+    if match and match.group(1) <= match.group(2):
+        return ("range", int(match.group(1)), int(match.group(2))), None
+    return None, "'release' must be \"latest\", a year or a year range like \"2018-2024\""
+
+
+def release_year(value):
+    """Return a data_release_year as an int, or None if it isn't one."""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def filter_release(rows, release):
+    """Apply a release option to rows from the in-memory index or snapshot."""
+    if release is None:
+        return rows
+    kind = release[0]
+    if kind == "year":
+        return [row for row in rows if release_year(row[RELEASE_YEAR_INDEX]) == release[1]]
+    if kind == "range":
+        first, last = release[1:]
+        rows = [row for row in rows
+                if first <= (release_year(row[RELEASE_YEAR_INDEX]) or 0) <= last]
+        return sorted(rows, key=lambda row: (row[FIPSCODE_INDEX] or "", row[STATE_INDEX] or "",
+                                             release_year(row[RELEASE_YEAR_INDEX]),
+                                             row[YEAR_SPAN_INDEX] or ""))
+    latest = {}
+    for row in rows:
+        key = (row[FIPSCODE_INDEX], row[STATE_INDEX], row[MEASURE_NAME_INDEX])
+        year = release_year(row[RELEASE_YEAR_INDEX])
+        if year is not None and year > latest.get(key, -1):
+            latest[key] = year
+    return [row for row in rows
+            if release_year(row[RELEASE_YEAR_INDEX]) == latest.get(
+                (row[FIPSCODE_INDEX], row[STATE_INDEX], row[MEASURE_NAME_INDEX]))]
+
+
+def lookup_query(conn, measure_count, release):
+    """Return the lookup SQL for this database's tables and a release option."""
+    kind = release[0] if release else None
+    latest_table = kind == "latest" and table_exists(conn, LATEST_RELEASE_TABLE)
+    return county_query(serving_source(conn), measure_count, kind, latest_table)
+
+
+def group_series(zip_code, measure_name, release, rows, columns=RESULT_COLUMNS):
+    """Collapse release range rows into one series of arrays per county."""
+    series_columns = SERIES_COLUMNS + columns[len(RESULT_COLUMNS):]
+    series_indexes = SERIES_INDEXES + tuple(range(len(RESULT_COLUMNS), len(columns)))
+    counties = {}
+    for row in rows:
+        key = (row[FIPSCODE_INDEX], row[STATE_INDEX])
+        county = counties.get(key)
+        if county is None:
+            county = counties[key] = {
+                "fipscode": row[FIPSCODE_INDEX],
+                "state": row[STATE_INDEX],
+                "county": row[COUNTY_INDEX],
+                "series": {col: [] for col in series_columns},
+            }
+        for col, index in zip(series_columns, series_indexes):
+            county["series"][col].append(row[index])
+    return {
+        "zip": zip_code,
+        "measure_name": measure_name,
+        "release": f"{release[1]}-{release[2]}",
+        "counties": list(counties.values()),
+    }
+
+
+def rank_rows(conn):
+    """Return a function appending a row's RANK_COLUMNS, null where it wasn't ranked.
+
+    Every release of a county's measure is read with one primary key range
+    probe, the first time a row of it is seen.
+    """
+    if not table_exists(conn, RANK_TABLE):
+        return lambda row: row + NO_RANKS
+    execute = conn.execute
+    by_measure = {}
+
+    def add_ranks(row):
+        key = (row[FIPSCODE_INDEX], row[STATE_INDEX], row[MEASURE_NAME_INDEX])
+        releases = by_measure.get(key)
+        if releases is None:
+            releases = by_measure[key] = {
+                ranks[0]: ranks[1:] for ranks in execute(RANK_QUERY, key)
+            }
+        return row + releases.get(row[RELEASE_YEAR_INDEX], NO_RANKS)
+    return add_ranks
+
+
+def fetch_batch_rows(conn, pairs):
+    """Return {(zip, measure_name): [row dicts]} for the given pairs."""
+    source = serving_source(conn)
+    found = {}
+    for start in range(0, len(pairs), BATCH_QUERY_CHUNK):
+        chunk = pairs[start:start + BATCH_QUERY_CHUNK]
+        values = ", ".join(["(?, ?)"] * len(chunk))
+        rows = run_lookup_query(
+            conn,
+            "batch_lookup",
+            f"WITH req(zip, measure_name) AS (VALUES {values}) "
+            f"SELECT s.zip AS zip, {SELECT_COLUMNS} FROM req "
+            f"JOIN {source} AS s ON s.zip = req.zip AND s.measure_name = req.measure_name",
+            [value for pair in chunk for value in pair],
+            f"{len(chunk)} pairs",
+            "batch",
+        )
+        for row in rows:
+            values = row[1:]
+            key = (row[0], values[MEASURE_NAME_INDEX])
+            found.setdefault(key, []).append(dict(zip(RESULT_COLUMNS, values)))
+    return found
+
+
+@lru_cache(maxsize=None)
+def aggregate_query(scope_filter, by_state):
+    """Return a one-pass rollup of a measure and release year over a scope.
+
+    Rows are grouped by state, or with by_state false into a single
+    "selection" group for an explicit list of counties. State and national
+    rollup rows (county_code 000) are left out. Mirrors the query
+    csv_to_sqlite.py uses to build SUMMARY_TABLE, which answers state
+    rollups without scanning county_health_rankings.
+    """
+    group = "state" if by_state else "'selection'"
+    percentiles = ", ".join(
+        f"MIN(CASE WHEN rn * 100 >= {p} * n THEN raw_value END) AS raw_p{p}"
+        for p in SUMMARY_PERCENTILES
+    )
+    return f"""
+        WITH sel AS (
+            SELECT {group} AS grp, fipscode, state,
+                   CAST(NULLIF(numerator, '') AS REAL) AS numerator,
+                   CAST(NULLIF(denominator, '') AS REAL) AS denominator,
+                   CAST(NULLIF(raw_value, '') AS REAL) AS raw_value
+            FROM county_health_rankings
+            WHERE measure_name = ? AND data_release_year = ? AND {scope_filter}
+              AND CAST(county_code AS INTEGER) IS NOT 0
+        ),
+        totals AS (
+            SELECT grp,
+                   COUNT(*) AS rows,
+                   COUNT(DISTINCT fipscode || '|' || state) AS counties,
+                   SUM(numerator) FILTER (WHERE denominator > 0) AS numerator,
+                   SUM(denominator) FILTER (WHERE numerator IS NOT NULL AND denominator > 0)
+                       AS denominator,
+                   COUNT(raw_value) AS raw_count,
+                   MIN(raw_value) AS raw_min,
+                   MAX(raw_value) AS raw_max,
+                   AVG(raw_value) AS raw_mean
+            FROM sel
+            GROUP BY grp
+        ),
+        ranked AS (
+            SELECT grp, raw_value, ROW_NUMBER() OVER w AS rn, COUNT(*) OVER w AS n
+            FROM sel
+            WHERE raw_value IS NOT NULL
+            WINDOW w AS (PARTITION BY grp ORDER BY raw_value
+                         ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING)
+        ),
+        pct AS (
+            SELECT grp, {percentiles} FROM ranked GROUP BY grp
+        )
+        SELECT totals.grp, rows, counties, numerator, denominator,
+               numerator / denominator AS weighted_rate,
+               raw_count, raw_min, raw_max, raw_mean,
+               {", ".join(f"raw_p{p}" for p in SUMMARY_PERCENTILES)}
+        FROM totals
+        LEFT JOIN pct ON pct.grp IS totals.grp
+        ORDER BY totals.grp
+    """
+
+
+def aggregate_scope(scope, values):
+    """Return (scope_filter, params) restricting rows to an aggregate scope."""
+    placeholders = ", ".join(["?"] * len(values))
+    if scope == "state":
+        return (f"state IN ({placeholders})" if values else "state IS NOT NULL"), values
+    if scope == "fipscodes":
+        return f"fipscode IN ({placeholders})", values
+    # ZIPs select every county they overlap, each counted once
+    return (
+        "(fipscode, state) IN (SELECT county_code, state_abbreviation "
+        f"FROM zip_county WHERE zip IN ({placeholders}))"
+    ), values
+
+
+def fetch_aggregates(conn, measure_name, release_year, scope, values):
+    """Return [(group, aggregate columns...)] for a validated aggregate request."""
+    if scope == "state" and table_exists(conn, SUMMARY_TABLE):
+        state_filter = f" AND state IN ({', '.join(['?'] * len(values))})" if values else ""
+        return run_lookup_query(
+            conn,
+            "aggregate_summary",
+            f"SELECT state, {', '.join(AGGREGATE_COLUMNS)} FROM {SUMMARY_TABLE} "
+            f"WHERE measure_name = ? AND data_release_year = ?{state_filter} ORDER BY state",
+            (measure_name, release_year, *values),
+            f"{len(values) or 'all'} states",
+            measure_name,
+        )
+    scope_filter, params = aggregate_scope(scope, values)
+    return run_lookup_query(
+        conn,
+        "aggregate",
+        aggregate_query(scope_filter, scope == "state"),
+        (measure_name, release_year, *params),
+        f"{len(values) or 'all'} {scope}",
+        measure_name,
+    )
+
+
+def aggregate_group(row):
+    """Shape one aggregate row for the /county_data/aggregate response."""
+    values = dict(zip(AGGREGATE_COLUMNS, row[1:]))
+    return {
+        "group": row[0],
+        "rows": values["rows"],
+        "counties": values["counties"],
+        "numerator": values["numerator"],
+        "denominator": values["denominator"],
+        "weighted_rate": values["weighted_rate"],
+        "raw_value": {
+            "count": values["raw_count"],
+            "min": values["raw_min"],
+            "max": values["raw_max"],
+            "mean": values["raw_mean"],
+            **{f"p{p}": values[f"raw_p{p}"] for p in SUMMARY_PERCENTILES},
+        },
+    }
+
+
+class RowEncoder:
+    """Serialize rows to the JSON objects app.json writes for their dicts.
+
+    The output matches app.json.dumps(dict(zip(columns, row))) with the
+    default provider (sorted keys, ASCII escapes) byte for byte, without
+    building the dict. The types of a row's values select a cached
+    %-format template with the keys, nulls and separators already in
+    place. Numbers are written with repr() and strings are escaped by the
+    json module's C helper. Rows holding any other type, or infinite or NaN
+    floats, fall back to app.json.dumps.
+    """
+
+    def __init__(self, columns, item_separator=",", key_separator=":"):
+        self.columns = columns
+        self.item_separator = item_separator
+        self.key_separator = key_separator
+        order = sorted(range(len(columns)), key=columns.__getitem__)
+        self._keys = [columns[i] for i in order]
+        self._sorted_values = itemgetter(*order)
+        self._templates = {}
+        self._inf, self._negative_inf, self._nan = (
+            key_separator + value for value in ("inf", "-inf", "nan"))
+
+    def _template(self, types):
+        """Return (template, string positions, has_float) for one row shape, or None."""
+        fields = []
+        strings = []
+        for i, (key, value_type) in enumerate(zip(self._keys, types)):
+            if value_type is type(None):
+                # %.0s consumes the None and writes nothing
+                value = "null%.0s"
+            elif value_type is str:
+                value = "%s"
+                strings.append(i)
+            elif value_type in (int, float):
+                value = "%r"
+            else:
+                return None
+            fields.append(encode_basestring_ascii(key).replace("%", "%%") + self.key_separator + value)
+        template = "{" + self.item_separator.join(fields) + "}"
+        return template, tuple(strings), float in types
+
+    def encode(self, row):
+        """Return one row as a JSON object string."""
+        values = self._sorted_values(row)
+        types = tuple(map(type, values))
+        try:
+            template = self._templates[types]
+        except KeyError:
+            template = self._templates[types] = self._template(types)
+        if template is not None:
+            template, strings, has_float = template
+            args = list(values)
+            for i in strings:
+                args[i] = encode_basestring_ascii(args[i])
+            text = template % tuple(args)
+            if not has_float or not (self._inf in text or self._negative_inf in text
+                                     or self._nan in text):
+                return text
+        return app.json.dumps(dict(zip(self.columns, row)),
+                              separators=(self.item_separator, self.key_separator))
+
+    def encode_array(self, rows):
+        """Return rows as the JSON array jsonify(list of dicts) would send."""
+        return f"[{self.item_separator.join(map(self.encode, rows))}]\n".encode()
+
+
+# Row encoders for jsonify's compact arrays and app.json.dumps's NDJSON lines,
+# for plain rows and rows with RANK_COLUMNS appended
+row_json = RowEncoder(RESULT_COLUMNS)
+row_ndjson = RowEncoder(RESULT_COLUMNS, ", ", ": ")
+ranked_row_json = RowEncoder(RESULT_COLUMNS + RANK_COLUMNS)
+ranked_row_ndjson = RowEncoder(RESULT_COLUMNS + RANK_COLUMNS, ", ", ": ")
+
+
+def rows_response(rows, encoder=row_json):
+    """Return a JSON array response of rows, identical to jsonify's."""
+    compact = app.json.compact
+    if compact is False or (compact is None and app.debug):
+        return jsonify([dict(zip(encoder.columns, row)) for row in rows])
+    return app.response_class(encoder.encode_array(rows), mimetype=app.json.mimetype)
+
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+
+
+def wants_ndjson():
+    """True if the client prefers NDJSON over JSON in its Accept header."""
+    accept = request.accept_mimetypes
+    return accept.quality(NDJSON_MIMETYPE) > accept.quality("application/json")
+
+
+class NDJSONRowStream:
+    """Response body that serializes cursor rows one line at a time.
+
+    Holds a pooled connection until the server closes the body, so memory
+    stays constant no matter how many rows match.
+    """
+
+    def __init__(self, stack, first_row, rows, encoder=row_ndjson):
+        self._stack = stack
+        self._first_row = first_row
+        self._rows = rows
+        self._encoder = encoder
+
+    def __iter__(self):
+        encode = self._encoder.encode
+        yield (encode(self._first_row) + "\n").encode()
+        for row in self._rows:
+            yield (encode(row) + "\n").encode()
+
+    def close(self):
+        self._stack.close()
+
+
+def stream_county_rows(zip_code, measure_name, release=None, ranks=False):
+    """Return a streaming NDJSON response for a lookup, or the usual 404."""
+    stack = ExitStack()
+    index = get_lookup_index()
+    try:
+        if index is not None:
+            rows = iter(filter_release(index.lookup(zip_code, (measure_name,)), release))
+            if ranks:
+                conn = stack.enter_context(get_db_connection())
+        else:
+            conn = stack.enter_context(get_db_connection())
+            rows = conn.execute(lookup_query(conn, 1, release),
+                                (zip_code, measure_name, *(release or ())[1:]))
+        if ranks:
+            rows = map(rank_rows(conn), rows)
+        first_row = next(rows, None)
+    except BaseException:
+        stack.close()
+        raise
+    if first_row is None:
+        stack.close()
+        return jsonify({"error": "No data found for provided zip and measure_name"}), 404
+    # The stream holds its connection until the server closes the body, so it
+    # keeps the request's in-flight slot until then rather than until teardown
+    if g.pop("admitted", False):
+        stack.callback(admission.release)
+    encoder = ranked_row_ndjson if ranks else row_ndjson
+    return app.response_class(NDJSONRowStream(stack, first_row, rows, encoder),
+                              mimetype=NDJSON_MIMETYPE)
+
+
+@app.before_request
+def start_request_timer():
+    g.stage_timer = StageTimer()
+
+
+def client_key():
+    """Identify the client a request's rate limit is charged to.
+
+    Unknown API keys are ignored, so rotating made-up keys can't buy a new
+    bucket per request.
+    """
+    api_key = request.headers.get("X-API-Key")
+    if api_key and api_key in app.config["API_KEYS"]:
+        return "key:" + api_key
+    if app.config["TRUST_FORWARDED_FOR"] and request.access_route:
+        return "ip:" + request.access_route[0]
+    return f"ip:{request.remote_addr}"
+
+
+@app.before_request
+def admit_request():
+    """Shed lookups over the rate limit or in-flight bound before any parsing."""
+    if request.endpoint not in ADMITTED_ENDPOINTS:
+        return None
+    wait = admission.take_token(client_key())
+    if wait:
+        metrics.inc("county_admission_rejections_total", {"reason": "rate_limit"})
+        response = jsonify({"error": "Rate limit exceeded"})
+        response.status_code = 429
+        response.headers["Retry-After"] = str(max(1, math.ceil(wait)))
+        return response
+    if not admission.acquire():
+        metrics.inc("county_admission_rejections_total", {"reason": "busy"})
+        response = jsonify({"error": "Server is busy"})
+        response.status_code = 503
+        response.headers["Retry-After"] = str(app.config["BUSY_RETRY_AFTER"])
+        return response
+    g.admitted = True
+    return None
+
+
+@app.errorhandler(PoolTimeout)
+def pool_timeout(exc):
+    """Answer a lookup that waited out the connection pool like other overload 503s."""
+    response = jsonify({"error": "Server is busy"})
+    response.status_code = 503
+    response.headers["Retry-After"] = str(app.config["BUSY_RETRY_AFTER"])
+    return response
+
+
+@app.teardown_request
+def release_admission(exc):
+    """Free the request's in-flight slot, unless a streamed response took it over."""
+    if g.pop("admitted", False):
+        admission.release()
+
+
+@app.after_request
+def record_request_metrics(response):
+    timer = g.get("stage_timer")
+    if timer is None:
+        return response
+    endpoint = request.endpoint or "unmatched"
+    if endpoint == "metrics":
+        return response
+    elapsed = time.perf_counter() - timer.start
+    metrics.inc("county_requests_total", {"endpoint": endpoint, "status": response.status_code})
+    metrics.observe("county_request_seconds", {"endpoint": endpoint}, elapsed)
+    measure = g.get("metrics_measure")
+    if measure is not None:
+        metrics.observe("county_request_measure_seconds",
+                        {"endpoint": endpoint, "measure_name": measure}, elapsed)
+    for stage, seconds in timer.stages:
+        metrics.observe("county_request_stage_seconds", {"endpoint": endpoint, "stage": stage}, seconds)
+    return response
 
 
 @app.route('/')
@@ -33,10 +1574,87 @@ def index():
     return render_template('index.html')
 
 
-@app.route('/county_data', methods=['POST'])
+@app.route('/stats', methods=['GET'])
+def stats():
+    index = get_lookup_index()
+    return jsonify({
+        "pool": get_pool().stats(),
+        "cache": response_cache.stats(),
+        "lookup_index": index.stats if index is not None else None,
+        "admission": admission.stats(),
+    }), 200
+
+
+# Registered as "metrics" so record_request_metrics leaves scrapes out
+@app.route('/metrics', methods=['GET'], endpoint='metrics')
+def metrics_endpoint():
+    gauges = []
+    for key, value in get_pool().stats().items():
+        gauges.append((f"county_db_pool_{key}", {}, value, f"Connection pool {key} (see /stats)."))
+    for key, value in response_cache.stats().items():
+        gauges.append((f"county_response_cache_{key}", {}, value, f"Response cache {key} (see /stats)."))
+    for key, value in admission.stats().items():
+        gauges.append((f"county_admission_{key}", {}, value, f"Admission control {key} (see /stats)."))
+    return app.response_class(metrics.render(gauges), mimetype="text/plain; version=0.0.4")
+
+
+def query_lookup_data():
+    """Build a /county_data payload from GET query parameters.
+
+    measure_name may be repeated to request a profile of several measures.
+    """
+    args = request.args
+    measure_names = args.getlist('measure_name')
+    data = {
+        'zip': args.get('zip'),
+        'measure_name': measure_names[0] if len(measure_names) == 1 else measure_names or None,
+    }
+    if 'coffee' in args:
+        data['coffee'] = args['coffee']
+    if args.get('stream', '').lower() in ('1', 'true'):
+        data['stream'] = True
+    if 'release' in args:
+        data['release'] = args['release']
+    if args.get('ranks', '').lower() in ('1', 'true'):
+        data['ranks'] = True
+    return data
+
+
+def lookup_etag(version, ndjson=False):
+    """Strong ETag for a lookup representation at a data version."""
+    return f"{version}-ndjson" if ndjson else version
+
+
+def add_http_cache_headers(response, etag, last_modified):
+    """Mark a GET lookup response cacheable until the data version changes."""
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.public = True
+    response.cache_control.max_age = app.config["HTTP_CACHE_MAX_AGE"]
+    response.cache_control.s_maxage = app.config["HTTP_CACHE_S_MAXAGE"]
+    response.vary.add("Accept")
+    return response
+
+
+def is_not_modified(etag, last_modified):
+    """True if the request's validators match the current representation."""
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    since = request.if_modified_since
+    return since is not None and last_modified <= since
+
+
+@app.route('/county_data', methods=['GET', 'POST'])
 def county_data():
-    # Ensure JSON content type and payload
-    data = request.get_json(silent=True)
+    timer = g.stage_timer
+
+    # GET takes the lookup from the query string so CDN edges can cache it
+    if request.method == 'GET':
+        data = query_lookup_data()
+    else:
+        # Ensure JSON content type and payload
+        data = request.get_json(silent=True)
+    timer.mark("parse_json")
     if data is None:
         return jsonify({"error": "Request must be JSON with content-type: application/json"}), 400
 
@@ -47,71 +1665,248 @@ def county_data():
     zip_code = data.get('zip')
     measure_name = data.get('measure_name')
 
-    # Validate required inputs
-    if not zip_code or not measure_name:
-        return jsonify({"error": "Both 'zip' and 'measure_name' are required"}), 400
+    error = validate_lookup(zip_code, measure_name, allow_multiple=True)
+    release, release_error = parse_release(data.get('release'))
+    timer.mark("validate")
+    if error or release_error:
+        return jsonify({"error": error or release_error}), 400
 
-    # Validate zip format (5 digits)
-    if not re.fullmatch(r"\d{5}", str(zip_code)):
-        return jsonify({"error": "'zip' must be a 5-digit ZIP code"}), 400
+    # "*" or a list of measures returns a profile grouped by county and measure
+    profile = not isinstance(measure_name, str) or measure_name == "*"
+    if profile and release and release[0] == "range":
+        return jsonify({"error": "A 'release' range needs a single 'measure_name'"}), 400
+    measures = lookup_measures(measure_name)
+    g.metrics_measure = "*" if profile else measure_name
+    stream = not profile and (data.get('stream') is True or wants_ndjson())
+    ranks = data.get('ranks') is True
 
-    # Validate measure_name against allowed list
-    if measure_name not in ALLOWED_MEASURES:
-        return jsonify({"error": "'measure_name' is invalid"}), 400
+    # Answer conditional GETs from the data version alone, without a lookup
+    http_cache = None
+    if request.method == 'GET':
+        current = dataset_version()
+        if current is not None:
+            version, last_modified = current
+            http_cache = (lookup_etag(version, stream), last_modified)
+            if is_not_modified(*http_cache):
+                timer.mark("conditional")
+                return add_http_cache_headers(app.response_class(status=304), *http_cache)
 
-    # Perform parameterized query joining zip_county and county_health_rankings
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        query = (
-            """
-            SELECT
-                chr.state,
-                chr.county,
-                chr.state_code,
-                chr.county_code,
-                chr.year_span,
-                chr.measure_name,
-                chr.measure_id,
-                chr.numerator,
-                chr.denominator,
-                chr.raw_value,
-                chr.confidence_interval_lower_bound,
-                chr.confidence_interval_upper_bound,
-                chr.data_release_year,
-                chr.fipscode
-            FROM county_health_rankings AS chr
-            JOIN zip_county AS zc
-              ON TRIM(zc.county_code) = TRIM(chr.fipscode)
-             AND zc.state_abbreviation = chr.state
-            WHERE zc.zip = ? AND chr.measure_name = ?
-            """
-        )
-        cursor.execute(query, (zip_code, measure_name))
-        rows = cursor.fetchall()
+    response = lookup_response(zip_code, measure_name, measures, profile, stream, release, ranks)
+    if http_cache is not None and response.status_code in (200, 404):
+        add_http_cache_headers(response, *http_cache)
+    return response
 
-    if not rows:
-        return jsonify({"error": "No data found for provided zip and measure_name"}), 404
 
+def lookup_response(zip_code, measure_name, measures, profile, stream, release=None,
+                    ranks=False):
+    """Look up a validated /county_data request and build its response."""
+    timer = g.stage_timer
+
+    # Opt-in streaming of single-measure lookups, read straight off the cursor
+    if stream:
+        return make_response(stream_county_rows(zip_code, measure_name, release, ranks))
+
+    # Serve repeat lookups from the response cache while the data is unchanged
+    cache_key = (zip_code, measures, profile, release, ranks)
+    version = cache_version()
+    if version is not None:
+        cached = response_cache.get(cache_key, version)
+        if cached is not None:
+            timer.mark("cache")
+            body, status = cached
+            return app.response_class(body, status=status, mimetype="application/json")
+        timer.mark("cache")
+
+    index = get_lookup_index()
+    if index is not None:
+        # Answer from the in-memory index without touching the database
+        rows = filter_release(index.lookup(zip_code, measures), release)
+        if ranks and rows:
+            with get_db_connection() as conn:
+                rows = list(map(rank_rows(conn), rows))
+        timer.mark("query")
+    else:
+        # Perform parameterized query against the serving rows for this zip
+        with get_db_connection() as conn:
+            timer.mark("connection")
+            rows = run_lookup_query(
+                conn,
+                "profile_lookup" if profile else "county_lookup",
+                lookup_query(conn, len(measures), release),
+                (zip_code, *measures, *(release or ())[1:]),
+                zip_code,
+                g.metrics_measure,
+            )
+            if ranks:
+                rows = list(map(rank_rows(conn), rows))
+            timer.mark("query")
+
+    columns = RESULT_COLUMNS + RANK_COLUMNS if ranks else RESULT_COLUMNS
+    if rows and profile:
+        response = jsonify(group_profile(zip_code, rows, columns))
+    elif rows and release and release[0] == "range":
+        response = jsonify(group_series(zip_code, measure_name, release, rows, columns))
+    elif rows:
+        response = rows_response(rows, ranked_row_json if ranks else row_json)
+    else:
+        response = jsonify({"error": "No data found for provided zip and measure_name"})
+        response.status_code = 404
+    timer.mark("serialize")
+
+    if version is not None:
+        response_cache.put(cache_key, version, response.get_data(), response.status_code)
+    return response
+
+
+@app.route('/county_data/batch', methods=['POST'])
+def county_data_batch():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Request must be JSON with content-type: application/json"}), 400
+
+    # Special 418 case supersedes all other behavior
+    if data.get('coffee') == 'teapot':
+        return jsonify({"error": "I'm a teapot"}), 418
+
+    # Accept explicit items or the cross product of zips x measure_names
+    if 'items' in data:
+        items = data['items']
+        if not isinstance(items, list):
+            return jsonify({"error": "'items' must be a list"}), 400
+    elif 'zips' in data or 'measure_names' in data:
+        zips = data.get('zips')
+        measure_names = data.get('measure_names')
+        if not isinstance(zips, list) or not isinstance(measure_names, list):
+            return jsonify({"error": "'zips' and 'measure_names' must both be lists"}), 400
+        items = None
+    else:
+        return jsonify({"error": "Either 'items' or 'zips' and 'measure_names' are required"}), 400
+
+    # Size the cross product before building it, so oversized batches stay cheap to reject
+    max_items = app.config["BATCH_MAX_ITEMS"]
+    item_count = len(items) if items is not None else len(zips) * len(measure_names)
+    if item_count > max_items:
+        return jsonify({"error": f"Batch exceeds the maximum of {max_items} items"}), 413
+    if items is None:
+        items = [{"zip": z, "measure_name": m} for z in zips for m in measure_names]
+
+    # Validate each item with the same rules as /county_data
     results = []
-    for row in rows:
-        results.append({
-            "state": row["state"],
-            "county": row["county"],
-            "state_code": row["state_code"],
-            "county_code": row["county_code"],
-            "year_span": row["year_span"],
-            "measure_name": row["measure_name"],
-            "measure_id": row["measure_id"],
-            "numerator": row["numerator"],
-            "denominator": row["denominator"],
-            "raw_value": row["raw_value"],
-            "confidence_interval_lower_bound": row["confidence_interval_lower_bound"],
-            "confidence_interval_upper_bound": row["confidence_interval_upper_bound"],
-            "data_release_year": row["data_release_year"],
-            "fipscode": row["fipscode"],
+    pairs = []
+    for item in items:
+        if not isinstance(item, dict):
+            results.append({"status": 400, "error": "Each item must be a JSON object"})
+            continue
+        result = {"zip": item.get('zip'), "measure_name": item.get('measure_name')}
+        results.append(result)
+        if item.get('coffee') == 'teapot':
+            result.update(status=418, error="I'm a teapot")
+            continue
+        error = validate_lookup(result["zip"], result["measure_name"])
+        if error:
+            result.update(status=400, error=error)
+            continue
+        result["zip"] = str(result["zip"])
+        pairs.append((result["zip"], result["measure_name"]))
+
+    # Answer every valid pair with one set-based query
+    found = {}
+    index = get_lookup_index()
+    if pairs and index is not None:
+        for pair in dict.fromkeys(pairs):
+            rows = index.lookup(pair[0], (pair[1],))
+            if rows:
+                found[pair] = [dict(zip(RESULT_COLUMNS, row)) for row in rows]
+    elif pairs:
+        with get_db_connection() as conn:
+            found = fetch_batch_rows(conn, list(dict.fromkeys(pairs)))
+
+    for result in results:
+        if "status" in result:
+            continue
+        rows = found.get((result["zip"], result["measure_name"]))
+        if rows:
+            result.update(status=200, data=rows)
+        else:
+            result.update(status=404, error="No data found for provided zip and measure_name")
+
+    return jsonify({"results": results}), 200
+
+
+@app.route('/county_data/aggregate', methods=['POST'])
+def county_data_aggregate():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Request must be JSON with content-type: application/json"}), 400
+
+    # Special 418 case supersedes all other behavior
+    if data.get('coffee') == 'teapot':
+        return jsonify({"error": "I'm a teapot"}), 418
+
+    measure_name = data.get('measure_name')
+    release_year = data.get('data_release_year')
+    if not measure_name or release_year is None:
+        return jsonify({"error": "Both 'measure_name' and 'data_release_year' are required"}), 400
+    if not isinstance(measure_name, str) or measure_name not in ALLOWED_MEASURES:
+        return jsonify({"error": "'measure_name' is invalid"}), 400
+    if isinstance(release_year, bool) or not re.fullmatch(r"\d{4}", str(release_year)):
+        return jsonify({"error": "'data_release_year' must be a 4-digit year"}), 400
+    release_year = int(release_year)
+
+    # Roll up by state (all states by default), or over one list of counties
+    scopes = [key for key in ('state', 'fipscodes', 'zips') if key in data]
+    if len(scopes) > 1:
+        return jsonify({"error": "Only one of 'state', 'fipscodes' or 'zips' may be given"}), 400
+    scope = scopes[0] if scopes else 'state'
+    values = data.get(scope, [])
+    if scope == 'state' and isinstance(values, str):
+        values = [values]
+    patterns = {'state': r"[A-Z]{2}", 'fipscodes': r"\d{1,5}", 'zips': r"\d{5}"}
+    if not isinstance(values, list) or (scope != 'state' and not values) \
+            or not all(isinstance(v, str) and re.fullmatch(patterns[scope], v) for v in values):
+        messages = {
+            'state': "'state' must be a 2-letter state code or a list of them",
+            'fipscodes': "'fipscodes' must be a non-empty list of FIPS codes",
+            'zips': "'zips' must be a non-empty list of 5-digit ZIP codes",
+        }
+        return jsonify({"error": messages[scope]}), 400
+
+    max_items = app.config["BATCH_MAX_ITEMS"]
+    if len(values) > max_items:
+        return jsonify({"error": f"Aggregate exceeds the maximum of {max_items} items"}), 413
+    values = tuple(sorted(set(values)))
+    g.metrics_measure = measure_name
+
+    # Serve repeat rollups from the response cache while the data is unchanged
+    cache_key = ("aggregate", measure_name, release_year, scope, values)
+    version = cache_version()
+    if version is not None:
+        cached = response_cache.get(cache_key, version)
+        if cached is not None:
+            body, status = cached
+            return app.response_class(body, status=status, mimetype="application/json")
+
+    with get_db_connection() as conn:
+        rows = fetch_aggregates(conn, measure_name, release_year, scope, values)
+
+    if rows:
+        response = jsonify({
+            "measure_name": measure_name,
+            "data_release_year": release_year,
+            "groups": [aggregate_group(row) for row in rows],
         })
+    else:
+        response = jsonify({"error": "No data found for provided scope, measure_name and data_release_year"})
+        response.status_code = 404
+
+    if version is not None:
+        response_cache.put(cache_key, version, response.get_data(), response.status_code)
+    return response
+
 
-    return jsonify(results), 200
+# Do the first request's setup at import, while the instance starts
+if app.config["PREWARM"]:
+    prewarm()
 
 if __name__ == '__main__':
     app.run(debug=True)
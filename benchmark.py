@@ -0,0 +1,666 @@
+#!/usr/bin/env python3
+"""
+API Benchmark Harness
+
+Generates a realistic-size synthetic database and replays a request mix
+against the Flask app, reporting latency percentiles, throughput and peak
+memory as JSON so runs can be compared between commits.
+
+Usage:
+    python benchmark.py generate bench.db
+    python benchmark.py run --db bench.db [--requests payloads.jsonl]
+                            [--mode inprocess|wsgi|asgi|asgi-http] [--concurrency 8]
+                            [--count 5000] [--output results.json]
+    python benchmark.py coldstart --db bench.db [--runs 10]
+    python benchmark.py serialize --db bench.db [--rows 20]
+
+A requests file holds one JSON payload per line, as it would be POSTed to
+/county_data. Without one, a skewed mix of popular ZIPs, all measures,
+unknown ZIPs and invalid payloads is generated from the database.
+
+coldstart starts a fresh interpreter per run, as a new serverless instance
+would, and reports time-to-first-response for a GET /county_data lookup with
+and without PREWARM, plus the slowest imports under api.index.
+
+serialize times JSON encoding of lookup rows, per row, with the dict and
+jsonify path and with the API's RowEncoder, and checks they produce the
+same bytes.
+"""
+
+import argparse
+import http.client
+import importlib.util
+import json
+import os
+import random
+import resource
+import sqlite3
+import subprocess
+import timeit
+import tempfile
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+from io import StringIO
+
+# Add the current directory to the Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import csv_to_sqlite
+from api import index as api_index
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Run in each cold-start interpreter: import the app, then time the first and
+# a second lookup straight through the WSGI callable. One JSON line is
+# printed per request, the first as soon as its response is complete.
+COLD_START_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+from api.index import app
+imported = time.perf_counter()
+from werkzeug.test import create_environ
+
+def lookup():
+    began = time.perf_counter()
+    environ = create_environ("/county_data", query_string={"zip": sys.argv[1], "measure_name": sys.argv[2]})
+    statuses = []
+    response = app(environ, lambda status, headers, exc_info=None: statuses.append(status))
+    try:
+        b"".join(response)
+    finally:
+        response.close()
+    return int(statuses[0].split()[0]), time.perf_counter() - began
+
+status, first = lookup()
+print(json.dumps({"import": imported - start, "first_request": first, "status": status,
+                  "templates_loaded": "jinja_env" in app.__dict__}), flush=True)
+print(json.dumps({"warm_request": lookup()[1]}), flush=True)
+"""
+
+STATES = ["AL", "AZ", "CA", "CO", "FL", "GA", "IL", "MA", "MI", "NY", "OH", "PA", "TX", "WA"]
+
+
+def generate_database(db_path, zips=40000, counties=3200, releases=6, seed=1060):
+    """
+    Build zip_county and county_health_rankings tables of roughly production
+    size, then run the same serving-table step as csv_to_sqlite.py.
+    """
+    rng = random.Random(seed)
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    csv_to_sqlite.set_bulk_load_pragmas(cursor, "OFF")
+    cursor.execute("BEGIN")
+
+    cursor.execute("CREATE TABLE zip_county (zip TEXT, county_code TEXT, state_abbreviation TEXT)")
+    cursor.execute(
+        "CREATE TABLE county_health_rankings (state TEXT, county TEXT, state_code TEXT, "
+        "county_code TEXT, year_span TEXT, measure_name TEXT, measure_id INTEGER, "
+        "numerator REAL, denominator REAL, raw_value REAL, "
+        "confidence_interval_lower_bound REAL, confidence_interval_upper_bound REAL, "
+        "data_release_year INTEGER, fipscode TEXT)"
+    )
+
+    county_keys = []
+    for i in range(counties):
+        state_index = i % len(STATES)
+        state_code = f"{state_index + 1:02d}"
+        county_code = f"{i // len(STATES) + 1:03d}"
+        county_keys.append((STATES[state_index], state_code, county_code, state_code + county_code))
+
+    # Most ZIPs sit in one county; some straddle two or three
+    zip_rows = []
+    for z in range(zips):
+        zip_code = f"{z * 99999 // zips:05d}"
+        for key in rng.sample(county_keys, rng.choice([1, 1, 1, 2, 3])):
+            zip_rows.append((zip_code, key[3], key[0]))
+    cursor.executemany("INSERT INTO zip_county VALUES (?, ?, ?)", zip_rows)
+
+    measures = sorted(api_index.ALLOWED_MEASURES)
+    first_release = 2025 - releases
+    chr_rows = []
+    for state, state_code, county_code, fipscode in county_keys:
+        for measure_id, measure in enumerate(measures, start=1):
+            for release in range(first_release, 2025):
+                denominator = float(rng.randint(1000, 500000))
+                numerator = float(rng.randint(0, int(denominator) // 4))
+                raw_value = numerator / denominator
+                chr_rows.append((
+                    state, f"County {fipscode}", state_code, county_code,
+                    f"{release - 3}-{release - 1}", measure, measure_id,
+                    numerator, denominator, raw_value, raw_value * 0.9, raw_value * 1.1,
+                    release, fipscode,
+                ))
+    cursor.executemany(f"INSERT INTO county_health_rankings VALUES ({', '.join(['?'] * 14)})", chr_rows)
+
+    with redirect_stdout(StringIO()):
+        csv_to_sqlite.build_serving_tables(cursor)
+    conn.commit()
+    csv_to_sqlite.reset_pragmas(cursor)
+    conn.close()
+    return {"zip_county": len(zip_rows), "county_health_rankings": len(chr_rows)}
+
+
+def load_request_mix(path):
+    """
+    Read one JSON payload per line from a requests file.
+    """
+    with open(path, 'r', encoding='utf-8') as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def synthetic_request_mix(db_path, count, seed=1060):
+    """
+    Build a skewed request mix: a few thousand popular ZIPs take most of the
+    traffic, with some profile lookups, unknown ZIPs and invalid payloads.
+    """
+    rng = random.Random(seed)
+    conn = sqlite3.connect(db_path)
+    zips = [row[0] for row in conn.execute("SELECT DISTINCT zip FROM zip_county ORDER BY zip")]
+    conn.close()
+    measures = sorted(api_index.ALLOWED_MEASURES)
+    popular = rng.sample(zips, min(len(zips), 2000))
+
+    payloads = []
+    for _ in range(count):
+        roll = rng.random()
+        zip_code = rng.choice(popular) if rng.random() < 0.8 else rng.choice(zips)
+        if roll < 0.85:
+            payloads.append({"zip": zip_code, "measure_name": rng.choice(measures)})
+        elif roll < 0.90:
+            payloads.append({"zip": zip_code, "measure_name": "*"})
+        elif roll < 0.95:
+            payloads.append({"zip": "99999", "measure_name": rng.choice(measures)})
+        else:
+            payloads.append({"zip": zip_code[:4], "measure_name": rng.choice(measures)})
+    return payloads
+
+
+def percentile(sorted_values, fraction):
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[rank]
+
+
+def summarize(latencies, statuses, elapsed):
+    """
+    Turn raw per-request latencies (seconds) into the JSON report fields.
+    """
+    ordered = sorted(latencies)
+    status_counts = {}
+    for status in statuses:
+        status_counts[str(status)] = status_counts.get(str(status), 0) + 1
+    to_ms = lambda value: None if value is None else round(value * 1000, 3)
+    return {
+        "requests": len(ordered),
+        "elapsed_seconds": round(elapsed, 3),
+        "requests_per_second": round(len(ordered) / elapsed, 1) if elapsed else None,
+        "latency_ms": {
+            "p50": to_ms(percentile(ordered, 0.50)),
+            "p95": to_ms(percentile(ordered, 0.95)),
+            "p99": to_ms(percentile(ordered, 0.99)),
+            "max": to_ms(ordered[-1] if ordered else None),
+        },
+        "status_counts": status_counts,
+        "peak_rss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def run_concurrently(send, payloads, concurrency):
+    """
+    Send every payload with `concurrency` worker threads. `send` is called
+    as send(worker_state, payload) and returns the HTTP status.
+    """
+    latencies = []
+    statuses = []
+    lock = threading.Lock()
+    local = threading.local()
+
+    def worker(payload):
+        start = time.perf_counter()
+        status = send(local, payload)
+        latency = time.perf_counter() - start
+        with lock:
+            latencies.append(latency)
+            statuses.append(status)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, payloads))
+    return latencies, statuses, time.perf_counter() - start
+
+
+def send_inprocess(local, payload, endpoint="/county_data"):
+    """
+    POST through a per-thread Flask test client.
+    """
+    if not hasattr(local, "client"):
+        local.client = api_index.app.test_client()
+    response = local.client.post(endpoint, data=json.dumps(payload), content_type="application/json")
+    response.get_data()
+    return response.status_code
+
+
+def make_http_sender(port, endpoint="/county_data"):
+    """
+    Return a sender that POSTs over a per-thread HTTP connection.
+    """
+    def send(local, payload):
+        body = json.dumps(payload)
+        for attempt in range(2):
+            if not hasattr(local, "conn"):
+                local.conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+            try:
+                local.conn.request("POST", endpoint, body=body,
+                                   headers={"Content-Type": "application/json"})
+                response = local.conn.getresponse()
+                response.read()
+                if response.getheader("Connection", "").lower() == "close":
+                    del local.conn
+                return response.status
+            except (http.client.HTTPException, ConnectionError):
+                del local.conn
+                if attempt:
+                    raise
+    return send
+
+
+def run_wsgi(payloads, concurrency, endpoint="/county_data"):
+    """
+    Serve the app from a local threaded WSGI server and replay over HTTP.
+    """
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class QuietRequestHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server("127.0.0.1", 0, api_index.app, threaded=True,
+                         request_handler=QuietRequestHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        return run_concurrently(make_http_sender(server.server_port, endpoint), payloads, concurrency)
+    finally:
+        server.shutdown()
+
+
+def run_asgi_http(payloads, concurrency, endpoint="/county_data"):
+    """
+    Serve the ASGI entry point from uvicorn and replay over HTTP with the
+    same clients as run_wsgi, so the two servers are compared like for like.
+    """
+    import uvicorn
+    from api.asgi import AsgiApp
+
+    asgi_app = AsgiApp(api_index.app, api_index.app.config["ASGI_WORKERS"],
+                       api_index.app.config["ASGI_MAX_BODY_BYTES"])
+    # Let uvicorn bind the port itself, as in production: it sets TCP_NODELAY
+    # on accepted connections, and a pre-bound socket would not get it
+    server = uvicorn.Server(uvicorn.Config(asgi_app, host="127.0.0.1", port=0,
+                                           log_level="warning", access_log=False))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    try:
+        while not server.started:
+            if not thread.is_alive():
+                raise RuntimeError("uvicorn failed to start")
+            time.sleep(0.01)
+        port = server.servers[0].sockets[0].getsockname()[1]
+        return run_concurrently(make_http_sender(port, endpoint), payloads, concurrency)
+    finally:
+        server.should_exit = True
+        thread.join()
+
+
+def run_asgi(payloads, concurrency, endpoint="/county_data"):
+    """
+    Drive the ASGI entry point in-process from `concurrency` concurrent
+    client coroutines; requests run on its bounded executor. There are no
+    sockets or HTTP parsing, so compare it with --mode inprocess, not wsgi.
+    """
+    import asyncio
+    from api.asgi import AsgiApp
+
+    asgi_app = AsgiApp(api_index.app, api_index.app.config["ASGI_WORKERS"],
+                       api_index.app.config["ASGI_MAX_BODY_BYTES"])
+    latencies = []
+    statuses = []
+
+    async def client(queue):
+        while queue:
+            body = json.dumps(queue.pop()).encode("utf-8")
+            request = [{"type": "http.request", "body": body, "more_body": False}]
+            status = []
+
+            async def receive():
+                return request.pop() if request else {"type": "http.disconnect"}
+
+            async def send(message):
+                if message["type"] == "http.response.start":
+                    status.append(message["status"])
+
+            start = time.perf_counter()
+            await asgi_app({
+                "type": "http", "http_version": "1.1", "method": "POST", "path": endpoint,
+                "query_string": b"", "headers": [(b"content-type", b"application/json")],
+            }, receive, send)
+            latencies.append(time.perf_counter() - start)
+            statuses.append(status[0])
+
+    async def run():
+        queue = list(reversed(payloads))
+        await asyncio.gather(*(client(queue) for _ in range(concurrency)))
+
+    start = time.perf_counter()
+    try:
+        asyncio.run(run())
+    finally:
+        asgi_app.executor.shutdown()
+    return latencies, statuses, time.perf_counter() - start
+
+
+def configure_app(db_path, use_cache, serving_mode="sqlite", snapshot_path=None):
+    """
+    Point the app at the benchmark database with a fresh pool and cache.
+    """
+    api_index.app.config["DATABASE"] = os.path.abspath(db_path)
+    api_index.app.config["SERVING_MODE"] = serving_mode
+    if snapshot_path:
+        api_index.app.config["SNAPSHOT_PATH"] = os.path.abspath(snapshot_path)
+    api_index.close_pool()
+    api_index.response_cache.clear()
+    api_index.response_cache.max_entries = api_index.app.config["RESPONSE_CACHE_MAX_ENTRIES"] if use_cache else 0
+
+
+def run_benchmark(args):
+    """
+    Replay the request mix and return the report dict.
+    """
+    configure_app(args.db, args.cache, args.serving_mode, args.snapshot)
+    api_index.get_lookup_index()
+    if args.requests:
+        payloads = load_request_mix(args.requests)
+        if args.count:
+            payloads = (payloads * (args.count // len(payloads) + 1))[:args.count]
+    else:
+        payloads = synthetic_request_mix(args.db, args.count or 5000, args.seed)
+
+    if args.max_in_flight is not None:
+        api_index.admission.max_in_flight = args.max_in_flight
+    warmup = payloads[:args.warmup]
+    runners = {"asgi": run_asgi, "asgi-http": run_asgi_http, "wsgi": run_wsgi}
+    if args.mode in runners:
+        runner = runners[args.mode]
+        runner(warmup, args.concurrency, args.endpoint)
+        api_index.admission.clear()
+        latencies, statuses, elapsed = runner(payloads, args.concurrency, args.endpoint)
+    else:
+        send = lambda local, payload: send_inprocess(local, payload, args.endpoint)
+        run_concurrently(send, warmup, args.concurrency)
+        api_index.admission.clear()
+        latencies, statuses, elapsed = run_concurrently(send, payloads, args.concurrency)
+
+    report = {
+        "mode": args.mode,
+        "asgi_workers": (api_index.app.config["ASGI_WORKERS"]
+                         if args.mode in ("asgi", "asgi-http") else None),
+        "endpoint": args.endpoint,
+        "concurrency": args.concurrency,
+        "cache": args.cache,
+        "serving_mode": args.serving_mode,
+        "database": args.db,
+    }
+    report.update(summarize(latencies, statuses, elapsed))
+    report["pool"] = api_index.get_pool().stats()
+    report["response_cache"] = api_index.response_cache.stats()
+    report["admission"] = api_index.admission.stats()
+    index = api_index.get_lookup_index()
+    if index is not None:
+        report["lookup_index"] = index.stats
+    return report
+
+
+def cold_start_lookup(db_path, measure_name):
+    """
+    Return a ZIP with rows for measure_name, for the cold-start lookup.
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        row = conn.execute(
+            "SELECT zc.zip FROM zip_county AS zc JOIN county_health_rankings AS chr"
+            " ON zc.county_code = chr.fipscode AND zc.state_abbreviation = chr.state"
+            " WHERE chr.measure_name = ? LIMIT 1",
+            (measure_name,),
+        ).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        raise ValueError(f"No ZIP in {db_path} has rows for {measure_name!r}")
+    return row[0]
+
+
+def run_cold_start_once(args, zip_code, prewarm, importtime=False):
+    """
+    Start one interpreter and return (its timings, its stderr).
+    """
+    env = dict(
+        os.environ,
+        COUNTY_DB_PATH=os.path.abspath(args.db),
+        SERVING_MODE=args.serving_mode,
+        PREWARM="1" if prewarm else "0",
+        RESPONSE_CACHE_MAX_ENTRIES="0",
+    )
+    if args.snapshot:
+        env["SNAPSHOT_PATH"] = os.path.abspath(args.snapshot)
+    command = [sys.executable] + (["-X", "importtime"] if importtime else [])
+    command += ["-c", COLD_START_SCRIPT, zip_code, args.measure_name]
+    # stderr goes to a file so -X importtime output can't fill a pipe
+    with tempfile.TemporaryFile("w+") as stderr:
+        start = time.perf_counter()
+        process = subprocess.Popen(command, cwd=ROOT, env=env, text=True,
+                                   stdout=subprocess.PIPE, stderr=stderr)
+        first = process.stdout.readline()
+        time_to_first_response = time.perf_counter() - start
+        rest = process.stdout.read()
+        process.wait()
+        stderr.seek(0)
+        errors = stderr.read()
+    if process.returncode != 0 or not first:
+        raise RuntimeError(f"cold start run failed:\n{errors}")
+    result = json.loads(first)
+    result.update(json.loads(rest))
+    result["time_to_first_response"] = time_to_first_response
+    return result, errors
+
+
+def import_breakdown(importtime_output, top=10):
+    """
+    Return api.index's own import time and its slowest direct imports, in ms,
+    from python -X importtime output.
+    """
+    entries = []
+    for line in importtime_output.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _, self_us, cumulative_us, name = (part for part in [line[:12]] + line[12:].split("|"))
+        depth = len(name) - len(name.lstrip())
+        entries.append((depth, name.strip(), int(self_us), int(cumulative_us)))
+    # Children are printed before their parent, one indent level deeper
+    position = next(i for i, entry in enumerate(entries) if entry[1] == "api.index")
+    depth, _, self_us, cumulative_us = entries[position]
+    children = []
+    for child_depth, name, _, child_cumulative in reversed(entries[:position]):
+        if child_depth <= depth:
+            break
+        if child_depth == depth + 2:
+            children.append({"module": name, "cumulative_ms": round(child_cumulative / 1000, 3)})
+    children.sort(key=lambda child: child["cumulative_ms"], reverse=True)
+    return {
+        "api.index_ms": round(cumulative_us / 1000, 3),
+        "api.index_self_ms": round(self_us / 1000, 3),
+        "slowest": children[:top],
+    }
+
+
+def run_cold_start(args):
+    """
+    Measure fresh-interpreter starts with and without PREWARM.
+    """
+    zip_code = args.zip or cold_start_lookup(args.db, args.measure_name)
+    to_ms = lambda value: round(value * 1000, 3)
+    report = {
+        "database": args.db,
+        "serving_mode": args.serving_mode,
+        "runs": args.runs,
+        "zip": zip_code,
+        "measure_name": args.measure_name,
+    }
+    for label, prewarm in (("prewarm", True), ("no_prewarm", False)):
+        results = [run_cold_start_once(args, zip_code, prewarm)[0] for _ in range(args.runs)]
+        summary = {}
+        for key in ("time_to_first_response", "import", "first_request", "warm_request"):
+            values = sorted(result[key] for result in results)
+            summary[f"{key}_ms"] = {
+                "p50": to_ms(percentile(values, 0.50)),
+                "min": to_ms(values[0]),
+                "max": to_ms(values[-1]),
+            }
+        summary["status"] = results[0]["status"]
+        summary["templates_loaded"] = any(result["templates_loaded"] for result in results)
+        report[label] = summary
+    _, errors = run_cold_start_once(args, zip_code, True, importtime=True)
+    report["imports"] = import_breakdown(errors)
+    return report
+
+
+def run_serialize(args):
+    """
+    Compare per-row serialization cost of dicts + jsonify and RowEncoder.
+    """
+    conn = sqlite3.connect(args.db)
+    try:
+        rows = conn.execute(
+            f"SELECT {', '.join(api_index.RESULT_COLUMNS)} FROM county_health_rankings LIMIT ?",
+            (args.rows,),
+        ).fetchall()
+    finally:
+        conn.close()
+    columns = api_index.RESULT_COLUMNS
+    dumps = api_index.app.json.dumps
+    cases = {
+        "array": (
+            lambda: api_index.jsonify([dict(zip(columns, row)) for row in rows]).get_data(),
+            lambda: api_index.rows_response(rows).get_data(),
+        ),
+        "ndjson": (
+            lambda: b"".join((dumps(dict(zip(columns, row))) + "\n").encode() for row in rows),
+            lambda: b"".join((api_index.row_ndjson.encode(row) + "\n").encode() for row in rows),
+        ),
+    }
+    report = {"database": args.db, "rows": len(rows), "iterations": args.iterations}
+    with api_index.app.app_context():
+        for name, (dicts, encoder) in cases.items():
+            per_row_us = {}
+            for label, serialize in (("dicts", dicts), ("row_encoder", encoder)):
+                best = min(timeit.repeat(serialize, number=args.iterations, repeat=5))
+                per_row_us[label] = round(best / args.iterations / len(rows) * 1e6, 3)
+            report[name] = {
+                "per_row_us": per_row_us,
+                "speedup": round(per_row_us["dicts"] / per_row_us["row_encoder"], 2),
+                "identical": dicts() == encoder(),
+            }
+    return report
+
+
+def parse_args(argv):
+    """
+    Parse command line arguments.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the county data API.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    generate = subparsers.add_parser("generate", help="build a synthetic benchmark database")
+    generate.add_argument("db", help="database file to create")
+    generate.add_argument("--zips", type=int, default=40000)
+    generate.add_argument("--counties", type=int, default=3200)
+    generate.add_argument("--releases", type=int, default=6, help="data release years per measure")
+    generate.add_argument("--seed", type=int, default=1060)
+
+    run = subparsers.add_parser("run", help="replay a request mix and report latency")
+    run.add_argument("--db", required=True, help="database to serve")
+    run.add_argument("--requests", help="JSONL file with one /county_data payload per line")
+    run.add_argument("--endpoint", default="/county_data")
+    run.add_argument("--mode", choices=["inprocess", "wsgi", "asgi", "asgi-http"], default="inprocess",
+                     help="Flask test client threads, a threaded WSGI server over HTTP, "
+                          "concurrent coroutines calling the ASGI entry point in-process, "
+                          "or the ASGI entry point under uvicorn over HTTP")
+    run.add_argument("--concurrency", type=int, default=8)
+    run.add_argument("--count", type=int, default=0,
+                     help="requests to send (default: 5000, or every line of --requests)")
+    run.add_argument("--warmup", type=int, default=200)
+    run.add_argument("--no-cache", dest="cache", action="store_false",
+                     help="disable the response cache to measure the database path")
+    run.add_argument("--serving-mode", choices=["sqlite", "memory", "snapshot"], default="sqlite",
+                     help="serve from SQLite, the in-memory index or an mmapped snapshot")
+    run.add_argument("--snapshot", help="snapshot file for --serving-mode snapshot")
+    run.add_argument("--max-in-flight", type=int,
+                     help="override MAX_IN_FLIGHT to find where 503s start (0 is unlimited)")
+    run.add_argument("--seed", type=int, default=1060)
+    run.add_argument("--output", help="write the JSON report here instead of stdout")
+
+    coldstart = subparsers.add_parser("coldstart", help="time fresh-process starts to a first lookup")
+    coldstart.add_argument("--db", required=True, help="database to serve")
+    coldstart.add_argument("--runs", type=int, default=10, help="interpreters started per setting")
+    coldstart.add_argument("--zip", help="ZIP to look up (default: one with rows for --measure-name)")
+    coldstart.add_argument("--measure-name", default="Adult obesity")
+    coldstart.add_argument("--serving-mode", choices=["sqlite", "memory", "snapshot"], default="sqlite")
+    coldstart.add_argument("--snapshot", help="snapshot file for --serving-mode snapshot")
+    coldstart.add_argument("--output", help="write the JSON report here instead of stdout")
+
+    serialize = subparsers.add_parser("serialize", help="time per-row JSON serialization")
+    serialize.add_argument("--db", required=True, help="database to read rows from")
+    serialize.add_argument("--rows", type=int, default=20, help="rows per response")
+    serialize.add_argument("--iterations", type=int, default=2000)
+    serialize.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+    if args.command == "run" and args.mode == "asgi-http" and importlib.util.find_spec("uvicorn") is None:
+        parser.error("--mode asgi-http needs uvicorn (pip install uvicorn)")
+    # Checked here rather than in run_benchmark, where --count would divide by zero.
+    if args.command == "run" and args.requests and not load_request_mix(args.requests):
+        parser.error(f"--requests file {args.requests} has no payloads")
+    return args
+
+
+def main():
+    """
+    Main function to dispatch the benchmark subcommands.
+    """
+    args = parse_args(sys.argv[1:])
+    if args.command == "generate":
+        start = time.perf_counter()
+        counts = generate_database(args.db, args.zips, args.counties, args.releases, args.seed)
+        counts["seconds"] = round(time.perf_counter() - start, 2)
+        print(json.dumps(counts, indent=2))
+        return
+
+    commands = {"coldstart": run_cold_start, "serialize": run_serialize}
+    report = commands.get(args.command, run_benchmark)(args)
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
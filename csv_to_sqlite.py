@@ -5,100 +5,1369 @@ CSV to SQLite Converter
 This script converts a CSV file with a header row to a SQLite database.
 The header row should contain valid SQL column names (no spaces, no special characters).
 
-Usage: python csv_to_sqlite.py <database_name> <csv_file>
+Usage: python csv_to_sqlite.py <database_name> <csv_file> [<csv_file> ...] [--materialize] [--snapshot PATH]
+
+Several files (or glob patterns) can be given, plain or compressed
+(.gz, .bz2, .xz, .zip), or - for stdin. Each is streamed once; chunks
+are parsed and converted by a pool of worker processes and written by a
+single writer.
+
+Column types (INTEGER, REAL or TEXT) are inferred from a sample of the rows;
+use --type column=TYPE to override them and --strict for a STRICT table.
+
+Once both zip_county and county_health_rankings are loaded, the serving
+tables used by the API are (re)built: FIPS join keys are normalized and the
+lookup indexes are created. Pass --no-serving-tables to skip this step.
+
+With --upsert-key COL,COL,... the CSV is merged into the existing table
+instead of replacing it: only new or changed rows are written, and the
+result is built in a copy of the database that atomically replaces it.
 """
 
+import argparse
+import bz2
 import csv
+import errno
+import glob
+import gzip
+import hashlib
+import io
+import json
+import lzma
+import math
 import sqlite3
+import struct
 import sys
 import os
+import re
+import time
+import zipfile
+from array import array
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import ExitStack, contextmanager
+from datetime import datetime, timezone
+from itertools import chain, islice
+from urllib.parse import quote
+
+
+# Rows per executemany call during bulk load.
+DEFAULT_BATCH_SIZE = 10000
+
+# Approximate bytes of CSV converted per worker task during a parallel load.
+DEFAULT_CHUNK_BYTES = 8 * 1024 * 1024
+
+# Decompressors for CSV sources, by file extension.
+COMPRESSED_OPENERS = {".gz": gzip.open, ".bz2": bz2.open, ".xz": lzma.open}
+
+# Rows sampled per file when inferring column types.
+DEFAULT_SAMPLE_SIZE = 1000
+
+# Identifier columns that look numeric but must keep their leading zeros.
+DEFAULT_TYPE_OVERRIDES = {
+    "zip": "TEXT",
+    "fipscode": "TEXT",
+    "county_code": "TEXT",
+    "state_code": "TEXT",
+}
+
+COLUMN_TYPES = ("INTEGER", "REAL", "TEXT")
+
+INTEGER_PATTERN = re.compile(r"[+-]?(0|[1-9][0-9]*)")
+REAL_PATTERN = re.compile(r"[+-]?([0-9]+\.?[0-9]*|\.[0-9]+)([eE][+-]?[0-9]+)?")
+LEADING_ZERO_PATTERN = re.compile(r"[+-]?0[0-9]")
+
+# Page cache used while loading, in KiB (negative values are KiB in SQLite).
+BULK_CACHE_SIZE = -262144
+
+# Columns returned by the /county_data endpoint, in response order.
+SERVING_COLUMNS = [
+    "state",
+    "county",
+    "state_code",
+    "county_code",
+    "year_span",
+    "measure_name",
+    "measure_id",
+    "numerator",
+    "denominator",
+    "raw_value",
+    "confidence_interval_lower_bound",
+    "confidence_interval_upper_bound",
+    "data_release_year",
+    "fipscode",
+]
+
+# Join key columns trimmed at load time so the API joins on plain equality.
+JOIN_KEY_COLUMNS = {
+    "zip_county": ("county_code", "state_abbreviation", "zip"),
+    "county_health_rankings": ("fipscode", "state"),
+}
+
+IDENTIFIER_PATTERN = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+# Key/value table recording the data version the API derives ETags from.
+METADATA_TABLE = "metadata"
+
+# Denormalized (zip, measure_name) -> rows table built by --materialize.
+LOOKUP_TABLE = "zip_measure_lookup"
+
+# (fipscode, state, measure_name) -> latest data_release_year, used by the
+# API's release="latest" lookups.
+LATEST_RELEASE_TABLE = "latest_release"
+
+# Per (state, measure_name, data_release_year) rollups served by the API's
+# /county_data/aggregate endpoint, and the nearest-rank percentiles of
+# raw_value it keeps.
+SUMMARY_TABLE = "state_measure_summary"
+SUMMARY_PERCENTILES = (25, 50, 75, 90)
+
+# (fipscode, state, measure_name, data_release_year) -> raw_value percentile
+# rank and z-score within the state and nationally, returned by the API's
+# /county_data lookups with "ranks": true.
+RANK_TABLE = "county_measure_rank"
+
+# Binary snapshot layout, read by the API's Snapshot class: SNAPSHOT_MAGIC,
+# a little-endian uint32 header length, a JSON header, then 8-byte aligned
+# sections in native byte order whose offsets, item counts and formats are
+# listed in the header.
+SNAPSHOT_MAGIC = b"CHRSNAP1"
+SNAPSHOT_VERSION = 1
+SNAPSHOT_INT_NULL = -2**63
+SNAPSHOT_STRING_NULL = 0xFFFFFFFF
+
+# Representative query the API issues; used to report the query plan.
+SERVING_QUERY_PLAN_SQL = """
+    SELECT chr.*
+    FROM county_health_rankings AS chr
+    JOIN zip_county AS zc
+      ON zc.county_code = chr.fipscode
+     AND zc.state_abbreviation = chr.state
+    WHERE zc.zip = ? AND chr.measure_name = ?
+"""
+
+
+@contextmanager
+def open_csv_source(source):
+    """
+    Open a CSV source for binary reading: a plain file, a .gz, .bz2 or .xz
+    file, a .zip archive holding a single .csv, or '-' for stdin.
+    Compressed input is decompressed as it is read, never to disk.
+    """
+    if source == '-':
+        yield sys.stdin.buffer
+        return
+    suffix = os.path.splitext(source)[1].lower()
+    with ExitStack() as stack:
+        if suffix in COMPRESSED_OPENERS:
+            stream = stack.enter_context(COMPRESSED_OPENERS[suffix](source, 'rb'))
+        elif suffix == '.zip':
+            archive = stack.enter_context(zipfile.ZipFile(source))
+            members = [name for name in archive.namelist() if name.lower().endswith('.csv')]
+            if len(members) != 1:
+                raise ValueError(f"{source} must contain exactly one .csv file, found {len(members)}")
+            stream = stack.enter_context(archive.open(members[0]))
+        else:
+            stream = stack.enter_context(open(source, 'rb'))
+        yield stream
+
+
+@contextmanager
+def open_csv_text(source):
+    """
+    Open a CSV source (see open_csv_source) as UTF-8 text for csv.reader.
+    """
+    with open_csv_source(source) as stream:
+        text = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+        try:
+            yield text
+        finally:
+            # Leave closing the underlying stream (and never stdin) to open_csv_source
+            text.detach()
+
+
+def source_table_name(source):
+    """
+    Return the table name for a CSV source: its file name without the
+    compression and .csv extensions, or None for stdin.
+    """
+    if source == '-':
+        return None
+    name = os.path.basename(source)
+    stem, suffix = os.path.splitext(name)
+    if suffix.lower() in COMPRESSED_OPENERS or suffix.lower() == '.zip':
+        name = stem
+    stem, suffix = os.path.splitext(name)
+    return stem if suffix.lower() == '.csv' else name
+
+
+def classify_value(value):
+    """
+    Return the narrowest column type that can hold a CSV value losslessly.
+    Empty values return None so they don't influence inference.
+    """
+    if value == '':
+        return None
+    if INTEGER_PATTERN.fullmatch(value) and -2**63 <= int(value) < 2**63:
+        return "INTEGER"
+    if REAL_PATTERN.fullmatch(value) and not LEADING_ZERO_PATTERN.match(value):
+        return "REAL"
+    return "TEXT"
+
+
+def infer_types_from_rows(header, rows, overrides=None):
+    """
+    Infer an INTEGER, REAL or TEXT type per header column from sample rows.
+    Values with leading zeros stay TEXT, and overrides (column -> type)
+    take precedence over the sample.
+    Returns a dict mapping column name to type.
+    """
+    seen = [set() for _ in header]
+    for row in rows:
+        for kinds, value in zip(seen, row):
+            kinds.add(classify_value(value))
+
+    column_types = {}
+    for col, kinds in zip(header, seen):
+        kinds.discard(None)
+        if not kinds or "TEXT" in kinds:
+            column_types[col] = "TEXT"
+        elif "REAL" in kinds:
+            column_types[col] = "REAL"
+        else:
+            column_types[col] = "INTEGER"
+
+    merged_overrides = dict(DEFAULT_TYPE_OVERRIDES)
+    merged_overrides.update(overrides or {})
+    for col, col_type in merged_overrides.items():
+        if col in column_types:
+            column_types[col] = col_type
+    return column_types
+
+
+def to_integer(value):
+    """
+    Convert a CSV value for an INTEGER column, keeping anything that
+    wouldn't round-trip (e.g. leading zeros) as text.
+    """
+    if value == '':
+        return None
+    try:
+        number = int(value)
+    except ValueError:
+        return value
+    return number if str(number) == value else value
+
+
+def to_real(value):
+    """
+    Convert a CSV value for a REAL column, keeping non-numeric text as is.
+    """
+    if value == '':
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+CONVERTERS = {"INTEGER": to_integer, "REAL": to_real, "TEXT": None}
+
+
+def create_table(cursor, table_name, header, column_types=None, strict=False):
+    """
+    Create a SQLite table with the header's columns.
+    Columns use the types from column_types (TEXT when missing), and the
+    table is declared STRICT when strict is set.
+    """
+    column_types = column_types or {}
+    
+    # Validate that we have column names
+    if not header:
+        raise ValueError("CSV file appears to be empty or has no header row")
+    
+    # Create table with column names from header (no quotes around column names)
+    column_definitions = ', '.join(f"{col} {column_types.get(col, 'TEXT')}" for col in header)
+    create_table_sql = f"CREATE TABLE {table_name} ({column_definitions})"
+    if strict:
+        create_table_sql += " STRICT"
+    
+    cursor.execute(create_table_sql)
+
+
+def convert_rows(rows, column_names, column_types=None):
+    """
+    Yield CSV rows converted according to column_types (left as text when
+    missing). Short rows are padded with NULLs and long rows truncated to
+    the header.
+    """
+    column_types = column_types or {}
+    converters = [CONVERTERS[column_types.get(col, "TEXT")] for col in column_names]
+    width = len(column_names)
+    padding = [None] * width
+    rows = (row[:width] + padding[len(row):] for row in rows)
+    if any(converters):
+        rows = (
+            [value if convert is None or value is None else convert(value)
+             for convert, value in zip(converters, row)]
+            for row in rows
+        )
+    return rows
 
 
-def create_table_from_csv(cursor, csv_file, table_name):
+def insert_statement(table_name, column_names):
     """
-    Create a SQLite table based on the CSV header row.
-    Returns the column names for data insertion.
+    Return the INSERT statement for a row of column_names (no quotes around column names).
+    """
+    placeholders = ', '.join(['?' for _ in column_names])
+    column_list = ', '.join(column_names)
+    return f"INSERT INTO {table_name} ({column_list}) VALUES ({placeholders})"
+
+
+def insert_rows(cursor, table_name, column_names, rows, batch_size=DEFAULT_BATCH_SIZE,
+                column_types=None):
+    """
+    Insert parsed CSV rows into the SQLite table.
+    Rows are streamed in batches of batch_size through executemany, with
+    values converted according to column_types (left as text when missing).
+    Returns the number of rows inserted.
+    """
+    insert_sql = insert_statement(table_name, column_names)
+    rows = convert_rows(rows, column_names, column_types)
+    
+    row_count = 0
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            break
+        cursor.executemany(insert_sql, batch)
+        row_count += len(batch)
+    return row_count
+
+
+def first_record_end(data):
     """
-    with open(csv_file, 'r', newline='', encoding='utf-8') as file:
+    Return the offset just past the first complete CSV record in data,
+    or len(data) if there is none.
+
+    A newline ends a record only outside a quoted field, i.e. after an even
+    number of '"' characters, since CSV escapes quotes by doubling them.
+    """
+    inside_quotes = False
+    scanned = 0
+    while True:
+        newline = data.find(b'\n', scanned)
+        if newline < 0:
+            return len(data)
+        inside_quotes ^= bool(data.count(b'"', scanned, newline) & 1)
+        scanned = newline + 1
+        if not inside_quotes:
+            return scanned
+
+
+def last_record_end(data):
+    """
+    Return the offset just past the last complete CSV record in data, which
+    must start on a record boundary, or 0 if there is none.
+    """
+    inside_quotes = bool(data.count(b'"') & 1)
+    end = len(data)
+    while True:
+        newline = data.rfind(b'\n', 0, end)
+        if newline < 0:
+            return 0
+        inside_quotes ^= bool(data.count(b'"', newline, end) & 1)
+        end = newline
+        if not inside_quotes:
+            return newline + 1
+
+
+def read_record_chunks(stream, chunk_bytes=DEFAULT_CHUNK_BYTES):
+    """
+    Yield the bytes of a binary stream in chunks of at least chunk_bytes
+    (except the last) that each end on a CSV record boundary.
+    """
+    pending = b''
+    while True:
+        block = stream.read(chunk_bytes)
+        if not block:
+            break
+        pending += block
+        end = last_record_end(pending)
+        if end:
+            yield pending[:end]
+            pending = pending[end:]
+    if pending:
+        yield pending
+
+
+def parse_chunk(chunk):
+    """
+    Return a csv.reader over a chunk of complete CSV records.
+    """
+    return csv.reader(io.StringIO(chunk.decode('utf-8'), newline=''))
+
+
+def convert_csv_chunk(chunk, column_names, column_types, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Parse and convert a chunk of CSV records.
+    Runs in a worker process; returns the converted rows in batches of at
+    most batch_size, one executemany call each.
+    """
+    # Tuples unpickle faster in the writer process than lists
+    rows = map(tuple, convert_rows(parse_chunk(chunk), column_names, column_types))
+    batches = []
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            return batches
+        batches.append(batch)
+
+
+def submit_task(executor, fn, *args):
+    """
+    Run fn on the executor, or inline when executor is None; returns a Future.
+    """
+    if executor is not None:
+        return executor.submit(fn, *args)
+    future = Future()
+    future.set_result(fn(*args))
+    return future
+
+
+def load_csv_sources(cursor, sources, workers=1, sample_size=DEFAULT_SAMPLE_SIZE,
+                     type_overrides=None, strict=False, chunk_bytes=DEFAULT_CHUNK_BYTES,
+                     max_pending=None, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Drop, recreate and load tables from CSV sources, reading each source once.
+
+    sources is a list of (source, table_name). Each source is read as a
+    stream of record-aligned chunks; the header and a type-inference sample
+    come from the first chunk, and a table is created from its first
+    source (later sources for the table must have the same header).
+    Worker processes parse and convert chunks in parallel while this
+    process inserts them in order as the single SQLite writer. At most
+    max_pending chunks (default: two per worker) are in flight, which
+    bounds memory. With workers <= 1 chunks are converted inline. Each
+    chunk's rows are inserted batch_size rows per executemany call.
+    Returns a list of per-source stats dicts (file, table, rows, bytes, seconds).
+    """
+    max_pending = max_pending or max(2 * workers, 1)
+    executor = ProcessPoolExecutor(workers) if workers > 1 else None
+    tables = {}
+    stats = []
+    try:
+        for source, table_name in sources:
+            started = time.perf_counter()
+            with open_csv_source(source) as stream:
+                chunks = read_record_chunks(stream, chunk_bytes)
+                first = next(chunks, b'')
+                header_end = first_record_end(first)
+                header = next(parse_chunk(first[:header_end]), [])
+                first = first[header_end:]
+
+                # Create the table from the header and a sample of the first chunk
+                if table_name not in tables:
+                    column_types = infer_types_from_rows(
+                        header, islice(parse_chunk(first), sample_size), type_overrides)
+                    cursor.execute(f"DROP TABLE IF EXISTS {table_name}")
+                    create_table(cursor, table_name, header, column_types, strict)
+                    column_summary = ', '.join(f"{col} {column_types[col]}" for col in header)
+                    print(f"Created table '{table_name}' with columns: {column_summary}")
+                    tables[table_name] = (header, column_types, source)
+                column_names, column_types, first_source = tables[table_name]
+                if header != column_names:
+                    raise ValueError(f"{source} has different columns than {first_source}")
+
+                insert_sql = insert_statement(table_name, column_names)
+                source_stats = {"file": source, "table": table_name, "rows": 0,
+                                "bytes": header_end, "seconds": 0.0}
+                stats.append(source_stats)
+                pending = deque()
+
+                def write_oldest():
+                    for batch in pending.popleft().result():
+                        cursor.executemany(insert_sql, batch)
+                        source_stats["rows"] += len(batch)
+                    print(f"  {source}: {source_stats['rows']:,} rows, "
+                          f"{source_stats['bytes'] / 1e6:,.1f} MB read", flush=True)
+
+                for chunk in chain([first], chunks):
+                    source_stats["bytes"] += len(chunk)
+                    pending.append(submit_task(executor, convert_csv_chunk, chunk,
+                                               column_names, column_types, batch_size))
+                    if len(pending) >= max_pending:
+                        write_oldest()
+                while pending:
+                    write_oldest()
+            source_stats["seconds"] = time.perf_counter() - started
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+    return stats
+
+
+def print_load_summary(stats):
+    """
+    Print rows and throughput per loaded source.
+    """
+    print("Load summary:")
+    print(f"  {'file':<40} {'table':<24} {'rows':>10} {'seconds':>8} {'rows/sec':>10} {'MB/sec':>7}")
+    for item in stats:
+        seconds = item["seconds"] or float("inf")
+        print(f"  {item['file']:<40} {item['table']:<24} {item['rows']:>10,} {item['seconds']:>8.2f} "
+              f"{item['rows'] / seconds:>10,.0f} {item['bytes'] / seconds / 1e6:>7.1f}")
+
+
+def set_bulk_load_pragmas(cursor, journal_mode):
+    """
+    Trade durability for speed while the database is being rebuilt.
+    Must be called outside of a transaction.
+    """
+    cursor.execute(f"PRAGMA journal_mode = {journal_mode}")
+    cursor.execute("PRAGMA synchronous = OFF")
+    cursor.execute(f"PRAGMA cache_size = {BULK_CACHE_SIZE}")
+    cursor.execute("PRAGMA temp_store = MEMORY")
+
+
+def reset_pragmas(cursor):
+    """
+    Restore the default rollback journal so the file can be served read-only.
+    """
+    cursor.execute("PRAGMA journal_mode = DELETE")
+    cursor.execute("PRAGMA synchronous = FULL")
+
+
+def table_exists(cursor, table_name):
+    """
+    Return True if the table exists in the database.
+    """
+    cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+        (table_name,),
+    )
+    return cursor.fetchone() is not None
+
+
+def database_has_table(database_name, table_name):
+    """
+    Return True if the database file exists and has the table.
+    """
+    if not os.path.exists(database_name):
+        return False
+    conn = sqlite3.connect(f"file:{quote(database_name)}?mode=ro", uri=True)
+    try:
+        return table_exists(conn.cursor(), table_name)
+    finally:
+        conn.close()
+
+
+def explain_query_plan(cursor, sql, params):
+    """
+    Return the EXPLAIN QUERY PLAN detail lines for a query.
+    """
+    cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+    return [row[-1] for row in cursor.fetchall()]
+
+
+def print_query_plan(label, plan):
+    """
+    Print a query plan, flagging full table scans.
+    """
+    print(f"{label}:")
+    for detail in plan:
+        marker = "  <-- full scan" if detail.startswith("SCAN") else ""
+        print(f"    {detail}{marker}")
+
+
+def trim_join_keys(cursor, table_name, target=None):
+    """
+    Trim whitespace from table_name's join key columns, updating target
+    (default: table_name itself) in place.
+    """
+    columns = JOIN_KEY_COLUMNS[table_name]
+    assignments = ', '.join(f"{col} = TRIM({col})" for col in columns)
+    changed = ' OR '.join(f"{col} <> TRIM({col})" for col in columns)
+    cursor.execute(f"UPDATE {target or table_name} SET {assignments} WHERE {changed}")
+
+
+def build_serving_tables(cursor, materialize=False):
+    """
+    Prepare the loaded tables for the API's zip/measure lookups.
+
+    The FIPS join keys are trimmed once here so the API can join on plain
+    column equality, which lets SQLite use the indexes created below instead
+    of scanning county_health_rankings on every request. With materialize,
+    a denormalized zip_measure_lookup table is also written so a lookup is a
+    single indexed point query.
+    """
+    plan_params = ("00000", "")
+    if table_exists(cursor, LOOKUP_TABLE):
+        cursor.execute(f"DROP TABLE {LOOKUP_TABLE}")
+    print_query_plan("Query plan before",
+                     explain_query_plan(cursor, SERVING_QUERY_PLAN_SQL, plan_params))
+
+    # Normalize the join keys so no TRIM() is needed at query time
+    trim_join_keys(cursor, "zip_county")
+    trim_join_keys(cursor, "county_health_rankings")
+
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_zip_county_zip ON zip_county (zip)")
+    # Release-aware lookups filter and order on data_release_year after the
+    # (fipscode, measure_name) prefix the plain lookups use
+    cursor.execute("DROP INDEX IF EXISTS idx_chr_fipscode_measure")
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_chr_fipscode_measure_release "
+        "ON county_health_rankings (fipscode, measure_name, data_release_year)"
+    )
+    build_latest_release_table(cursor)
+
+    if materialize:
+        column_list = ', '.join(f"chr.{col}" for col in SERVING_COLUMNS)
+        cursor.execute(
+            f"""
+            CREATE TABLE {LOOKUP_TABLE} AS
+            SELECT zc.zip AS zip, {column_list}
+            FROM zip_county AS zc
+            JOIN county_health_rankings AS chr
+              ON zc.county_code = chr.fipscode
+             AND zc.state_abbreviation = chr.state
+            ORDER BY zc.zip, chr.measure_name
+            """
+        )
+        cursor.execute(
+            f"CREATE INDEX idx_{LOOKUP_TABLE}_zip_measure "
+            f"ON {LOOKUP_TABLE} (zip, measure_name)"
+        )
+
+    build_summary_table(cursor)
+    build_rank_table(cursor)
+
+    cursor.execute("ANALYZE")
+
+    print_query_plan("Query plan after",
+                     explain_query_plan(cursor, SERVING_QUERY_PLAN_SQL, plan_params))
+    if materialize:
+        print_query_plan(
+            f"Query plan for {LOOKUP_TABLE}",
+            explain_query_plan(
+                cursor,
+                f"SELECT * FROM {LOOKUP_TABLE} WHERE zip = ? AND measure_name = ?",
+                plan_params,
+            ),
+        )
+
+
+def build_latest_release_table(cursor):
+    """
+    Record each county's latest data_release_year per measure.
+    """
+    cursor.execute(f"DROP TABLE IF EXISTS {LATEST_RELEASE_TABLE}")
+    cursor.execute(
+        f"""
+        CREATE TABLE {LATEST_RELEASE_TABLE} (
+            fipscode TEXT NOT NULL,
+            state TEXT NOT NULL,
+            measure_name TEXT NOT NULL,
+            data_release_year,
+            PRIMARY KEY (fipscode, state, measure_name)
+        ) WITHOUT ROWID
+        """
+    )
+    cursor.execute(
+        f"""
+        INSERT INTO {LATEST_RELEASE_TABLE}
+        SELECT fipscode, state, measure_name, MAX(data_release_year)
+        FROM county_health_rankings
+        WHERE fipscode IS NOT NULL AND state IS NOT NULL AND measure_name IS NOT NULL
+        GROUP BY fipscode, state, measure_name
+        """
+    )
+
+
+def build_summary_table(cursor):
+    """
+    Precompute per-state rollups of every measure and release year.
+
+    Each row holds row and county counts, numerator/denominator sums and
+    their ratio (over rows with both values and a positive denominator),
+    and the count, min, max, mean and nearest-rank percentiles of
+    raw_value. State and national rollup rows (county_code 000) are left
+    out. Values are cast to REAL so tables loaded as TEXT aggregate the
+    same as typed ones. The API reads a state rollup as one indexed row.
+    """
+    percentiles = ", ".join(
+        f"MIN(CASE WHEN rn * 100 >= {p} * n THEN raw_value END) AS raw_p{p}"
+        for p in SUMMARY_PERCENTILES
+    )
+    cursor.execute(f"DROP TABLE IF EXISTS {SUMMARY_TABLE}")
+    cursor.execute(
+        f"""
+        CREATE TABLE {SUMMARY_TABLE} AS
+        WITH sel AS (
+            SELECT state, measure_name, data_release_year, fipscode,
+                   CAST(NULLIF(numerator, '') AS REAL) AS numerator,
+                   CAST(NULLIF(denominator, '') AS REAL) AS denominator,
+                   CAST(NULLIF(raw_value, '') AS REAL) AS raw_value
+            FROM county_health_rankings
+            WHERE CAST(county_code AS INTEGER) IS NOT 0
+        ),
+        totals AS (
+            SELECT state, measure_name, data_release_year,
+                   COUNT(*) AS rows,
+                   COUNT(DISTINCT fipscode) AS counties,
+                   SUM(numerator) FILTER (WHERE denominator > 0) AS numerator,
+                   SUM(denominator) FILTER (WHERE numerator IS NOT NULL AND denominator > 0)
+                       AS denominator,
+                   COUNT(raw_value) AS raw_count,
+                   MIN(raw_value) AS raw_min,
+                   MAX(raw_value) AS raw_max,
+                   AVG(raw_value) AS raw_mean
+            FROM sel
+            GROUP BY state, measure_name, data_release_year
+        ),
+        ranked AS (
+            SELECT state, measure_name, data_release_year, raw_value,
+                   ROW_NUMBER() OVER w AS rn, COUNT(*) OVER w AS n
+            FROM sel
+            WHERE raw_value IS NOT NULL
+            WINDOW w AS (PARTITION BY state, measure_name, data_release_year
+                         ORDER BY raw_value
+                         ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING)
+        ),
+        pct AS (
+            SELECT state, measure_name, data_release_year, {percentiles}
+            FROM ranked
+            GROUP BY state, measure_name, data_release_year
+        )
+        SELECT totals.state, totals.measure_name, totals.data_release_year,
+               rows, counties, numerator, denominator,
+               numerator / denominator AS weighted_rate,
+               raw_count, raw_min, raw_max, raw_mean,
+               {', '.join(f"raw_p{p}" for p in SUMMARY_PERCENTILES)}
+        FROM totals
+        LEFT JOIN pct
+          ON pct.state IS totals.state
+         AND pct.measure_name IS totals.measure_name
+         AND pct.data_release_year IS totals.data_release_year
+        ORDER BY totals.measure_name, totals.data_release_year, totals.state
+        """
+    )
+    cursor.execute(
+        f"CREATE UNIQUE INDEX idx_{SUMMARY_TABLE}_key "
+        f"ON {SUMMARY_TABLE} (measure_name, data_release_year, state)"
+    )
+
+
+def ensure_sqrt(cursor):
+    """
+    Register sqrt() on SQLite builds compiled without the math functions.
+    """
+    try:
+        cursor.execute("SELECT sqrt(1)")
+    except sqlite3.OperationalError:
+        cursor.connection.create_function(
+            "sqrt", 1, lambda value: None if value is None else math.sqrt(value),
+            deterministic=True,
+        )
+
+
+def build_rank_table(cursor):
+    """
+    Precompute where each county's raw_value falls within its state and nationally.
+
+    One window pass over county_health_rankings partitions every (measure_name,
+    data_release_year) by state and nationally, and stores per county row the
+    percentile rank (100 * PERCENT_RANK(), ascending raw_value, ties share the
+    lower rank), the population z-score (NULL when every value is equal) and
+    how many counties were compared. Rows without a raw_value and state or
+    national rollup rows (county_code 000) are not ranked.
+    """
+    ensure_sqrt(cursor)
+    cursor.execute(f"DROP TABLE IF EXISTS {RANK_TABLE}")
+    cursor.execute(
+        f"""
+        CREATE TABLE {RANK_TABLE} (
+            fipscode TEXT NOT NULL,
+            state TEXT NOT NULL,
+            measure_name TEXT NOT NULL,
+            data_release_year NOT NULL,
+            raw_value REAL,
+            state_percentile REAL,
+            state_z_score REAL,
+            state_counties INTEGER,
+            national_percentile REAL,
+            national_z_score REAL,
+            national_counties INTEGER,
+            PRIMARY KEY (fipscode, state, measure_name, data_release_year)
+        ) WITHOUT ROWID
+        """
+    )
+    # Duplicate source rows for a key are all ranked; one of them is kept
+    cursor.execute(
+        f"""
+        INSERT OR REPLACE INTO {RANK_TABLE}
+        WITH sel AS (
+            SELECT fipscode, state, measure_name, data_release_year,
+                   CAST(NULLIF(raw_value, '') AS REAL) AS raw_value
+            FROM county_health_rankings
+            WHERE fipscode IS NOT NULL AND state IS NOT NULL
+              AND measure_name IS NOT NULL AND data_release_year IS NOT NULL
+              AND NULLIF(raw_value, '') IS NOT NULL
+              AND CAST(county_code AS INTEGER) IS NOT 0
+        ),
+        moments AS (
+            SELECT *,
+                   AVG(raw_value) OVER s AS state_mean,
+                   COUNT(*) OVER s AS state_counties,
+                   100.0 * PERCENT_RANK() OVER (s ORDER BY raw_value) AS state_percentile,
+                   AVG(raw_value) OVER n AS national_mean,
+                   COUNT(*) OVER n AS national_counties,
+                   100.0 * PERCENT_RANK() OVER (n ORDER BY raw_value) AS national_percentile
+            FROM sel
+            WINDOW s AS (PARTITION BY measure_name, data_release_year, state),
+                   n AS (PARTITION BY measure_name, data_release_year)
+        ),
+        spread AS (
+            SELECT *,
+                   sqrt(AVG((raw_value - state_mean) * (raw_value - state_mean))
+                        OVER (PARTITION BY measure_name, data_release_year, state)) AS state_sd,
+                   sqrt(AVG((raw_value - national_mean) * (raw_value - national_mean))
+                        OVER (PARTITION BY measure_name, data_release_year)) AS national_sd
+            FROM moments
+        )
+        SELECT fipscode, state, measure_name, data_release_year, raw_value,
+               state_percentile, (raw_value - state_mean) / NULLIF(state_sd, 0), state_counties,
+               national_percentile, (raw_value - national_mean) / NULLIF(national_sd, 0),
+               national_counties
+        FROM spread
+        ORDER BY fipscode, state, measure_name, data_release_year
+        """
+    )
+
+
+def table_columns(cursor, table_name):
+    """
+    Return {column: declared type} for an existing table, in column order.
+    """
+    cursor.execute(f"PRAGMA table_info({table_name})")
+    return {row[1]: (row[2] or "TEXT").upper() for row in cursor.fetchall()}
+
+
+def create_upsert_index(cursor, table_name, key_columns):
+    """
+    Create the unique index ON CONFLICT resolves rows against.
+    """
+    cursor.execute(
+        f"CREATE UNIQUE INDEX IF NOT EXISTS idx_{table_name}_upsert_key "
+        f"ON {table_name} ({', '.join(key_columns)})"
+    )
+
+
+def upsert_csv_data(cursor, csv_file, table_name, key_columns, batch_size=DEFAULT_BATCH_SIZE,
+                    normalize=True):
+    """
+    Merge a CSV source into an existing table, keyed on key_columns.
+
+    The CSV is loaded into a temporary staging table with the target's
+    column types, then compared with the target: rows with a new key are
+    inserted, rows whose values differ are updated and identical rows are
+    left untouched. Rows missing from the CSV are kept. With normalize,
+    join keys are trimmed in staging first, as build_serving_tables does
+    for the target. Returns (inserted, updated, unchanged).
+    """
+    target_types = table_columns(cursor, table_name)
+    missing = [col for col in key_columns if col not in target_types]
+    if missing:
+        raise ValueError(f"Upsert key columns not in '{table_name}': {', '.join(missing)}")
+
+    staging = f"{table_name}_staging"
+    with open_csv_text(csv_file) as file:
         reader = csv.reader(file)
-        header = next(reader)  # Get the header row
-        
-        # Validate that we have column names
-        if not header:
-            raise ValueError("CSV file appears to be empty or has no header row")
-        
-        # Create table with column names from header (no quotes around column names)
-        column_definitions = ', '.join(f"{col} TEXT" for col in header)
-        create_table_sql = f"CREATE TABLE {table_name} ({column_definitions})"
-        
-        cursor.execute(create_table_sql)
-        return header
+        header = next(reader, [])
+        if sorted(header) != sorted(target_types):
+            raise ValueError(f"CSV columns {header} don't match table '{table_name}' columns "
+                             f"{list(target_types)}")
+        cursor.execute(f"DROP TABLE IF EXISTS temp.{staging}")
+        cursor.execute(f"CREATE TEMP TABLE {staging} AS SELECT * FROM {table_name} WHERE 0")
+        column_types = {col: t if t in COLUMN_TYPES else "TEXT" for col, t in target_types.items()}
+        insert_rows(cursor, staging, header, reader, batch_size, column_types)
+    if normalize and table_name in JOIN_KEY_COLUMNS:
+        trim_join_keys(cursor, table_name, target=f"temp.{staging}")
+
+    key_list = ', '.join(key_columns)
+    cursor.execute(
+        f"SELECT COUNT(*) FROM {staging} WHERE "
+        + ' OR '.join(f"{col} IS NULL" for col in key_columns)
+    )
+    null_keys = cursor.fetchone()[0]
+    if null_keys:
+        raise ValueError(f"{null_keys} rows have an empty upsert key ({key_list})")
+    cursor.execute(
+        f"SELECT COUNT(*) FROM (SELECT 1 FROM {staging} GROUP BY {key_list} HAVING COUNT(*) > 1)"
+    )
+    duplicate_keys = cursor.fetchone()[0]
+    if duplicate_keys:
+        raise ValueError(f"{duplicate_keys} upsert keys ({key_list}) appear more than once in the CSV")
 
+    create_upsert_index(cursor, table_name, key_columns)
+    value_columns = [col for col in target_types if col not in key_columns]
+    join = ' AND '.join(f"s.{col} = t.{col}" for col in key_columns)
+    same = ' AND '.join(f"s.{col} IS t.{col}" for col in value_columns) or "1"
+    cursor.execute(
+        f"SELECT COUNT(*) FILTER (WHERE t.rowid IS NULL), "
+        f"COUNT(*) FILTER (WHERE t.rowid IS NOT NULL AND NOT ({same})), "
+        f"COUNT(*) FROM {staging} AS s LEFT JOIN {table_name} AS t ON {join}"
+    )
+    inserted, updated, total = cursor.fetchone()
 
-def insert_csv_data(cursor, csv_file, column_names, table_name):
+    column_list = ', '.join(target_types)
+    if value_columns:
+        assignments = ', '.join(f"{col} = excluded.{col}" for col in value_columns)
+        changed = ' OR '.join(f"{table_name}.{col} IS NOT excluded.{col}" for col in value_columns)
+        conflict = f"DO UPDATE SET {assignments} WHERE {changed}"
+    else:
+        conflict = "DO NOTHING"
+    # WHERE true keeps the parser from reading ON CONFLICT as a join constraint
+    cursor.execute(
+        f"INSERT INTO {table_name} ({column_list}) SELECT {column_list} FROM {staging} WHERE true "
+        f"ON CONFLICT ({key_list}) {conflict}"
+    )
+    cursor.execute(f"DROP TABLE temp.{staging}")
+    return inserted, updated, total - inserted - updated
+
+
+def open_shadow_copy(database_name):
     """
-    Insert data from CSV file into the SQLite table.
+    Copy database_name to a shadow file with the backup API and connect to it.
+    Returns (connection, shadow_path); the shadow is later renamed over the
+    original so readers switch to the new contents in one step.
     """
-    with open(csv_file, 'r', newline='', encoding='utf-8') as file:
-        reader = csv.DictReader(file)
-        
-        # Prepare the INSERT statement (no quotes around column names)
-        placeholders = ', '.join(['?' for _ in column_names])
-        column_list = ', '.join(column_names)
-        insert_sql = f"INSERT INTO {table_name} ({column_list}) VALUES ({placeholders})"
-        
-        # Insert each row
-        for row in reader:
-            values = [row.get(col, '') for col in column_names]
-            cursor.execute(insert_sql, values)
+    shadow_path = f"{database_name}.incoming"
+    if os.path.exists(shadow_path):
+        os.remove(shadow_path)
+    conn = sqlite3.connect(shadow_path)
+    if os.path.exists(database_name):
+        source = sqlite3.connect(database_name)
+        try:
+            source.backup(conn)
+        finally:
+            source.close()
+    return conn, shadow_path
+
+
+def read_metadata(cursor):
+    """
+    Return the metadata table as a dict, or {} if it doesn't exist.
+    """
+    if not table_exists(cursor, METADATA_TABLE):
+        return {}
+    cursor.execute(f"SELECT key, value FROM {METADATA_TABLE}")
+    return dict(cursor.fetchall())
+
+
+def write_metadata(cursor, sources):
+    """
+    Record a new data version and build time in the metadata table.
+
+    The version hashes the previous one with the build time and the loaded
+    sources, so every published rebuild gets a new identifier; the API
+    serves it as the ETag of lookups and built_at as their Last-Modified.
+    Returns the new version.
+    """
+    previous = read_metadata(cursor).get("data_version", "")
+    built_at = datetime.now(timezone.utc).replace(microsecond=0).isoformat()
+    seed = "\n".join([previous, built_at, str(time.time_ns()), *sources])
+    version = hashlib.sha256(seed.encode("utf-8")).hexdigest()[:20]
+    cursor.execute(f"CREATE TABLE IF NOT EXISTS {METADATA_TABLE} (key TEXT PRIMARY KEY, value TEXT)")
+    cursor.executemany(
+        f"INSERT INTO {METADATA_TABLE} (key, value) VALUES (?, ?) "
+        "ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+        [("data_version", version), ("built_at", built_at)],
+    )
+    return version
+
+
+def snapshot_column_type(cursor, column):
+    """
+    Return the snapshot storage for a column: 'q' (int64) or 'd' (float64)
+    when every non-NULL value has that SQLite type, else 's' (string id).
+    """
+    cursor.execute(f"SELECT DISTINCT typeof({column}) FROM county_health_rankings")
+    kinds = {row[0] for row in cursor.fetchall()} - {"null"}
+    if kinds == {"integer"}:
+        return "q"
+    if kinds == {"real"}:
+        return "d"
+    return "s"
+
+
+def export_snapshot(cursor, path):
+    """
+    Export the serving rows to a compact binary snapshot the API can mmap.
+
+    Rows are sorted by county and measure and stored as fixed-width columns;
+    text is dictionary-encoded into a shared string table. A sorted array of
+    ZIPs points at the counties each ZIP belongs to, and each county at its
+    row range. The file is written next to path and renamed into place.
+    Returns the number of rows exported.
+    """
+    column_types = {col: snapshot_column_type(cursor, col) for col in SERVING_COLUMNS}
+    strings = {}
+
+    def string_id(value):
+        if value is None:
+            return SNAPSHOT_STRING_NULL
+        return strings.setdefault(str(value), len(strings))
+
+    nulls = {"q": SNAPSHOT_INT_NULL, "d": float("nan")}
+    columns = {col: array("I" if kind == "s" else kind) for col, kind in column_types.items()}
+    county_ids = {}
+    county_row_start = array("I")
+    row_count = 0
+    cursor.execute(
+        f"SELECT {', '.join(SERVING_COLUMNS)} FROM county_health_rankings "
+        "ORDER BY fipscode, state, measure_name"
+    )
+    fips_index = SERVING_COLUMNS.index("fipscode")
+    state_index = SERVING_COLUMNS.index("state")
+    for row in cursor:
+        county = (row[fips_index], row[state_index])
+        if county not in county_ids:
+            county_ids[county] = len(county_ids)
+            county_row_start.append(row_count)
+        for col, value in zip(SERVING_COLUMNS, row):
+            kind = column_types[col]
+            if kind == "s":
+                columns[col].append(string_id(value))
+            else:
+                columns[col].append(nulls[kind] if value is None else value)
+        row_count += 1
+    county_row_start.append(row_count)
+
+    # Map every 5-digit ZIP to the counties it joins to
+    zip_counties = {}
+    cursor.execute("SELECT DISTINCT zip, county_code, state_abbreviation FROM zip_county")
+    for zip_code, county_code, state in cursor:
+        county_id = county_ids.get((county_code, state))
+        zip_code = str(zip_code)
+        if county_id is not None and re.fullmatch(r"\d{5}", zip_code):
+            zip_counties.setdefault(int(zip_code), []).append(county_id)
+    zips = array("I", sorted(zip_counties))
+    zip_ref_start = array("I", [0])
+    zip_refs = array("I")
+    for zip_code in zips:
+        zip_refs.extend(zip_counties[zip_code])
+        zip_ref_start.append(len(zip_refs))
+
+    encoded = [value.encode("utf-8") for value in strings]
+    string_offsets = array("I", [0])
+    for value in encoded:
+        string_offsets.append(string_offsets[-1] + len(value))
+
+    sections = [
+        ("string_offsets", "I", string_offsets),
+        ("string_data", "B", b"".join(encoded)),
+        ("zips", "I", zips),
+        ("zip_ref_start", "I", zip_ref_start),
+        ("zip_refs", "I", zip_refs),
+        ("county_row_start", "I", county_row_start),
+    ]
+    sections += [(f"column:{col}", columns[col].typecode, columns[col]) for col in SERVING_COLUMNS]
+
+    def layout(header_size):
+        offset = len(SNAPSHOT_MAGIC) + 4 + header_size
+        placed = {}
+        for name, fmt, data in sections:
+            offset += -offset % 8
+            placed[name] = [offset, len(data), fmt]
+            offset += len(data) * struct.calcsize(fmt)
+        return placed
+
+    measure_ids = {}
+    if column_types["measure_name"] == "s":
+        cursor.execute("SELECT DISTINCT measure_name FROM county_health_rankings")
+        measure_ids = {str(row[0]): strings[str(row[0])] for row in cursor.fetchall() if row[0] is not None}
+
+    metadata = read_metadata(cursor)
+    header = {
+        "version": SNAPSHOT_VERSION,
+        "data_version": metadata.get("data_version"),
+        "built_at": metadata.get("built_at"),
+        "byteorder": sys.byteorder,
+        "rows": row_count,
+        "counties": len(county_ids),
+        "zips": len(zips),
+        "columns": [[col, column_types[col]] for col in SERVING_COLUMNS],
+        "measure_ids": measure_ids,
+    }
+    # Offsets depend on the header length, so reserve room for their digits
+    header_size = len(json.dumps(dict(header, sections=layout(0)))) + 256
+    header["sections"] = layout(header_size)
+    header_bytes = json.dumps(header, sort_keys=True).encode("utf-8").ljust(header_size)
+
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "wb") as file:
+        file.write(SNAPSHOT_MAGIC)
+        file.write(struct.pack("<I", header_size))
+        file.write(header_bytes)
+        for name, fmt, data in sections:
+            file.write(b"\0" * (header["sections"][name][0] - file.tell()))
+            file.write(data if isinstance(data, bytes) else data.tobytes())
+    os.replace(temp_path, path)
+    return row_count
+
+
+def expand_csv_files(patterns):
+    """
+    Expand glob patterns in the CSV arguments, keeping their order ('-' is stdin).
+    Raises FileNotFoundError for a missing file or a pattern with no match.
+    """
+    csv_files = []
+    for pattern in patterns:
+        if any(char in pattern for char in "*?["):
+            matches = sorted(glob.glob(pattern))
+            if not matches:
+                raise FileNotFoundError(errno.ENOENT, "No CSV files match", pattern)
+            csv_files.extend(matches)
+        elif pattern != '-' and not os.path.exists(pattern):
+            raise FileNotFoundError(errno.ENOENT, "CSV file not found", pattern)
+        else:
+            csv_files.append(pattern)
+    return csv_files
+
+
+def group_by_table(csv_files, table=None):
+    """
+    Return {table_name: [csv_file, ...]} in first-seen order. Tables are
+    named after the file (see source_table_name) unless table is given.
+    """
+    groups = {}
+    for csv_file in csv_files:
+        table_name = table or source_table_name(csv_file)
+        groups.setdefault(table_name, []).append(csv_file)
+    return groups
+
+
+def parse_args(argv):
+    """
+    Parse command line arguments.
+    """
+    parser = argparse.ArgumentParser(
+        description="Convert a CSV file with a header row to a SQLite table.",
+        epilog="Example: python csv_to_sqlite.py data.db zip_county.csv county_health_rankings.csv",
+    )
+    parser.add_argument("database_name", help="SQLite database to write")
+    parser.add_argument(
+        "csv_files",
+        nargs="+",
+        metavar="csv_file",
+        help="CSV files (optionally .gz, .bz2, .xz or .zip), glob patterns, or - for stdin; "
+             "each table is named after its file",
+    )
+    parser.add_argument(
+        "--table",
+        help="load every CSV file into this table instead of one table per file name",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="processes parsing and converting CSV chunks (default: CPU count)",
+    )
+    parser.add_argument(
+        "--no-serving-tables",
+        dest="serving_tables",
+        action="store_false",
+        help="skip normalizing and indexing the tables used by the API",
+    )
+    parser.add_argument(
+        "--materialize",
+        action="store_true",
+        help=f"also build the denormalized {LOOKUP_TABLE} table",
+    )
+    parser.add_argument(
+        "--snapshot",
+        metavar="PATH",
+        help="also export a binary snapshot of the serving rows for SERVING_MODE=snapshot",
+    )
+    parser.add_argument(
+        "--upsert-key",
+        metavar="COL,COL,...",
+        help="merge the CSV into the existing table keyed on these columns instead of "
+             "reloading it, then atomically replace the database file",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=DEFAULT_BATCH_SIZE,
+        help=f"rows per executemany call, for full loads and merges (default: {DEFAULT_BATCH_SIZE})",
+    )
+    parser.add_argument(
+        "--journal-mode",
+        choices=["OFF", "WAL", "MEMORY", "DELETE"],
+        default="OFF",
+        help="journal mode used during the load (default: OFF)",
+    )
+    parser.add_argument(
+        "--type",
+        dest="type_overrides",
+        action="append",
+        default=[],
+        metavar="COLUMN=TYPE",
+        help="force a column type (INTEGER, REAL or TEXT); may be repeated",
+    )
+    parser.add_argument(
+        "--sample-size",
+        type=int,
+        default=DEFAULT_SAMPLE_SIZE,
+        help=f"rows sampled to infer column types (default: {DEFAULT_SAMPLE_SIZE})",
+    )
+    parser.add_argument(
+        "--strict",
+        action="store_true",
+        help="create the table as a STRICT table",
+    )
+    args = parser.parse_args(argv)
+    overrides = {}
+    for item in args.type_overrides:
+        column, _, col_type = item.partition("=")
+        if not column or col_type.upper() not in COLUMN_TYPES:
+            parser.error(f"--type expects COLUMN=INTEGER|REAL|TEXT, got '{item}'")
+        overrides[column] = col_type.upper()
+    args.type_overrides = overrides
+    if args.upsert_key is not None:
+        key_columns = tuple(col.strip() for col in args.upsert_key.split(","))
+        if not all(IDENTIFIER_PATTERN.fullmatch(col) for col in key_columns):
+            parser.error(f"--upsert-key expects comma-separated column names, got '{args.upsert_key}'")
+        args.upsert_key = key_columns
+        # A merge into a mistyped or missing table must not turn into a fresh load
+        try:
+            tables = group_by_table(expand_csv_files(args.csv_files), args.table)
+        except FileNotFoundError:
+            tables = {}  # main() reports the missing file
+        missing = [name for name in tables if not database_has_table(args.database_name, name)]
+        if missing:
+            parser.error(f"--upsert-key merges into an existing table, but {args.database_name} "
+                         f"has no {', '.join(missing)} table (use --table to name it)")
+    if args.batch_size < 1:
+        parser.error("--batch-size must be at least 1")
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.csv_files.count("-") > 1:
+        parser.error("stdin (-) can only be read once")
+    if "-" in args.csv_files and args.table is None:
+        parser.error("reading from stdin (-) requires --table")
+    if args.table is not None and not IDENTIFIER_PATTERN.fullmatch(args.table):
+        parser.error(f"--table expects a table name, got '{args.table}'")
+    return args
 
 
 def main():
     """
     Main function to handle command line arguments and convert CSV to SQLite.
     """
-    if len(sys.argv) != 3:
-        print("Usage: python csv_to_sqlite.py <database_name> <csv_file>")
-        print("Example: python csv_to_sqlite.py data.db input.csv")
-        sys.exit(1)
-    
-    database_name = sys.argv[1]
-    csv_file = sys.argv[2]
+    args = parse_args(sys.argv[1:])
+    database_name = args.database_name
     
-    # Validate that CSV file exists
-    if not os.path.exists(csv_file):
-        print(f"Error: CSV file '{csv_file}' not found")
+    # Validate that the CSV files exist
+    try:
+        csv_files = expand_csv_files(args.csv_files)
+    except FileNotFoundError as e:
+        print(f"Error: CSV file '{e.filename}' not found")
         sys.exit(1)
+    tables = group_by_table(csv_files, args.table)
     
+    incremental = args.upsert_key is not None
+    shadow_path = None
     try:
-        # Connect to SQLite database (creates if doesn't exist)
-        conn = sqlite3.connect(database_name)
+        # Incremental loads go to a copy of the database that replaces it in
+        # one rename, so the API never reads a half-updated table
+        if incremental:
+            conn, shadow_path = open_shadow_copy(database_name)
+        else:
+            # Connect to SQLite database (creates if doesn't exist)
+            conn = sqlite3.connect(database_name)
         cursor = conn.cursor()
+        set_bulk_load_pragmas(cursor, args.journal_mode)
+        
+        # Load everything in a single transaction
+        cursor.execute("BEGIN")
+        
+        changed = 0
+        loads = []
+        for table_name, table_files in tables.items():
+            if incremental:
+                for csv_file in table_files:
+                    print(f"Upserting {csv_file} into '{table_name}' on ({', '.join(args.upsert_key)})...")
+                    start = time.perf_counter()
+                    inserted, updated, unchanged = upsert_csv_data(
+                        cursor, csv_file, table_name, args.upsert_key, args.batch_size, args.serving_tables
+                    )
+                    elapsed = time.perf_counter() - start
+                    print(f"Inserted {inserted}, updated {updated}, unchanged {unchanged} rows "
+                          f"in {elapsed:.2f}s")
+                    changed += inserted + updated
+            else:
+                loads.extend((csv_file, table_name) for csv_file in table_files)
+        
+        if loads:
+            # Stream each CSV once into its new table; indexes are only built afterwards
+            print(f"Loading {len(loads)} file(s) with {args.workers} worker(s)...")
+            start = time.perf_counter()
+            load_stats = load_csv_sources(cursor, loads, args.workers, args.sample_size,
+                                          args.type_overrides, args.strict,
+                                          batch_size=args.batch_size)
+            elapsed = time.perf_counter() - start
+            row_count = sum(item["rows"] for item in load_stats)
+            print(f"Inserted {row_count} rows in {elapsed:.2f}s "
+                  f"({row_count / elapsed if elapsed else 0:,.0f} rows/sec)")
+            print_load_summary(load_stats)
+            changed += row_count
         
-        # Extract table name from CSV filename (remove .csv extension)
-        table_name = os.path.splitext(os.path.basename(csv_file))[0]
+        if incremental and not changed:
+            conn.rollback()
+            conn.close()
+            print(f"No changes; {database_name} left as is")
+            return
         
-        # Drop existing table if it exists
-        cursor.execute(f"DROP TABLE IF EXISTS {table_name}")
+        # Any reload makes the denormalized lookup and summary tables stale
+        cursor.execute(f"DROP TABLE IF EXISTS {LOOKUP_TABLE}")
+        cursor.execute(f"DROP TABLE IF EXISTS {SUMMARY_TABLE}")
+        cursor.execute(f"DROP TABLE IF EXISTS {LATEST_RELEASE_TABLE}")
+        cursor.execute(f"DROP TABLE IF EXISTS {RANK_TABLE}")
         
-        # Create table from CSV header
-        print(f"Reading CSV file: {csv_file}")
-        column_names = create_table_from_csv(cursor, csv_file, table_name)
-        print(f"Created table '{table_name}' with columns: {', '.join(column_names)}")
+        # Rebuild the serving indexes once both API tables are present
+        if args.serving_tables and table_exists(cursor, "zip_county") \
+                and table_exists(cursor, "county_health_rankings"):
+            print("Building serving tables...")
+            build_serving_tables(cursor, materialize=args.materialize)
         
-        # Insert data from CSV
-        print("Inserting data...")
-        insert_csv_data(cursor, csv_file, column_names, table_name)
+        # Give the rebuilt data a new version for HTTP caching
+        data_version = write_metadata(cursor, csv_files)
+        print(f"Data version: {data_version}")
         
         # Commit changes and close connection
         conn.commit()
+        reset_pragmas(cursor)
+        
+        # Export the binary snapshot from the committed serving tables
+        if args.snapshot:
+            if table_exists(cursor, "zip_county") and table_exists(cursor, "county_health_rankings"):
+                snapshot_rows = export_snapshot(cursor, args.snapshot)
+                print(f"Wrote snapshot with {snapshot_rows} rows: {args.snapshot}")
+            else:
+                print("Skipping snapshot: zip_county and county_health_rankings are both required")
         conn.close()
         
+        if incremental:
+            os.replace(shadow_path, database_name)
+            print(f"Published the updated database to {database_name}")
+        
         print(f"Successfully converted CSV to SQLite database: {database_name}")
-        print(f"Table name: {table_name}")
+        print(f"Tables: {', '.join(tables)}")
         
-    except FileNotFoundError:
-        print(f"Error: Could not find file '{csv_file}'")
+    except FileNotFoundError as e:
+        print(f"Error: Could not find file '{e.filename}'")
         sys.exit(1)
     except csv.Error as e:
         print(f"Error reading CSV file: {e}")
@@ -106,9 +1375,17 @@ def main():
     except sqlite3.Error as e:
         print(f"Error with SQLite database: {e}")
         sys.exit(1)
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
     except Exception as e:
         print(f"Unexpected error: {e}")
         sys.exit(1)
+    finally:
+        # A failed incremental load leaves the original database untouched
+        if shadow_path and os.path.exists(shadow_path):
+            conn.close()
+            os.remove(shadow_path)
 
 
 if __name__ == "__main__":
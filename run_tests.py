@@ -12,6 +12,9 @@ import os
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 from test_api import TestAPI
+from test_csv_to_sqlite import TestCsvToSqlite
+from test_benchmark import TestBenchmark
+from test_asgi import TestAsgi
 
 def run_tests():
     """Run the test suite with detailed output"""
@@ -23,6 +26,9 @@ def run_tests():
     # Create test suite
     loader = unittest.TestLoader()
     suite = loader.loadTestsFromTestCase(TestAPI)
+    suite.addTests(loader.loadTestsFromTestCase(TestCsvToSqlite))
+    suite.addTests(loader.loadTestsFromTestCase(TestBenchmark))
+    suite.addTests(loader.loadTestsFromTestCase(TestAsgi))
     
     # Run tests with detailed output
     runner = unittest.TextTestRunner(verbosity=2, stream=sys.stdout)
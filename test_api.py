@@ -2,6 +2,7 @@ import unittest
 import json
 import sqlite3
 import os
+from flask import jsonify
 from api.index import app, get_db_connection, ALLOWED_MEASURES
 
 class TestAPI(unittest.TestCase):
@@ -16,6 +17,10 @@ class TestAPI(unittest.TestCase):
         # Create a test database with sample data
         self.test_db_path = 'test_data.db'
         self.create_test_database()
+        
+        # Start every test with an empty response cache
+        import api.index
+        api.index.response_cache.clear()
     
     def tearDown(self):
         """Clean up test database"""
@@ -265,6 +270,883 @@ class TestAPI(unittest.TestCase):
             # Restore original function
             api.index.get_db_connection = original_get_db_connection
     
+    def test_successful_request_from_lookup_table(self):
+        """Test that a materialized zip_measure_lookup table is used when present"""
+        conn = sqlite3.connect(self.test_db_path)
+        conn.execute('''
+            CREATE TABLE zip_measure_lookup AS
+            SELECT zc.zip AS zip, chr.*
+            FROM zip_county AS zc
+            JOIN county_health_rankings AS chr
+              ON zc.county_code = chr.fipscode AND zc.state_abbreviation = chr.state
+        ''')
+        # Drop the source tables so only the lookup table can answer
+        conn.execute('DROP TABLE county_health_rankings')
+        conn.commit()
+        conn.close()
+
+        original_get_db_connection = get_db_connection
+        def test_get_db_connection():
+            conn = sqlite3.connect(self.test_db_path)
+            conn.row_factory = sqlite3.Row
+            return conn
+
+        import api.index
+        api.index.get_db_connection = test_get_db_connection
+
+        try:
+            response = self.client.post('/county_data',
+                                     data=json.dumps({'zip': '54321', 'measure_name': 'Unemployment'}),
+                                     content_type='application/json')
+            self.assertEqual(response.status_code, 200)
+            data = response.get_json()
+            self.assertEqual(len(data), 1)
+            self.assertEqual(data[0]['county'], 'Another County')
+            self.assertEqual(data[0]['fipscode'], '002')
+        finally:
+            api.index.get_db_connection = original_get_db_connection
+
+    def test_connection_pool_reuse(self):
+        """Test that pooled read-only connections are reused across requests"""
+        import api.index
+        original_database = self.app.config['DATABASE']
+        self.app.config['DATABASE'] = self.test_db_path
+        try:
+            requests = [
+                ({'zip': '12345', 'measure_name': 'Violent crime rate'}, 200),
+                ({'zip': '54321', 'measure_name': 'Unemployment'}, 200),
+                ({'zip': '99999', 'measure_name': 'Unemployment'}, 404),
+            ]
+            for data, status in requests:
+                response = self.client.post('/county_data',
+                                         data=json.dumps(data),
+                                         content_type='application/json')
+                self.assertEqual(response.status_code, status)
+
+            stats = self.client.get('/stats').get_json()['pool']
+            self.assertEqual(stats['open'], 1)
+            self.assertEqual(stats['misses'], 1)
+            self.assertEqual(stats['hits'], 2)
+
+            # Pooled connections must not be able to write
+            with api.index.get_db_connection() as conn:
+                with self.assertRaises(sqlite3.OperationalError):
+                    conn.execute('DELETE FROM zip_county')
+        finally:
+            api.index.close_pool()
+            self.app.config['DATABASE'] = original_database
+
+    def test_prewarm(self):
+        """Test that prewarm leaves one ready connection and skips a missing database"""
+        import api.index
+        original_database = self.app.config['DATABASE']
+        try:
+            self.app.config['DATABASE'] = 'missing.db'
+            api.index.prewarm()
+            self.assertIsNone(api.index._pool)
+
+            self.app.config['DATABASE'] = self.test_db_path
+            api.index.prewarm()
+            stats = api.index.get_pool().stats()
+            self.assertEqual((stats['open'], stats['idle'], stats['misses']), (1, 1, 1))
+            response = self.client.post('/county_data',
+                                     data=json.dumps({'zip': '12345', 'measure_name': 'Violent crime rate'}),
+                                     content_type='application/json')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(api.index.get_pool().stats()['open'], 1)
+        finally:
+            api.index.close_pool()
+            self.app.config['DATABASE'] = original_database
+
+    def test_pool_timeout(self):
+        """Test that a lookup waiting out an exhausted pool gets a JSON 503 with Retry-After"""
+        import api.index
+        original = {key: self.app.config[key] for key in ('DATABASE', 'DB_POOL_SIZE', 'DB_POOL_TIMEOUT')}
+        self.app.config.update(DATABASE=self.test_db_path, DB_POOL_SIZE=1, DB_POOL_TIMEOUT=0.01)
+        api.index.close_pool()
+        try:
+            with api.index.get_db_connection():
+                response = self.client.post('/county_data', content_type='application/json', data=json.dumps(
+                    {'zip': '12345', 'measure_name': 'Violent crime rate'}))
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response.get_json(), {'error': 'Server is busy'})
+            self.assertEqual(response.headers['Retry-After'], '1')
+            self.assertEqual(api.index.get_pool().stats()['timeouts'], 1)
+        finally:
+            api.index.close_pool()
+            self.app.config.update(original)
+
+    def test_pool_follows_replaced_database(self):
+        """Test that an atomically replaced database file is served by fresh connections"""
+        import api.index
+        original_database = self.app.config['DATABASE']
+        self.app.config['DATABASE'] = self.test_db_path
+        replacement_path = 'test_data.db.incoming'
+        data = json.dumps({'zip': '12345', 'measure_name': 'Unemployment'})
+        try:
+            response = self.client.post('/county_data', data=data, content_type='application/json')
+            self.assertEqual(response.status_code, 404)
+
+            conn = sqlite3.connect(self.test_db_path)
+            replacement = sqlite3.connect(replacement_path)
+            conn.backup(replacement)
+            conn.close()
+            replacement.execute(
+                "INSERT INTO county_health_rankings VALUES ('CA', 'Test County', '06', '001', "
+                "'2020-2021', 'Unemployment', '23', '5', '100', '5.0', '4.0', '6.0', '2021', '001')"
+            )
+            replacement.commit()
+            replacement.close()
+            os.replace(replacement_path, self.test_db_path)
+
+            response = self.client.post('/county_data', data=data, content_type='application/json')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.get_json()[0]['raw_value'], '5.0')
+        finally:
+            api.index.close_pool()
+            self.app.config['DATABASE'] = original_database
+            if os.path.exists(replacement_path):
+                os.remove(replacement_path)
+
+    def test_response_cache(self):
+        """Test that 200 and 404 responses are cached until data.db changes"""
+        import api.index
+        original_database = self.app.config['DATABASE']
+        self.app.config['DATABASE'] = self.test_db_path
+        try:
+            requests = [
+                ({'zip': '12345', 'measure_name': 'Violent crime rate'}, 200),
+                ({'zip': '99999', 'measure_name': 'Violent crime rate'}, 404),
+            ]
+            before = self.client.get('/stats').get_json()['cache']
+            first = {}
+            for data, status in requests * 2:
+                response = self.client.post('/county_data',
+                                         data=json.dumps(data),
+                                         content_type='application/json')
+                self.assertEqual(response.status_code, status)
+                body = first.setdefault(data['zip'], response.get_data())
+                self.assertEqual(response.get_data(), body)
+
+            stats = self.client.get('/stats').get_json()['cache']
+            self.assertEqual(stats['misses'] - before['misses'], 2)
+            self.assertEqual(stats['hits'] - before['hits'], 2)
+            self.assertEqual(stats['entries'], 2)
+
+            # Rewriting data.db invalidates every cached response
+            conn = sqlite3.connect(self.test_db_path)
+            conn.execute("UPDATE county_health_rankings SET county = 'Renamed County' WHERE fipscode = '001'")
+            conn.commit()
+            conn.close()
+            stat = os.stat(self.test_db_path)
+            os.utime(self.test_db_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+
+            response = self.client.post('/county_data',
+                                     data=json.dumps(requests[0][0]),
+                                     content_type='application/json')
+            self.assertEqual(response.get_json()[0]['county'], 'Renamed County')
+            stats = self.client.get('/stats').get_json()['cache']
+            self.assertEqual(stats['invalidations'] - before['invalidations'], 1)
+        finally:
+            api.index.close_pool()
+            self.app.config['DATABASE'] = original_database
+
+    def test_response_cache_eviction(self):
+        """Test LRU eviction by entry count and byte size"""
+        from api.index import ResponseCache
+        cache = ResponseCache(max_entries=2, max_bytes=10, ttl=0)
+        cache.put('a', 1, b'aaaa', 200)
+        cache.put('b', 1, b'bbbb', 200)
+        self.assertIsNotNone(cache.get('a', 1))  # 'a' is now most recently used
+        cache.put('c', 1, b'cccc', 200)
+        self.assertIsNone(cache.get('b', 1))
+        self.assertEqual(cache.get('a', 1), (b'aaaa', 200))
+        cache.put('d', 1, b'dddddddd', 200)  # Exceeds max_bytes with 'a' or 'c'
+        self.assertEqual(cache.stats()['entries'], 1)
+        self.assertEqual(cache.stats()['evictions'], 3)
+        cache.put('e', 1, b'x' * 11, 200)  # Larger than max_bytes, never stored
+        self.assertIsNone(cache.get('e', 1))
+
+    def test_batch_lookup(self):
+        """Test per-item results and errors from /county_data/batch"""
+        import api.index
+        original_database = self.app.config['DATABASE']
+        self.app.config['DATABASE'] = self.test_db_path
+        try:
+            items = [
+                {'zip': '12345', 'measure_name': 'Violent crime rate'},
+                {'zip': '54321', 'measure_name': 'Unemployment'},
+                {'zip': '12345', 'measure_name': 'Unemployment'},
+                {'zip': '1234', 'measure_name': 'Unemployment'},
+                {'zip': '12345', 'measure_name': 'Invalid measure'},
+                {'zip': '12345'},
+                {'coffee': 'teapot', 'zip': '12345', 'measure_name': 'Violent crime rate'},
+                'not an object',
+            ]
+            response = self.client.post('/county_data/batch',
+                                     data=json.dumps({'items': items}),
+                                     content_type='application/json')
+            self.assertEqual(response.status_code, 200)
+            results = response.get_json()['results']
+            self.assertEqual([r['status'] for r in results], [200, 200, 404, 400, 400, 400, 418, 400])
+            self.assertEqual(results[0]['data'][0]['county'], 'Test County')
+            self.assertEqual(results[1]['data'][0]['county'], 'Another County')
+            self.assertIn("No data found", results[2]['error'])
+            self.assertIn("'zip' must be a 5-digit ZIP code", results[3]['error'])
+            self.assertIn("'measure_name' is invalid", results[4]['error'])
+            self.assertIn("Both 'zip' and 'measure_name' are required", results[5]['error'])
+
+            # Cross product of zips x measure_names
+            response = self.client.post('/county_data/batch',
+                                     data=json.dumps({'zips': ['12345', '54321'],
+                                                      'measure_names': ['Violent crime rate', 'Unemployment']}),
+                                     content_type='application/json')
+            results = response.get_json()['results']
+            self.assertEqual([(r['zip'], r['measure_name'], r['status']) for r in results], [
+                ('12345', 'Violent crime rate', 200),
+                ('12345', 'Unemployment', 404),
+                ('54321', 'Violent crime rate', 404),
+                ('54321', 'Unemployment', 200),
+            ])
+        finally:
+            api.index.close_pool()
+            self.app.config['DATABASE'] = original_database
+
+    def test_batch_request_errors(self):
+        """Test whole-request errors from /county_data/batch"""
+        test_cases = [
+            ({'coffee': 'teapot', 'items': []}, 418),
+            ({}, 400),
+            ({'items': 'not a list'}, 400),
+            ({'zips': ['12345']}, 400),
+            ({'items': [{'zip': '12345', 'measure_name': 'Unemployment'}] * 501}, 413),
+            ({'zips': ['12345'] * 3000, 'measure_names': ['Unemployment'] * 3000}, 413),
+        ]
+        for data, status in test_cases:
+            with self.subTest(data=str(data)[:60]):
+                response = self.client.post('/county_data/batch',
+                                         data=json.dumps(data),
+                                         content_type='application/json')
+                self.assertEqual(response.status_code, status)
+
+    def test_aggregate(self):
+        """Test state and county-list rollups, with and without the summary table"""
+        import api.index
+        import csv_to_sqlite
+        conn = sqlite3.connect(self.test_db_path)
+        conn.execute('''
+            INSERT INTO county_health_rankings
+            (state, county, fipscode, measure_name, numerator, denominator, raw_value, data_release_year)
+            VALUES ('CA', 'Second County', '003', 'Violent crime rate', '300', '1000', '30.0', '2021'),
+                   ('CA', 'Third County', '005', 'Violent crime rate', '', '', '20.0', '2021'),
+                   ('CA', 'Fourth County', '007', 'Violent crime rate', '50', '1000', '', '2021'),
+                   ('CA', 'Test County', '001', 'Violent crime rate', '1', '1', '99.0', '2020')
+        ''')
+        # State and national rollup rows are not counties and stay out of every group
+        conn.execute('''
+            INSERT INTO county_health_rankings
+            (state, county, county_code, fipscode, measure_name, numerator, denominator, raw_value,
+             data_release_year)
+            VALUES ('CA', 'California', '000', '06000', 'Violent crime rate', '350', '3000', '0.5', '2021'),
+                   ('US', 'United States', '000', '00000', 'Violent crime rate', '900', '9000', '0.4', '2021')
+        ''')
+        conn.execute("INSERT INTO zip_county VALUES ('12345', '003', 'CA')")
+        conn.commit()
+        conn.close()
+        original_database = self.app.config['DATABASE']
+        self.app.config['DATABASE'] = self.test_db_path
+
+        def aggregate(data):
+            api.index.response_cache.clear()
+            return self.client.post('/county_data/aggregate', data=json.dumps(data),
+                                    content_type='application/json')
+
+        request = {'measure_name': 'Violent crime rate', 'data_release_year': 2021}
+        try:
+            response = aggregate(request)
+            self.assertEqual(response.status_code, 200)
+            data = json.loads(response.data)
+            self.assertEqual(data['data_release_year'], 2021)
+            self.assertEqual(len(data['groups']), 1)
+            group = data['groups'][0]
+            self.assertEqual((group['group'], group['rows'], group['counties']), ('CA', 4, 4))
+            # Only rows with both a numerator and a positive denominator are weighted
+            self.assertEqual((group['numerator'], group['denominator']), (450.0, 3000.0))
+            self.assertAlmostEqual(group['weighted_rate'], 0.15)
+            self.assertEqual(group['raw_value'], {
+                'count': 3, 'min': 10.0, 'max': 30.0, 'mean': 20.0,
+                'p25': 10.0, 'p50': 20.0, 'p75': 30.0, 'p90': 30.0,
+            })
+
+            # The precomputed summary table answers the same rollup
+            conn = sqlite3.connect(self.test_db_path)
+            csv_to_sqlite.build_summary_table(conn.cursor())
+            conn.commit()
+            conn.close()
+            api.index.close_pool()
+            self.assertEqual(aggregate(request).data, response.data)
+            self.assertEqual(aggregate({**request, 'state': 'CA'}).data, response.data)
+            self.assertEqual(aggregate({**request, 'state': ['NY']}).status_code, 404)
+
+            selection = aggregate({**request, 'fipscodes': ['001', '003']})
+            group = json.loads(selection.data)['groups'][0]
+            self.assertEqual((group['group'], group['counties']), ('selection', 2))
+            self.assertEqual(group['raw_value']['p50'], 10.0)
+            by_zip = aggregate({**request, 'zips': ['12345']})
+            self.assertEqual(by_zip.data, selection.data)
+            self.assertEqual(aggregate({**request, 'data_release_year': '2020'}).status_code, 200)
+        finally:
+            api.index.close_pool()
+            self.app.config['DATABASE'] = original_database
+
+    def test_aggregate_request_errors(self):
+        """Test validation errors from /county_data/aggregate"""
+        base = {'measure_name': 'Unemployment', 'data_release_year': 2021}
+        test_cases = [
+            ({**base, 'coffee': 'teapot'}, 418),
+            ({'measure_name': 'Unemployment'}, 400),
+            ({**base, 'measure_name': 'Invalid'}, 400),
+            ({**base, 'data_release_year': '21'}, 400),
+            ({**base, 'data_release_year': True}, 400),
+            ({**base, 'state': 'california'}, 400),
+            ({**base, 'fipscodes': []}, 400),
+            ({**base, 'zips': ['1234']}, 400),
+            ({**base, 'state': 'CA', 'zips': ['12345']}, 400),
+            ({**base, 'fipscodes': ['001'] * 501}, 413),
+        ]
+        for data, status in test_cases:
+            with self.subTest(data=str(data)[:60]):
+                response = self.client.post('/county_data/aggregate',
+                                         data=json.dumps(data),
+                                         content_type='application/json')
+                self.assertEqual(response.status_code, status)
+
+    def test_release_options(self):
+        """Test latest, single-year and range lookups, with and without the latest_release table"""
+        import api.index
+        import csv_to_sqlite
+        conn = sqlite3.connect(self.test_db_path)
+        conn.execute('''
+            INSERT INTO county_health_rankings
+            (state, county, fipscode, year_span, measure_name, raw_value, data_release_year)
+            VALUES ('CA', 'Test County', '001', '2018-2019', 'Violent crime rate', '12.0', '2020'),
+                   ('CA', 'Test County', '001', '2017-2018', 'Violent crime rate', '14.0', '2019')
+        ''')
+        conn.commit()
+        conn.close()
+        original_database = self.app.config['DATABASE']
+        self.app.config['DATABASE'] = self.test_db_path
+
+        def lookup(release, measure_name='Violent crime rate'):
+            api.index.response_cache.clear()
+            return self.client.post('/county_data', content_type='application/json', data=json.dumps(
+                {'zip': '12345', 'measure_name': measure_name, 'release': release}))
+
+        try:
+            for latest_table in (False, True):
+                with self.subTest(latest_table=latest_table):
+                    if latest_table:
+                        conn = sqlite3.connect(self.test_db_path)
+                        csv_to_sqlite.build_latest_release_table(conn.cursor())
+                        conn.commit()
+                        conn.close()
+                        api.index.close_pool()
+                    rows = json.loads(lookup('latest').data)
+                    self.assertEqual([row['data_release_year'] for row in rows], ['2021'])
+                    profile = json.loads(lookup('latest', '*').data)
+                    measures = profile['counties'][0]['measures']
+                    self.assertEqual([row['data_release_year'] for row in measures['Violent crime rate']],
+                                     ['2021'])
+
+            rows = json.loads(lookup(2020).data)
+            self.assertEqual([row['raw_value'] for row in rows], ['12.0'])
+            self.assertEqual(lookup('2022').status_code, 404)
+
+            series = json.loads(lookup('2019-2020').data)
+            self.assertEqual(series['release'], '2019-2020')
+            self.assertEqual(len(series['counties']), 1)
+            county = series['counties'][0]
+            self.assertEqual((county['fipscode'], county['state']), ('001', 'CA'))
+            self.assertEqual(county['series']['data_release_year'], ['2019', '2020'])
+            self.assertEqual(county['series']['raw_value'], ['14.0', '12.0'])
+
+            response = self.client.get('/county_data?zip=12345&measure_name=Violent+crime+rate&release=latest')
+            self.assertEqual([row['data_release_year'] for row in response.get_json()], ['2021'])
+
+            for release, measure_name in (('newest', 'Violent crime rate'), ('2024-2018', 'Violent crime rate'),
+                                          (True, 'Violent crime rate'), ('2018-2024', '*')):
+                with self.subTest(release=release, measure_name=measure_name):
+                    self.assertEqual(lookup(release, measure_name).status_code, 400)
+        finally:
+            api.index.close_pool()
+            self.app.config['DATABASE'] = original_database
+
+    def test_ranks(self):
+        """Test state and national percentile ranks and z-scores from the ingest rank table"""
+        import api.index
+        import csv_to_sqlite
+        conn = sqlite3.connect(self.test_db_path)
+        conn.execute('''
+            INSERT INTO county_health_rankings
+            (state, county, county_code, fipscode, measure_name, raw_value, data_release_year)
+            VALUES ('CA', 'Second County', '003', '003', 'Violent crime rate', '30.0', '2021'),
+                   ('CA', 'Third County', '005', '005', 'Violent crime rate', '20.0', '2021'),
+                   ('CA', 'California', '000', '06000', 'Violent crime rate', '99.0', '2021'),
+                   ('NY', 'Another County', '002', '002', 'Violent crime rate', '40.0', '2021')
+        ''')
+        conn.commit()
+        conn.close()
+        original_database = self.app.config['DATABASE']
+        self.app.config['DATABASE'] = self.test_db_path
+
+        def lookup(measure_name='Violent crime rate', **options):
+            api.index.response_cache.clear()
+            return self.client.post('/county_data', content_type='application/json', data=json.dumps(
+                {'zip': '12345', 'measure_name': measure_name, 'ranks': True, **options}))
+
+        try:
+            # Without the rank table the fields are present but null
+            row = json.loads(lookup().data)[0]
+            self.assertEqual({column: row[column] for column in api.index.RANK_COLUMNS},
+                             dict.fromkeys(api.index.RANK_COLUMNS))
+
+            conn = sqlite3.connect(self.test_db_path)
+            csv_to_sqlite.build_rank_table(conn.cursor())
+            conn.commit()
+            conn.close()
+            api.index.close_pool()
+
+            row = json.loads(lookup().data)[0]
+            self.assertEqual(row['raw_value'], '10.0')
+            # The state rollup row (county_code 000) is not compared
+            self.assertEqual((row['state_percentile'], row['state_counties']), (0.0, 3))
+            self.assertAlmostEqual(row['state_z_score'], -10 / (200 / 3) ** 0.5)
+            self.assertEqual((row['national_percentile'], row['national_counties']), (0.0, 4))
+            self.assertAlmostEqual(row['national_z_score'], -15 / 125 ** 0.5)
+
+            profile = json.loads(lookup('*').data)
+            self.assertEqual(profile['counties'][0]['measures']['Violent crime rate'][0], row)
+            series = json.loads(lookup(release='2021-2021').data)['counties'][0]['series']
+            self.assertEqual(series['national_counties'], [4])
+            streamed = lookup(stream=True)
+            self.assertEqual(streamed.mimetype, 'application/x-ndjson')
+            self.assertEqual(json.loads(streamed.get_data(as_text=True)), row)
+            response = self.client.get('/county_data?zip=12345&measure_name=Violent+crime+rate&ranks=1')
+            self.assertEqual(response.get_json(), [row])
+
+            # A county alone in its partition has percentile 0 and no z-score
+            api.index.response_cache.clear()
+            other = self.client.post('/county_data', content_type='application/json', data=json.dumps(
+                {'zip': '54321', 'measure_name': 'Unemployment', 'ranks': True})).get_json()[0]
+            self.assertEqual((other['national_percentile'], other['national_z_score'],
+                              other['national_counties']), (0.0, None, 1))
+
+            api.index.response_cache.clear()
+            plain = self.client.post('/county_data', content_type='application/json', data=json.dumps(
+                {'zip': '12345', 'measure_name': 'Violent crime rate'})).get_json()[0]
+            self.assertNotIn('state_percentile', plain)
+
+            # The in-memory index takes its ranks from data.db
+            expected = [lookup().data, lookup('*').data, lookup(stream=True).get_data()]
+            self.app.config['SERVING_MODE'] = 'memory'
+            api.index.close_pool()
+            self.assertEqual([lookup().data, lookup('*').data, lookup(stream=True).get_data()], expected)
+        finally:
+            self.app.config['SERVING_MODE'] = 'sqlite'
+            api.index.close_pool()
+            self.app.config['DATABASE'] = original_database
+
+    def test_streaming_ndjson(self):
+        """Test NDJSON streaming via the stream flag and the Accept header"""
+        import api.index
+        original_database = self.app.config['DATABASE']
+        self.app.config['DATABASE'] = self.test_db_path
+        try:
+            requests = [
+                ({'zip': '12345', 'measure_name': 'Violent crime rate', 'stream': True}, {}),
+                ({'zip': '12345', 'measure_name': 'Violent crime rate'}, {'Accept': 'application/x-ndjson'}),
+            ]
+            for data, headers in requests:
+                with self.subTest(data=data, headers=headers):
+                    response = self.client.post('/county_data',
+                                             data=json.dumps(data),
+                                             content_type='application/json',
+                                             headers=headers)
+                    self.assertEqual(response.status_code, 200)
+                    self.assertEqual(response.mimetype, 'application/x-ndjson')
+                    lines = response.get_data(as_text=True).splitlines()
+                    self.assertEqual(len(lines), 1)
+                    self.assertEqual(json.loads(lines[0])['county'], 'Test County')
+                    response.close()
+
+            response = self.client.post('/county_data',
+                                     data=json.dumps({'zip': '99999', 'measure_name': 'Unemployment', 'stream': True}),
+                                     content_type='application/json')
+            self.assertEqual(response.status_code, 404)
+
+            # Every streamed response returned its connection to the pool
+            stats = self.client.get('/stats').get_json()['pool']
+            self.assertEqual(stats['idle'], stats['open'])
+        finally:
+            api.index.close_pool()
+            self.app.config['DATABASE'] = original_database
+
+    def test_row_encoder_matches_jsonify(self):
+        """Test that encoded rows are byte-identical to jsonify and app.json.dumps output"""
+        import api.index
+        from api.index import RESULT_COLUMNS, RowEncoder
+        base = ('CA', 'Test County', '06', '001', '2020-2021', 'Violent crime rate', 1,
+                100, 1000.0, 0.1, 8.0, 12.0, 2021, '06001')
+        rows = [
+            base,
+            base[:7] + (None, None, None, None, None) + base[12:],
+            base[:1] + ('Doña Ana "quoted" \\ {x} %s\n',) + base[2:],
+            base[:7] + (12345678901234567890, 1e16, 1e-05, -0.0, 2.5e-300) + base[12:],
+            base[:7] + (True, False, float('inf'), float('-inf'), float('nan')) + base[12:],
+            tuple(str(value) for value in base),
+        ]
+        with self.app.app_context():
+            self.assertEqual(api.index.rows_response(rows).get_data(),
+                             jsonify([dict(zip(RESULT_COLUMNS, row)) for row in rows]).get_data())
+            encoder = RowEncoder(RESULT_COLUMNS, ", ", ": ")
+            for row in rows:
+                with self.subTest(row=row[7:12]):
+                    self.assertEqual(encoder.encode(row),
+                                     self.app.json.dumps(dict(zip(RESULT_COLUMNS, row))))
+
+    def test_profile_all_measures(self):
+        """Test that '*' or a list of measures returns a grouped profile"""
+        import api.index
+        conn = sqlite3.connect(self.test_db_path)
+        conn.execute('''
+            INSERT INTO county_health_rankings
+            (state, county, state_code, county_code, year_span, measure_name,
+             measure_id, numerator, denominator, raw_value,
+             confidence_interval_lower_bound, confidence_interval_upper_bound,
+             data_release_year, fipscode)
+            VALUES ('CA', 'Test County', '06', '001', '2021', 'Uninsured',
+                    '85', '5', '100', '0.05', '0.04', '0.06', '2021', '001')
+        ''')
+        conn.commit()
+        conn.close()
+
+        original_database = self.app.config['DATABASE']
+        self.app.config['DATABASE'] = self.test_db_path
+        try:
+            for measure_name in ['*', ['Uninsured', 'Violent crime rate', 'Unemployment']]:
+                with self.subTest(measure_name=measure_name):
+                    response = self.client.post('/county_data',
+                                             data=json.dumps({'zip': '12345', 'measure_name': measure_name}),
+                                             content_type='application/json')
+                    self.assertEqual(response.status_code, 200)
+                    profile = response.get_json()
+                    self.assertEqual(profile['zip'], '12345')
+                    self.assertEqual(len(profile['counties']), 1)
+                    county = profile['counties'][0]
+                    self.assertEqual(county['county'], 'Test County')
+                    self.assertEqual(sorted(county['measures']), ['Uninsured', 'Violent crime rate'])
+                    self.assertEqual(county['measures']['Uninsured'][0]['raw_value'], '0.05')
+
+            response = self.client.post('/county_data',
+                                     data=json.dumps({'zip': '12345', 'measure_name': ['Uninsured', 'Invalid measure']}),
+                                     content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+            self.assertIn("'measure_name' is invalid", response.get_json()['error'])
+
+            response = self.client.post('/county_data',
+                                     data=json.dumps({'zip': '99999', 'measure_name': '*'}),
+                                     content_type='application/json')
+            self.assertEqual(response.status_code, 404)
+        finally:
+            api.index.close_pool()
+            self.app.config['DATABASE'] = original_database
+
+    def test_metrics_endpoint(self):
+        """Test Prometheus metrics for stages, statuses, pool and cache"""
+        import api.index
+        api.index.metrics.clear()
+        original_database = self.app.config['DATABASE']
+        self.app.config['DATABASE'] = self.test_db_path
+        try:
+            self.client.post('/county_data',
+                             data=json.dumps({'zip': '12345', 'measure_name': 'Violent crime rate'}),
+                             content_type='application/json')
+            self.client.post('/county_data',
+                             data=json.dumps({'zip': '1234', 'measure_name': 'Violent crime rate'}),
+                             content_type='application/json')
+
+            response = self.client.get('/metrics')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.mimetype, 'text/plain')
+            text = response.get_data(as_text=True)
+            self.assertIn('county_requests_total{endpoint="county_data",status="200"} 1', text)
+            self.assertIn('county_requests_total{endpoint="county_data",status="400"} 1', text)
+            for stage in ('parse_json', 'validate', 'cache', 'connection', 'query', 'serialize'):
+                self.assertIn(f'county_request_stage_seconds_count{{endpoint="county_data",stage="{stage}"}}', text)
+            self.assertIn('county_request_measure_seconds_count{endpoint="county_data",'
+                          'measure_name="Violent crime rate"} 1', text)
+            self.assertIn('county_sql_statement_seconds_count{statement="county_lookup"} 1', text)
+            self.assertIn('county_db_pool_hits', text)
+            self.assertIn('county_response_cache_misses', text)
+            self.assertIn('# TYPE county_request_seconds histogram', text)
+            self.assertIn('# TYPE county_requests_total counter', text)
+            self.assertIn('# HELP county_db_pool_hits ', text)
+            self.assertIn('# TYPE county_db_pool_hits gauge', text)
+            # Scrapes are not counted as requests
+            text = self.client.get('/metrics').get_data(as_text=True)
+            self.assertNotIn('endpoint="metrics', text)
+        finally:
+            api.index.close_pool()
+            self.app.config['DATABASE'] = original_database
+
+    def test_admission_control(self):
+        """Test 429s from per-client token buckets and 503s from the in-flight bound"""
+        import api.index
+        admission = api.index.admission
+        original_database = self.app.config['DATABASE']
+        self.app.config['DATABASE'] = self.test_db_path
+        body = json.dumps({'zip': '12345', 'measure_name': 'Violent crime rate'})
+
+        def post(data=body, **headers):
+            return self.client.post('/county_data', data=data, content_type='application/json',
+                                    headers=headers)
+
+        try:
+            admission.rate, admission.burst = 0.5, 2
+            self.assertEqual([post().status_code for _ in range(3)], [200, 200, 429])
+            limited = post()
+            self.assertEqual(limited.get_json(), {'error': 'Rate limit exceeded'})
+            self.assertEqual(limited.headers['Retry-After'], '2')
+            # Unknown keys share the address's bucket; configured keys get their own
+            self.assertEqual([post(**{'X-API-Key': f'made-up-{i}'}).status_code for i in range(3)],
+                             [429] * 3)
+            self.app.config['API_KEYS'] = frozenset({'analyst'})
+            self.assertEqual(post(**{'X-API-Key': 'analyst'}).status_code, 200)
+            # /stats is never limited
+            self.assertEqual(self.client.get('/stats').status_code, 200)
+            admission.rate = 0
+
+            # Streams other tests left unclosed still hold slots
+            idle_in_flight = admission.stats()['in_flight']
+            admission.max_in_flight = 1 + idle_in_flight
+            self.assertTrue(admission.acquire())
+            busy = post(data='not json')
+            self.assertEqual(busy.status_code, 503)
+            self.assertEqual(busy.headers['Retry-After'], '1')
+            admission.release()
+            self.assertEqual(post().status_code, 200)
+
+            # An open NDJSON stream holds its slot until the server closes it
+            stream = self.client.post('/county_data', content_type='application/json', data=json.dumps(
+                {'zip': '12345', 'measure_name': 'Violent crime rate', 'stream': True}))
+            self.assertEqual(admission.stats()['in_flight'], 1 + idle_in_flight)
+            self.assertEqual(post().status_code, 503)
+            stream.close()
+            self.assertEqual(post().status_code, 200)
+
+            stats = self.client.get('/stats').get_json()['admission']
+            self.assertEqual((stats['in_flight'], stats['rejected_rate_limit'], stats['rejected_busy']),
+                             (idle_in_flight, 5, 2))
+            metrics_text = self.client.get('/metrics').get_data(as_text=True)
+            self.assertIn('county_admission_rejections_total{reason="busy"} 2', metrics_text)
+            self.assertIn('county_admission_rejected_busy 2', metrics_text)
+        finally:
+            self.app.config['API_KEYS'] = frozenset()
+            admission.rate = 0
+            admission.max_in_flight = 0
+            admission.clear()
+            api.index.metrics.clear()
+            api.index.close_pool()
+            self.app.config['DATABASE'] = original_database
+
+    def test_slow_query_log(self):
+        """Test that lookups above SLOW_QUERY_MS are logged with their query plan"""
+        import api.index
+        original_database = self.app.config['DATABASE']
+        self.app.config['DATABASE'] = self.test_db_path
+        self.app.config['SLOW_QUERY_MS'] = 1e-9
+        try:
+            with self.assertLogs(self.app.logger, level='WARNING') as logs:
+                self.client.post('/county_data',
+                                 data=json.dumps({'zip': '12345', 'measure_name': 'Violent crime rate'}),
+                                 content_type='application/json')
+            self.assertEqual(len(logs.output), 1)
+            self.assertIn('zip=12345 measure_name=Violent crime rate', logs.output[0])
+            self.assertIn('plan=', logs.output[0])
+        finally:
+            api.index.close_pool()
+            self.app.config['SLOW_QUERY_MS'] = 0
+            self.app.config['DATABASE'] = original_database
+
+    def assert_serves_like_sqlite(self, serving_mode, **config):
+        """Replay lookups under serving_mode and compare them with SQLite responses"""
+        import api.index
+        original_database = self.app.config['DATABASE']
+        self.app.config['DATABASE'] = self.test_db_path
+        try:
+            requests = [
+                ('/county_data', {'zip': '12345', 'measure_name': 'Violent crime rate'}),
+                ('/county_data', {'zip': '54321', 'measure_name': '*'}),
+                ('/county_data', {'zip': '99999', 'measure_name': 'Unemployment'}),
+                ('/county_data', {'zip': '12345', 'measure_name': 'Violent crime rate', 'stream': True}),
+                ('/county_data/batch', {'zips': ['12345', '54321'], 'measure_names': ['Unemployment']}),
+                ('/county_data', {'zip': '12345', 'measure_name': 'Violent crime rate', 'release': 'latest'}),
+                ('/county_data', {'zip': '54321', 'measure_name': '*', 'release': 2020}),
+                ('/county_data', {'zip': '12345', 'measure_name': 'Violent crime rate', 'release': '2018-2024'}),
+            ]
+            expected = []
+            for path, data in requests:
+                api.index.response_cache.clear()
+                response = self.client.post(path, data=json.dumps(data), content_type='application/json')
+                expected.append((response.status_code, response.get_data()))
+
+            self.app.config.update(config, SERVING_MODE=serving_mode)
+            api.index.close_pool()
+            for (path, data), (status, body) in zip(requests, expected):
+                with self.subTest(path=path, data=data):
+                    api.index.response_cache.clear()
+                    response = self.client.post(path, data=json.dumps(data), content_type='application/json')
+                    self.assertEqual(response.status_code, status)
+                    self.assertEqual(response.get_data(), body)
+            return self.client.get('/stats').get_json()
+        finally:
+            self.app.config['SERVING_MODE'] = 'sqlite'
+            api.index.close_pool()
+            self.app.config['DATABASE'] = original_database
+
+    def test_memory_serving_mode(self):
+        """Test that SERVING_MODE=memory answers like SQLite without touching the pool"""
+        stats = self.assert_serves_like_sqlite('memory')
+        self.assertEqual(stats['lookup_index']['rows'], 2)
+        self.assertEqual(stats['lookup_index']['zips'], 2)
+        # Only the index load itself used a connection
+        self.assertEqual(stats['pool']['hits'] + stats['pool']['misses'], 1)
+
+    def test_snapshot_serving_mode(self):
+        """Test that SERVING_MODE=snapshot answers like SQLite from an mmapped snapshot"""
+        import csv_to_sqlite
+        snapshot_path = 'test_county_data.snapshot'
+        original_snapshot_path = self.app.config['SNAPSHOT_PATH']
+        conn = sqlite3.connect(self.test_db_path)
+        try:
+            csv_to_sqlite.export_snapshot(conn.cursor(), snapshot_path)
+            stats = self.assert_serves_like_sqlite('snapshot', SNAPSHOT_PATH=snapshot_path)
+            self.assertEqual(stats['lookup_index']['rows'], 2)
+            self.assertEqual(stats['lookup_index']['zips'], 2)
+            self.assertEqual(stats['pool']['hits'] + stats['pool']['misses'], 0)
+        finally:
+            conn.close()
+            self.app.config['SNAPSHOT_PATH'] = original_snapshot_path
+            if os.path.exists(snapshot_path):
+                os.remove(snapshot_path)
+
+    def test_snapshot_replacement_invalidates_cache(self):
+        """Test that cached lookups follow a replaced snapshot while data.db is unchanged"""
+        import api.index
+        import csv_to_sqlite
+        snapshot_path = 'test_county_data.snapshot'
+        original_snapshot_path = self.app.config['SNAPSHOT_PATH']
+        original_database = self.app.config['DATABASE']
+        body = json.dumps({'zip': '12345', 'measure_name': 'Violent crime rate'})
+
+        def raw_value():
+            response = self.client.post('/county_data', data=body, content_type='application/json')
+            return response.get_json()[0]['raw_value']
+
+        conn = sqlite3.connect(self.test_db_path)
+        try:
+            csv_to_sqlite.export_snapshot(conn.cursor(), snapshot_path)
+            self.app.config.update(DATABASE=self.test_db_path, SERVING_MODE='snapshot',
+                                   SNAPSHOT_PATH=snapshot_path)
+            self.assertEqual(raw_value(), '10.0')
+
+            # Export a changed snapshot without touching data.db
+            database_stat = os.stat(self.test_db_path)
+            conn.execute("UPDATE county_health_rankings SET raw_value = '10.55' WHERE fipscode = '001'")
+            csv_to_sqlite.export_snapshot(conn.cursor(), snapshot_path + '.new')
+            conn.rollback()
+            os.utime(self.test_db_path, ns=(database_stat.st_atime_ns, database_stat.st_mtime_ns))
+            os.replace(snapshot_path + '.new', snapshot_path)
+            self.assertEqual(raw_value(), '10.55')
+        finally:
+            conn.close()
+            self.app.config.update(DATABASE=original_database, SERVING_MODE='sqlite',
+                                   SNAPSHOT_PATH=original_snapshot_path)
+            api.index.close_pool()
+            for path in (snapshot_path, snapshot_path + '.new'):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def test_get_lookup(self):
+        """Test that GET with query parameters answers like POST"""
+        import api.index
+        original_database = self.app.config['DATABASE']
+        self.app.config['DATABASE'] = self.test_db_path
+        try:
+            cases = [
+                ('zip=12345&measure_name=Violent+crime+rate', {'zip': '12345', 'measure_name': 'Violent crime rate'}),
+                ('zip=54321&measure_name=*', {'zip': '54321', 'measure_name': '*'}),
+                ('zip=54321&measure_name=Unemployment&measure_name=Uninsured',
+                 {'zip': '54321', 'measure_name': ['Unemployment', 'Uninsured']}),
+                ('zip=99999&measure_name=Unemployment', {'zip': '99999', 'measure_name': 'Unemployment'}),
+                ('zip=1234&measure_name=Unemployment', {'zip': '1234', 'measure_name': 'Unemployment'}),
+                ('measure_name=Unemployment', {'measure_name': 'Unemployment'}),
+                ('coffee=teapot', {'coffee': 'teapot'}),
+            ]
+            for query, data in cases:
+                with self.subTest(query=query):
+                    api.index.response_cache.clear()
+                    expected = self.client.post('/county_data', data=json.dumps(data),
+                                                content_type='application/json')
+                    response = self.client.get(f'/county_data?{query}')
+                    self.assertEqual(response.status_code, expected.status_code)
+                    self.assertEqual(response.get_data(), expected.get_data())
+                    if response.status_code in (200, 404):
+                        self.assertIn('s-maxage=', response.headers['Cache-Control'])
+                        self.assertIsNotNone(response.headers.get('ETag'))
+                    else:
+                        self.assertIsNone(response.headers.get('ETag'))
+        finally:
+            api.index.close_pool()
+            self.app.config['DATABASE'] = original_database
+
+    def test_conditional_get(self):
+        """Test ETags from the metadata table and 304s that skip the database"""
+        import api.index
+        conn = sqlite3.connect(self.test_db_path)
+        conn.execute('CREATE TABLE metadata (key TEXT PRIMARY KEY, value TEXT)')
+        conn.execute("INSERT INTO metadata VALUES ('data_version', 'v1'), "
+                     "('built_at', '2025-01-02T03:04:05+00:00')")
+        conn.commit()
+        conn.close()
+        original_database = self.app.config['DATABASE']
+        self.app.config['DATABASE'] = self.test_db_path
+        url = '/county_data?zip=12345&measure_name=Violent+crime+rate'
+        try:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.headers['ETag'], '"v1"')
+            self.assertEqual(response.headers['Last-Modified'], 'Thu, 02 Jan 2025 03:04:05 GMT')
+            self.assertIn('Accept', response.headers['Vary'])
+            streamed = self.client.get(url + '&stream=1')
+            self.assertEqual(streamed.headers['ETag'], '"v1-ndjson"')
+
+            before = api.index.get_pool().stats()
+            for headers in ({'If-None-Match': '"v1"'}, {'If-None-Match': 'W/"v1"'},
+                            {'If-Modified-Since': 'Thu, 02 Jan 2025 03:04:05 GMT'}):
+                with self.subTest(headers=headers):
+                    response = self.client.get(url, headers=headers)
+                    self.assertEqual(response.status_code, 304)
+                    self.assertEqual(response.get_data(), b'')
+            after = api.index.get_pool().stats()
+            self.assertEqual(after['hits'] + after['misses'], before['hits'] + before['misses'])
+
+            response = self.client.get(url, headers={'If-None-Match': '"v0"'})
+            self.assertEqual(response.status_code, 200)
+        finally:
+            api.index.close_pool()
+            self.app.config['DATABASE'] = original_database
+
     def test_non_json_request(self):
         """Test that non-JSON requests return HTTP 400 error"""
         response = self.client.post('/county_data',
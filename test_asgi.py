@@ -0,0 +1,165 @@
+import unittest
+import asyncio
+import json
+import os
+
+import test_api
+from api.index import app
+from api.asgi import AsgiApp
+
+
+def call_asgi(asgi_app, method, path, body=b'', headers=()):
+    """Send one HTTP request to an ASGI app and return (status, headers, body)"""
+    async def run():
+        request = [{'type': 'http.request', 'body': body, 'more_body': False}]
+        messages = []
+
+        async def receive():
+            return request.pop(0) if request else {'type': 'http.disconnect'}
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {
+            'type': 'http',
+            'http_version': '1.1',
+            'method': method,
+            'scheme': 'http',
+            'path': path,
+            'query_string': b'',
+            'root_path': '',
+            'headers': [(name.lower().encode(), value.encode()) for name, value in headers],
+            'client': ('127.0.0.1', 50000),
+            'server': ('127.0.0.1', 8000),
+        }
+        await asgi_app(scope, receive, send)
+        return messages
+
+    messages = asyncio.run(run())
+    start = messages[0]
+    headers = {name.decode(): value.decode() for name, value in start['headers']}
+    return start['status'], headers, b''.join(m.get('body', b'') for m in messages[1:])
+
+
+class TestAsgi(unittest.TestCase):
+    """Test that the ASGI entry point serves the same contract as the WSGI app"""
+
+    def setUp(self):
+        """Point the app at a test database and build an ASGI app over it"""
+        import api.index
+        self.test_db_path = 'test_data.db'
+        test_api.TestAPI.create_test_database(self)
+        self.original_database = app.config['DATABASE']
+        app.config['DATABASE'] = self.test_db_path
+        api.index.response_cache.clear()
+        self.client = app.test_client()
+        self.asgi_app = AsgiApp(app, max_workers=2, max_body_bytes=4096)
+
+    def tearDown(self):
+        """Restore the app configuration and clean up"""
+        import api.index
+        self.asgi_app.executor.shutdown()
+        api.index.close_pool()
+        app.config['DATABASE'] = self.original_database
+        if os.path.exists(self.test_db_path):
+            os.remove(self.test_db_path)
+
+    def test_matches_wsgi_responses(self):
+        """Test that status codes and bodies match the Flask test client"""
+        import api.index
+        requests = [
+            ('/county_data', {'zip': '12345', 'measure_name': 'Violent crime rate'}),
+            ('/county_data', {'zip': '99999', 'measure_name': 'Unemployment'}),
+            ('/county_data', {'zip': '1234', 'measure_name': 'Unemployment'}),
+            ('/county_data', {'zip': '12345'}),
+            ('/county_data', {'coffee': 'teapot'}),
+            ('/county_data', {'zip': '54321', 'measure_name': '*'}),
+            ('/county_data', {'zip': '12345', 'measure_name': 'Violent crime rate', 'stream': True}),
+            ('/county_data/batch', {'zips': ['12345', '54321'], 'measure_names': ['Unemployment']}),
+        ]
+        for path, data in requests:
+            with self.subTest(path=path, data=data):
+                body = json.dumps(data)
+                api.index.response_cache.clear()
+                expected = self.client.post(path, data=body, content_type='application/json')
+                api.index.response_cache.clear()
+                status, headers, content = call_asgi(
+                    self.asgi_app, 'POST', path, body.encode(),
+                    [('Content-Type', 'application/json'), ('Content-Length', str(len(body)))])
+                self.assertEqual(status, expected.status_code)
+                self.assertEqual(headers['content-type'], expected.content_type)
+                self.assertEqual(content, expected.get_data())
+
+    def test_non_json_and_unknown_routes(self):
+        """Test that non-JSON requests get 400 and unknown routes get 404"""
+        status, _, content = call_asgi(self.asgi_app, 'POST', '/county_data', b'not json',
+                                       [('Content-Type', 'text/plain')])
+        self.assertEqual(status, 400)
+        self.assertIn('Request must be JSON', json.loads(content)['error'])
+        status, _, _ = call_asgi(self.asgi_app, 'GET', '/missing')
+        self.assertEqual(status, 404)
+
+    def test_body_too_large(self):
+        """Test that oversized bodies are rejected before reaching the app"""
+        body = json.dumps({'zip': '12345', 'measure_name': 'x' * 5000}).encode()
+        status, _, content = call_asgi(self.asgi_app, 'POST', '/county_data', body,
+                                       [('Content-Type', 'application/json')])
+        self.assertEqual(status, 413)
+        self.assertEqual(json.loads(content), {'error': 'Request body too large'})
+
+    def test_client_disconnect_skips_app(self):
+        """Test that a request abandoned before its body arrives never reaches the app"""
+        calls = []
+
+        def wsgi_app(environ, start_response):
+            calls.append(environ)
+            return app(environ, start_response)
+
+        asgi_app = AsgiApp(wsgi_app, max_workers=1, max_body_bytes=4096)
+        messages = []
+        receive_messages = [{'type': 'http.request', 'body': b'{"zip": ', 'more_body': True},
+                            {'type': 'http.disconnect'}]
+
+        async def receive():
+            return receive_messages.pop(0)
+
+        async def send(message):
+            messages.append(message)
+
+        try:
+            asyncio.run(asgi_app({
+                'type': 'http', 'method': 'POST', 'path': '/county_data', 'query_string': b'',
+                'headers': [(b'content-type', b'application/json')],
+            }, receive, send))
+        finally:
+            asgi_app.executor.shutdown()
+        self.assertEqual((calls, messages), ([], []))
+
+    def test_concurrent_requests_share_bounded_pool(self):
+        """Test that many concurrent requests complete on a two-thread executor"""
+        body = json.dumps({'zip': '12345', 'measure_name': 'Violent crime rate'}).encode()
+
+        async def run():
+            async def one():
+                messages = []
+                request = [{'type': 'http.request', 'body': body, 'more_body': False}]
+
+                async def receive():
+                    return request.pop(0)
+
+                async def send(message):
+                    messages.append(message)
+
+                await self.asgi_app({
+                    'type': 'http', 'method': 'POST', 'path': '/county_data', 'query_string': b'',
+                    'headers': [(b'content-type', b'application/json')],
+                }, receive, send)
+                return messages[0]['status']
+            return await asyncio.gather(*(one() for _ in range(200)))
+
+        self.assertEqual(asyncio.run(run()), [200] * 200)
+        self.assertLessEqual(len(self.asgi_app.executor._threads), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
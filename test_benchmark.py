@@ -0,0 +1,105 @@
+import unittest
+import contextlib
+import importlib.util
+import io
+import os
+from argparse import Namespace
+
+import benchmark
+from api import index as api_index
+
+
+class TestBenchmark(unittest.TestCase):
+    """Smoke tests for the benchmark harness"""
+
+    def setUp(self):
+        """Generate a small synthetic database"""
+        self.test_db_path = 'test_bench.db'
+        self.original_database = api_index.app.config['DATABASE']
+        self.counts = benchmark.generate_database(self.test_db_path, zips=50, counties=20, releases=2)
+
+    def tearDown(self):
+        """Restore the app and clean up the database"""
+        api_index.close_pool()
+        api_index.response_cache.max_entries = api_index.app.config['RESPONSE_CACHE_MAX_ENTRIES']
+        api_index.app.config['DATABASE'] = self.original_database
+        api_index.app.config['SERVING_MODE'] = 'sqlite'
+        if os.path.exists(self.test_db_path):
+            os.remove(self.test_db_path)
+
+    def test_generate_database(self):
+        """Test that every county gets a row per allowed measure and release"""
+        self.assertGreaterEqual(self.counts['zip_county'], 50)
+        self.assertEqual(self.counts['county_health_rankings'], 20 * len(api_index.ALLOWED_MEASURES) * 2)
+
+    def test_run_reports_latency(self):
+        """Test that in-process and ASGI runs produce a complete JSON report"""
+        for mode in ('inprocess', 'asgi'):
+            with self.subTest(mode=mode):
+                args = Namespace(db=self.test_db_path, requests=None, endpoint='/county_data', mode=mode,
+                                 concurrency=2, count=60, warmup=5, cache=False, seed=1,
+                                 serving_mode='sqlite', snapshot=None, max_in_flight=None)
+                report = benchmark.run_benchmark(args)
+                self.assertEqual(report['requests'], 60)
+                self.assertEqual(sum(report['status_counts'].values()), 60)
+                self.assertIn('200', report['status_counts'])
+                for key in ('p50', 'p95', 'p99'):
+                    self.assertIsNotNone(report['latency_ms'][key])
+                self.assertGreater(report['peak_rss_kib'], 0)
+                self.assertEqual(report['admission']['admitted'], 60)
+
+    @unittest.skipUnless(importlib.util.find_spec('uvicorn'), 'uvicorn is not installed')
+    def test_run_asgi_over_http(self):
+        """Test that the ASGI entry point under uvicorn answers like the WSGI server"""
+        reports = {}
+        for mode in ('wsgi', 'asgi-http'):
+            args = Namespace(db=self.test_db_path, requests=None, endpoint='/county_data', mode=mode,
+                             concurrency=2, count=40, warmup=5, cache=False, seed=1,
+                             serving_mode='sqlite', snapshot=None, max_in_flight=None)
+            reports[mode] = benchmark.run_benchmark(args)
+        self.assertEqual(reports['asgi-http']['status_counts'], reports['wsgi']['status_counts'])
+        self.assertEqual(reports['asgi-http']['asgi_workers'], api_index.app.config['ASGI_WORKERS'])
+
+    def test_empty_requests_file(self):
+        """Test that a requests file with only blank lines is a usage error"""
+        requests_path = 'test_bench_requests.jsonl'
+        with open(requests_path, 'w', encoding='utf-8') as file:
+            file.write('\n  \n')
+        try:
+            with self.assertRaises(SystemExit), contextlib.redirect_stderr(io.StringIO()):
+                benchmark.parse_args(['run', '--db', self.test_db_path, '--requests', requests_path, '--count', '10'])
+        finally:
+            os.remove(requests_path)
+
+    def test_cold_start(self):
+        """Test that cold-start runs report a first lookup with and without prewarm"""
+        args = Namespace(db=self.test_db_path, runs=1, zip=None, measure_name='Adult obesity',
+                         serving_mode='sqlite', snapshot=None)
+        report = benchmark.run_cold_start(args)
+        for label in ('prewarm', 'no_prewarm'):
+            with self.subTest(label=label):
+                self.assertEqual(report[label]['status'], 200)
+                self.assertFalse(report[label]['templates_loaded'])
+                self.assertGreater(report[label]['time_to_first_response_ms']['p50'],
+                                   report[label]['first_request_ms']['p50'])
+        self.assertEqual(report['imports']['slowest'][0]['module'], 'flask')
+
+    def test_serialize(self):
+        """Test that the serialization micro-benchmark reports identical output and per-row costs"""
+        report = benchmark.run_serialize(Namespace(db=self.test_db_path, rows=10, iterations=5))
+        self.assertEqual(report['rows'], 10)
+        for name in ('array', 'ndjson'):
+            with self.subTest(name=name):
+                self.assertTrue(report[name]['identical'])
+                self.assertGreater(report[name]['per_row_us']['row_encoder'], 0)
+
+    def test_percentile(self):
+        """Test nearest-rank percentiles"""
+        values = list(range(1, 101))
+        self.assertEqual(benchmark.percentile(values, 0.50), 50)
+        self.assertEqual(benchmark.percentile(values, 0.99), 99)
+        self.assertIsNone(benchmark.percentile([], 0.5))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,216 @@
+import unittest
+import gzip
+import sqlite3
+import os
+from contextlib import redirect_stderr, redirect_stdout
+from io import StringIO
+
+import csv_to_sqlite
+
+
+class TestCsvToSqlite(unittest.TestCase):
+    """Test suite for the CSV ingest script"""
+
+    def setUp(self):
+        """Set up a database with untrimmed join keys"""
+        self.test_db_path = 'test_ingest.db'
+        self.conn = sqlite3.connect(self.test_db_path)
+        self.cursor = self.conn.cursor()
+        self.cursor.execute('CREATE TABLE zip_county (zip TEXT, county_code TEXT, state_abbreviation TEXT)')
+        self.cursor.execute(
+            'CREATE TABLE county_health_rankings ({})'.format(
+                ', '.join(f'{col} TEXT' for col in csv_to_sqlite.SERVING_COLUMNS)
+            )
+        )
+        self.cursor.execute(
+            "INSERT INTO zip_county VALUES ('12345', ' 06001 ', 'CA'), ('54321', '36002', 'NY')"
+        )
+        self.cursor.execute(
+            "INSERT INTO county_health_rankings VALUES "
+            "('CA', 'Test County', '06', '001', '2020-2021', 'Violent crime rate', "
+            "'1', '100', '1000', '10.0', '8.0', '12.0', '2021', '06001 ')"
+        )
+
+    def tearDown(self):
+        """Clean up test database"""
+        self.conn.close()
+        if os.path.exists(self.test_db_path):
+            os.remove(self.test_db_path)
+
+    def build(self, **kwargs):
+        """Run build_serving_tables, capturing its query plan output"""
+        output = StringIO()
+        with redirect_stdout(output):
+            csv_to_sqlite.build_serving_tables(self.cursor, **kwargs)
+        return output.getvalue()
+
+    def test_build_serving_tables_normalizes_and_indexes(self):
+        """Test that join keys are trimmed and lookup indexes are created"""
+        output = self.build()
+        self.assertIn('Query plan before', output)
+        self.assertIn('Query plan after', output)
+
+        self.cursor.execute("SELECT county_code FROM zip_county WHERE zip = '12345'")
+        self.assertEqual(self.cursor.fetchone()[0], '06001')
+        self.cursor.execute('SELECT fipscode FROM county_health_rankings')
+        self.assertEqual(self.cursor.fetchone()[0], '06001')
+
+        self.cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index'")
+        indexes = {row[0] for row in self.cursor.fetchall()}
+        self.assertIn('idx_zip_county_zip', indexes)
+        self.assertIn('idx_chr_fipscode_measure_release', indexes)
+        self.assertFalse(csv_to_sqlite.table_exists(self.cursor, csv_to_sqlite.LOOKUP_TABLE))
+
+        self.cursor.execute(f'SELECT * FROM {csv_to_sqlite.LATEST_RELEASE_TABLE}')
+        self.assertEqual(self.cursor.fetchall(), [('06001', 'CA', 'Violent crime rate', '2021')])
+
+        self.cursor.execute(f'SELECT * FROM {csv_to_sqlite.RANK_TABLE}')
+        self.assertEqual(self.cursor.fetchall(),
+                         [('06001', 'CA', 'Violent crime rate', '2021', 10.0, 0.0, None, 1, 0.0, None, 1)])
+
+    def test_build_serving_tables_materialize(self):
+        """Test that the denormalized lookup table holds the joined rows"""
+        self.build(materialize=True)
+        self.cursor.execute(
+            f"SELECT zip, county, fipscode FROM {csv_to_sqlite.LOOKUP_TABLE} "
+            "WHERE zip = ? AND measure_name = ?",
+            ('12345', 'Violent crime rate'),
+        )
+        self.assertEqual(self.cursor.fetchall(), [('12345', 'Test County', '06001')])
+
+    def load(self, csv_path, table_name, **kwargs):
+        """Run load_csv_sources on one CSV, capturing its progress output"""
+        with redirect_stdout(StringIO()):
+            return csv_to_sqlite.load_csv_sources(self.cursor, [(csv_path, table_name)], **kwargs)
+
+    def test_load_csv_sources_batches(self):
+        """Test that rows are inserted across batches and short rows are padded"""
+        csv_path = 'test_ingest.csv'
+        with open(csv_path, 'w', newline='', encoding='utf-8') as file:
+            file.write('a,b\n1,x\n2,y\n3\n')
+        try:
+            stats = self.load(csv_path, 'sample', batch_size=2)
+            self.assertEqual(stats[0]['rows'], 3)
+            self.cursor.execute('SELECT a, b FROM sample ORDER BY a')
+            self.assertEqual(self.cursor.fetchall(), [(1, 'x'), (2, 'y'), (3, None)])
+        finally:
+            os.remove(csv_path)
+
+    def test_load_csv_sources_infers_types(self):
+        """Test INTEGER/REAL/TEXT inference, leading zeros and overrides"""
+        csv_path = 'test_ingest.csv'
+        with open(csv_path, 'w', newline='', encoding='utf-8') as file:
+            file.write('year,rate,code,name,empty,fipscode\n')
+            file.write('2021,10.5,007,Test,,01001\n')
+            file.write('2022,,12,Other,,02002\n')
+        try:
+            self.load(csv_path, 'sample', type_overrides={'year': 'TEXT'})
+        finally:
+            os.remove(csv_path)
+        self.assertEqual(csv_to_sqlite.table_columns(self.cursor, 'sample'), {
+            'year': 'TEXT',
+            'rate': 'REAL',
+            'code': 'TEXT',
+            'name': 'TEXT',
+            'empty': 'TEXT',
+            'fipscode': 'TEXT',
+        })
+
+    def test_load_csv_sources_typed(self):
+        """Test that typed columns store numbers and empty values as NULL"""
+        csv_path = 'test_ingest.csv'
+        with open(csv_path, 'w', newline='', encoding='utf-8') as file:
+            file.write('a,b,c\n1,2.5,01\n,,x\n')
+        try:
+            self.load(csv_path, 'sample', strict=True)
+            self.cursor.execute("SELECT sql FROM sqlite_master WHERE name = 'sample'")
+            self.assertEqual(self.cursor.fetchone()[0], 'CREATE TABLE sample (a INTEGER, b REAL, c TEXT) STRICT')
+            self.cursor.execute('SELECT a, b, c FROM sample ORDER BY rowid')
+            self.assertEqual(self.cursor.fetchall(), [(1, 2.5, '01'), (None, None, 'x')])
+        finally:
+            os.remove(csv_path)
+
+    def test_load_csv_sources(self):
+        """Test that chunked parallel and compressed loads match a serial load, including quoted newlines"""
+        csv_path = 'test_ingest.csv'
+        lines = ['a,b,c\n'] + [
+            f'{i},"line one\nline ""{i}""",{i / 4}\n' if i % 7 == 0 else f'{i},plain,{i / 4}\n'
+            for i in range(200)
+        ]
+        with open(csv_path, 'w', newline='', encoding='utf-8') as file:
+            file.writelines(lines)
+        with gzip.open(csv_path + '.gz', 'wt', newline='', encoding='utf-8') as file:
+            file.writelines(lines)
+        try:
+            self.load(csv_path, 'serial')
+            with open(csv_path, 'rb') as stream:
+                chunks = list(csv_to_sqlite.read_record_chunks(stream, chunk_bytes=64))
+            self.assertGreater(len(chunks), 10)
+            self.assertEqual(b''.join(chunks), ''.join(lines).encode('utf-8'))
+            with redirect_stdout(StringIO()):
+                stats = csv_to_sqlite.load_csv_sources(
+                    self.cursor, [(csv_path, 'parallel'), (csv_path + '.gz', 'compressed')],
+                    workers=2, chunk_bytes=64, batch_size=3)
+        finally:
+            os.remove(csv_path)
+            os.remove(csv_path + '.gz')
+        self.assertEqual([item['rows'] for item in stats], [200, 200])
+        self.assertEqual(
+            csv_to_sqlite.convert_csv_chunk(b'1\n2\n3\n', ['a'], {'a': 'INTEGER'}, batch_size=2),
+            [[(1,), (2,)], [(3,)]])
+        self.cursor.execute('SELECT a, b, c FROM serial ORDER BY rowid')
+        expected = self.cursor.fetchall()
+        self.assertEqual(expected[7], (7, 'line one\nline "7"', 1.75))
+        for table in ('parallel', 'compressed'):
+            self.cursor.execute(f'SELECT a, b, c FROM {table} ORDER BY rowid')
+            self.assertEqual(self.cursor.fetchall(), expected)
+
+    def test_upsert_csv_data(self):
+        """Test that an upsert inserts new keys, updates changed rows and counts unchanged ones"""
+        self.build()
+        csv_path = 'test_ingest.csv'
+        with open(csv_path, 'w', newline='', encoding='utf-8') as file:
+            file.write(','.join(csv_to_sqlite.SERVING_COLUMNS) + '\n')
+            file.write('CA,Test County,06,001,2020-2021,Violent crime rate,1,100,1000,11.0,8.0,12.0,2021, 06001\n')
+            file.write('CA,Test County,06,001,2020-2021,Unemployment,23,5,100,5.0,4.0,6.0,2021,06001\n')
+        key = ('fipscode', 'measure_name', 'year_span', 'data_release_year')
+        try:
+            counts = csv_to_sqlite.upsert_csv_data(self.cursor, csv_path, 'county_health_rankings', key)
+            self.assertEqual(counts, (1, 1, 0))
+            counts = csv_to_sqlite.upsert_csv_data(self.cursor, csv_path, 'county_health_rankings', key)
+            self.assertEqual(counts, (0, 0, 2))
+        finally:
+            os.remove(csv_path)
+        self.cursor.execute('SELECT measure_name, raw_value, fipscode FROM county_health_rankings ORDER BY measure_name')
+        self.assertEqual(self.cursor.fetchall(),
+                         [('Unemployment', '5.0', '06001'), ('Violent crime rate', '11.0', '06001')])
+
+    def test_upsert_requires_existing_table(self):
+        """Test that --upsert-key into a table the database lacks is an error, not a fresh load"""
+        self.conn.commit()
+        csv_path = 'county_health_rankings_2025.csv'
+        with open(csv_path, 'w', encoding='utf-8') as file:
+            file.write(','.join(csv_to_sqlite.SERVING_COLUMNS) + '\n')
+        argv = [self.test_db_path, csv_path, '--upsert-key', 'fipscode,measure_name']
+        try:
+            with redirect_stderr(StringIO()) as errors, self.assertRaises(SystemExit):
+                csv_to_sqlite.parse_args(argv)
+            self.assertIn('has no county_health_rankings_2025 table', errors.getvalue())
+            args = csv_to_sqlite.parse_args(argv + ['--table', 'county_health_rankings'])
+            self.assertEqual(args.upsert_key, ('fipscode', 'measure_name'))
+        finally:
+            os.remove(csv_path)
+
+    def test_write_metadata(self):
+        """Test that every write records a new data version and build time"""
+        self.assertEqual(csv_to_sqlite.read_metadata(self.cursor), {})
+        first = csv_to_sqlite.write_metadata(self.cursor, ['zip_county.csv'])
+        second = csv_to_sqlite.write_metadata(self.cursor, ['zip_county.csv'])
+        self.assertNotEqual(first, second)
+        metadata = csv_to_sqlite.read_metadata(self.cursor)
+        self.assertEqual(metadata['data_version'], second)
+        self.assertTrue(metadata['built_at'].endswith('+00:00'))
+
+
+if __name__ == '__main__':
+    unittest.main()